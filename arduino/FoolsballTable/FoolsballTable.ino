@@ -15,6 +15,8 @@
 #define LEFT_SIDE 0
 #define RIGHT_SIDE 1
 
+#define GOAL_POST_ATTEMPTS 3
+
 byte mac[] = { 0xF0, 0x00, 0x55, 0xB0, 0x00, 0x11 };
 IPAddress ip(10, 4, 4, 200);
 char serverName[] = "riley";
@@ -25,6 +27,12 @@ const char pageNameIsGameOn[] = "/is_game_on";
 
 RestClient client = RestClient(serverName, serverPort);
 
+// Every goal gets the next sequence number, a retry sends the same one again so the server counts it once.
+// The boot id keeps the sequence numbers of a restarted board apart from the previous ones; the server only
+// compares them within a game, so a boot id that comes up again at worst drops goals of the game the board restarted in.
+unsigned long boot_id = 0;
+unsigned long goal_sequence = 0;
+
 unsigned long last_goal_time = 0;
 unsigned long last_game_on_check = 0;
 
@@ -46,6 +54,9 @@ void setup()
 */
 
   pinMode(BOARD_LIGHT, OUTPUT);
+
+  randomSeed(analogRead(0));
+  boot_id = random(2147483647L);
   
   unsigned long now = millis();
 
@@ -56,19 +67,24 @@ void setup()
 }
 
 void send_goal(int side) {
+  char page[80];
   String response = "";
-  int statusCode;
-  
-  if (side == LEFT_SIDE) {
-    statusCode = client.post(pageNameLeft, "", &response);
-  } else {
-    statusCode = client.post(pageNameRight, "", &response);
-  }
+  int statusCode = 0;
 
-  Serial.print("Status code from server: ");
-  Serial.println(statusCode);
-  Serial.print("Response body from server: ");
-  Serial.println(response);
+  goal_sequence++;
+  sprintf(page, "%s?device=%02X%02X%02X%02X%02X%02X-%lu&sequence=%lu",
+          (side == LEFT_SIDE) ? pageNameLeft : pageNameRight,
+          mac[0], mac[1], mac[2], mac[3], mac[4], mac[5], boot_id, goal_sequence);
+
+  for (int attempt = 0; attempt < GOAL_POST_ATTEMPTS && statusCode != 200; attempt++) {
+    response = "";
+    statusCode = client.post(page, "", &response);
+
+    Serial.print("Status code from server: ");
+    Serial.println(statusCode);
+    Serial.print("Response body from server: ");
+    Serial.println(response);
+  }
   
 }
 
@@ -0,0 +1,19 @@
+"""
+    Offline benchmarks of the database and page hot paths.
+
+    Generate a synthetic league, then time the operations against a copy of it:
+
+        python -m benchmarks.league --players 500 --games 100000 league.db
+        python -m benchmarks.run league.db --output results.json
+        python -m benchmarks.run league.db --baseline results.json
+
+    The batch Elo functions need no database:
+
+        python -m benchmarks.elo_batch --matchups 100000
+
+    Neither does matchmaking, which fails when the widest rating spread goes over its time budget:
+
+        python -m benchmarks.matchups --max-ms 50
+
+    Run them from the repository root, with the revision to measure checked out.
+"""
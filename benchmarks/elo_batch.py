@@ -0,0 +1,69 @@
+"""
+    The batch Elo functions against a loop over the scalar ones, checking they give the very same values.
+"""
+import argparse
+import random
+import time
+
+import config
+import elo
+
+
+def _matchups(count, rng):
+    # rating differences of two-player sides, as integers like most stored ratings and with decimals
+    diffs = [rng.randint(-600, 600) if i % 2 else rng.uniform(-600, 600) for i in xrange(count)]
+    score_percs = [rng.random() for _ in xrange(count)]
+    return diffs, score_percs
+
+
+def _best_of(repetitions, call):
+    seconds = []
+    for _ in range(repetitions):
+        started = time.time()
+        result = call()
+        seconds.append(time.time() - started)
+    return min(seconds), result
+
+
+def run(count, repetitions=5, seed=0):
+    """
+        Time every batch function and its scalar loop on count matchups, returns {name: (scalar s, batch s)}
+    """
+    diffs, score_percs = _matchups(count, random.Random(seed))
+    functions = [
+        ("wining_expectancy",
+         lambda: [elo.wining_expectancy(diff) for diff in diffs],
+         lambda: elo.wining_expectancies(diffs)),
+        ("rating_increment",
+         lambda: [elo.rating_increment(score_perc, diff) for score_perc, diff in zip(score_percs, diffs)],
+         lambda: elo.rating_increments(score_percs, diffs)),
+        ("predicted_score",
+         lambda: [elo.predicted_score(diff, config.GAME_GOAL_LIMIT) for diff in diffs],
+         lambda: zip(*elo.predicted_scores(diffs, config.GAME_GOAL_LIMIT))),
+    ]
+
+    results = {}
+    for name, scalar, batch in functions:
+        scalar_seconds, expected = _best_of(repetitions, scalar)
+        batch_seconds, values = _best_of(repetitions, batch)
+        if list(values) != expected:
+            raise AssertionError("{} batch values differ from the scalar ones".format(name))
+        results[name] = (scalar_seconds, batch_seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batch Elo functions")
+    parser.add_argument("--matchups", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5, help="calls of every function, the best one is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print "{} matchups, {}".format(args.matchups, "NumPy" if elo.vectorized else "pure Python fallback")
+    for name, (scalar_seconds, batch_seconds) in sorted(run(args.matchups, args.repeat, args.seed).items()):
+        print "{:<20}{:>10.2f} ms scalar {:>10.2f} ms batch {:>8.1f}x".format(
+            name, 1000 * scalar_seconds, 1000 * batch_seconds, scalar_seconds / batch_seconds if batch_seconds else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+    Synthetic leagues for the benchmarks, written straight into a foosball database.
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+from db_access import DBAccess
+import config
+import tools
+
+
+# (players, games) of the usual league sizes
+SIZES = {
+    "small": (50, 1000),
+    "medium": (500, 100000),
+    "large": (5000, 1000000),
+}
+
+_BATCH_SIZE = 10000
+
+
+def _remove_database(path):
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def _timestamps(games):
+    # one game every ten minutes, or closer together so the last one is not in the future
+    first = datetime.datetime.strptime(config.FIRST_TIMESTAMP, config.TIMESTAMP_FORMAT)
+    step = min(600.0, (datetime.datetime.now() - first).total_seconds() / max(games, 1))
+    for i in xrange(games):
+        yield (first + datetime.timedelta(seconds=int(i * step))).strftime(config.TIMESTAMP_FORMAT)
+
+
+def _fill(con, players, games, tables, hidden, rng):
+    cur = con.cursor()
+    photo = "/static/" + config.DEFAULT_IMAGE
+
+    cur.executemany("INSERT INTO players(player_id, name, photo) VALUES(?, ?, ?)",
+                    [(player_id, "player{}".format(player_id), photo) for player_id in xrange(1, players + 1)])
+    cur.executemany("INSERT INTO hidden_players(player_id) VALUES(?)",
+                    [(player_id,) for player_id in rng.sample(xrange(1, players + 1), int(players * hidden))])
+
+    # players keep to a circle of regulars, so teams repeat like in a real league
+    circle = min(players, 12)
+    teams = {}
+
+    def team(defense_player_id, attack_player_id):
+        key = (defense_player_id, attack_player_id)
+        if key not in teams:
+            teams[key] = len(teams) + 1
+        return teams[key]
+
+    timestamps = _timestamps(games)
+    for start in xrange(0, games, _BATCH_SIZE):
+        game_rows = []
+        goal_rows = []
+        for game_id in xrange(start + 1, min(start + _BATCH_SIZE, games) + 1):
+            first = rng.randint(1, players)
+            picked = set([first])
+            while len(picked) < min(4, players):
+                picked.add((first + rng.randint(1, circle) - 1) % players + 1)
+            picked = list(picked)
+            rng.shuffle(picked)
+
+            left_team_id = team(picked[0], picked[1 % len(picked)])
+            right_team_id = team(picked[2 % len(picked)], picked[3 % len(picked)])
+            scores = [config.GAME_GOAL_LIMIT, rng.randint(0, config.GAME_GOAL_LIMIT - 1)]
+            rng.shuffle(scores)
+            timestamp = next(timestamps)
+
+            game_rows.append((game_id, timestamp, left_team_id, right_team_id, scores[0], scores[1], 1, rng.randint(1, tables)))
+            goal_rows.extend((game_id, side, score, timestamp) for side, score in zip((config.LEFT, config.RIGHT), scores) if score)
+
+        cur.executemany("INSERT INTO games(game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id) " +
+                        "VALUES(?, ?, ?, ?, ?, ?, ?, ?)", game_rows)
+        cur.executemany("INSERT INTO goals(game_id, side, value, timestamp) VALUES(?, ?, ?, ?)", goal_rows)
+
+    cur.executemany("INSERT INTO teams(team_id, defense_player_id, attack_player_id) VALUES(?, ?, ?)",
+                    [(team_id, defense_player_id, attack_player_id) for (defense_player_id, attack_player_id), team_id in teams.items()])
+    con.commit()
+    return len(teams)
+
+
+def generate(path, players, games, tables=1, hidden=0.1, seed=0):
+    """
+        Write a league of players and ended games to a new database at path, with its stats and rankings.
+        The same arguments always give the same league. Returns a dict describing it.
+    """
+    _remove_database(path)
+    rng = random.Random(seed)
+
+    started = time.time()
+    db = DBAccess(database=path)
+    teams = db.pool.write(lambda: _fill(db.con, players, games, tables, hidden, rng))
+    db.recalculate_stats()
+    db.close()
+
+    return dict(players=players, games=games, teams=teams, tables=tables, hidden=hidden, seed=seed,
+                generated_at=tools.get_timestamp_for_now(), seconds=round(time.time() - started, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic foosball league")
+    parser.add_argument("path", help="database to create, an existing one is replaced")
+    parser.add_argument("--size", choices=sorted(SIZES), help="a usual (players, games) size")
+    parser.add_argument("--players", type=int, default=SIZES["small"][0])
+    parser.add_argument("--games", type=int, default=SIZES["small"][1])
+    parser.add_argument("--tables", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    players, games = SIZES[args.size] if args.size else (args.players, args.games)
+    league = generate(args.path, players=players, games=games, tables=args.tables, seed=args.seed)
+    print "{players} players, {teams} teams and {games} games in {seconds}s".format(**league)
+
+
+if __name__ == '__main__':
+    main()
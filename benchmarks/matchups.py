@@ -0,0 +1,73 @@
+"""
+    Matchmaking of a full table of players with ratings spread evenly around the initial one, up to the extreme spread
+    where the pruning has the least to work with, which has to stay under a time budget.
+"""
+import argparse
+import random
+import time
+
+import elo
+import matchmaking
+
+
+SPREADS = (0, 50, 200, 600, 1000)
+
+# best call with matchmaking.MAX_PLAYERS players rated up to the widest spread away from the initial rating
+MAX_MILLISECONDS = 50
+
+
+def _ratings(player_ids, spread, rng):
+    def rating():
+        return elo.INITIAL_RATING + rng.uniform(-spread, spread)
+
+    return matchmaking.Ratings(player=dict((player_id, rating()) for player_id in player_ids),
+                               attack=dict((player_id, rating()) for player_id in player_ids),
+                               defense=dict((player_id, rating()) for player_id in player_ids),
+                               team=dict(((defense_id, attack_id), rating()) for defense_id in player_ids for attack_id in player_ids
+                                         if defense_id != attack_id))
+
+
+def run(players=matchmaking.MAX_PLAYERS, spreads=SPREADS, leagues=5, repetitions=3, seed=0):
+    """
+        Time balanced_matchups on leagues of players at every spread, returns {spread: (median s, worst s)} of the
+        best of repetitions calls on each league
+    """
+    rng = random.Random(seed)
+    player_ids = range(1, players + 1)
+    results = {}
+    for spread in spreads:
+        seconds = []
+        for _ in range(leagues):
+            ratings = _ratings(player_ids, spread, rng)
+            calls = []
+            for _ in range(repetitions):
+                started = time.time()
+                matchmaking.balanced_matchups(player_ids, ratings)
+                calls.append(time.time() - started)
+            seconds.append(min(calls))
+        seconds.sort()
+        results[spread] = (seconds[len(seconds) // 2], seconds[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark matchmaking against the rating spread")
+    parser.add_argument("--players", type=int, default=matchmaking.MAX_PLAYERS)
+    parser.add_argument("--leagues", type=int, default=5, help="random leagues at every spread")
+    parser.add_argument("--repeat", type=int, default=3, help="calls on every league, the best one is kept")
+    parser.add_argument("--max-ms", type=float, default=MAX_MILLISECONDS, help="budget of the worst league at the widest spread")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.players, SPREADS, args.leagues, args.repeat, args.seed)
+    print "{} players".format(args.players)
+    for spread, (median_seconds, worst_seconds) in sorted(results.items()):
+        print "+/-{:<8}{:>10.2f} ms median {:>10.2f} ms worst".format(spread, 1000 * median_seconds, 1000 * worst_seconds)
+
+    worst_ms = 1000 * results[SPREADS[-1]][1]
+    if worst_ms > args.max_ms:
+        raise AssertionError("matchmaking took {:.2f} ms at +/-{}, over the {} ms budget".format(worst_ms, SPREADS[-1], args.max_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+    Time the hot paths against a copy of a league database.
+
+    Every operation runs in its own process so its peak memory is its own. Reported per operation: latency
+    percentiles, SQL statements executed per call and the peak resident memory.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from db_pool import ConnectionPool
+import config
+import metrics
+import tools
+
+
+class Context:
+    """
+        What the operations run against: the database, a Flask test client for the pages and a seeded random
+    """
+
+    def __init__(self, path, pages, seed):
+        self.rng = random.Random(seed)
+        if pages:
+            # foosball opens config.DBNAME as it is imported
+            config.DBNAME = path
+            import foosball
+            self.foosball = foosball
+            self.db = foosball.db
+            self.client = foosball.app.test_client()
+        else:
+            from db_access import DBAccess
+            self.db = DBAccess(database=path)
+
+    def timestamps(self, count):
+        cur = self.db.con.cursor()
+        cur.execute("SELECT MAX(game_id) FROM games")
+        max_game_id = cur.fetchone()[0] or 0
+        game_ids = [self.rng.randint(1, max_game_id) for _ in range(count)] if max_game_id else []
+        cur.execute("SELECT timestamp FROM games WHERE game_id IN ({})".format(", ".join("?" * len(game_ids))), game_ids)
+        return [timestamp for timestamp, in cur.fetchall()]
+
+    def new_game(self, left_score=0, right_score=0):
+        players = self.db.get_visible_players()
+        picked = self.rng.sample(players, 4)
+        left_team = self.db.create_team(defense_player=picked[0], attack_player=picked[1])
+        right_team = self.db.create_team(defense_player=picked[2], attack_player=picked[3])
+        return self.db.create_update_game(timestamp=tools.get_timestamp_for_now(), left_team=left_team, right_team=right_team,
+                                          left_score=left_score, right_score=right_score)
+
+
+# Each operation takes the Context and returns the call to time, whatever it needs is prepared untimed
+
+def _get_visible_players(context):
+    return context.db.get_visible_players
+
+
+def _get_all_games(context):
+    return context.db.get_all_games
+
+
+def _get_game_by_timestamp(context):
+    timestamp = context.rng.choice(context.timestamps(1) or [config.FIRST_TIMESTAMP])
+    return lambda: context.db.get_game_by_timestamp(timestamp)
+
+
+def _goal(context):
+    game = context.db.get_open_game()
+    if game is None or max(game.left_score, game.right_score) >= config.GAME_GOAL_LIMIT - 1:
+        context.new_game()
+    side = context.rng.choice((config.LEFT, config.RIGHT))
+    return lambda: context.db.goal(side=side)
+
+
+def _end_game(context):
+    game = context.new_game(left_score=context.rng.randint(0, config.GAME_GOAL_LIMIT - 1),
+                            right_score=context.rng.randint(0, config.GAME_GOAL_LIMIT - 1))
+    return lambda: context.db.end_game(game)
+
+
+def _recalculate_stats(context):
+    return context.db.recalculate_stats
+
+
+def _recalculate_stats_parallel(context):
+    return lambda: context.db.recalculate_stats(parallel=True)
+
+
+def _page(url):
+    def operation(context):
+        def render():
+            # the page itself, not the cached copy of it
+            context.foosball.view_cache.clear()
+            response = context.client.get(url)
+            assert response.status_code == 200, "{} answered {}".format(url, response.status_code)
+        return render
+    return operation
+
+
+# (name, operation, repetitions, warm up calls, needs the Flask app); reads first, as goal and end_game add games
+OPERATIONS = [
+    ("get_visible_players", _get_visible_players, 20, 1, False),
+    ("get_game_by_timestamp", _get_game_by_timestamp, 100, 1, False),
+    ("get_all_games", _get_all_games, 3, 1, False),
+    ("page_rankings", _page("/rankings"), 10, 1, True),
+    ("page_elo", _page("/elo"), 10, 1, True),
+    ("page_games", _page("/games"), 10, 1, True),
+    ("goal", _goal, 100, 1, False),
+    ("end_game", _end_game, 20, 0, False),
+    ("recalculate_stats", _recalculate_stats, 3, 0, False),
+    ("recalculate_stats_parallel", _recalculate_stats_parallel, 3, 0, False),
+]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _measure(path, operation, repetitions, warm_up, pages, seed):
+    ConnectionPool.connection_factory = metrics.MetricsConnection
+    context = Context(path, pages=pages, seed=seed)
+
+    for _ in range(warm_up):
+        operation(context)()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = []
+    queries = []
+    for _ in range(repetitions):
+        call = operation(context)
+        statements = metrics.SQL_STATEMENTS.value()
+        started = time.time()
+        call()
+        seconds.append(time.time() - started)
+        queries.append(metrics.SQL_STATEMENTS.value() - statements)
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    context.db.close()
+    return dict(repetitions=repetitions,
+                median_ms=round(1000 * _percentile(seconds, 0.5), 3),
+                p90_ms=round(1000 * _percentile(seconds, 0.9), 3),
+                min_ms=round(1000 * min(seconds), 3),
+                max_ms=round(1000 * max(seconds), 3),
+                queries=round(sum(queries) / float(len(queries)), 1),
+                peak_rss_kb=rss_peak,
+                rss_growth_kb=rss_peak - rss_before)
+
+
+def _measure_in_process(connection, *args):
+    try:
+        connection.send(_measure(*args))
+    except Exception, e:
+        connection.send(dict(error="{}: {}".format(type(e).__name__, e)))
+    finally:
+        connection.close()
+
+
+def measure(path, operation, repetitions, warm_up, pages, seed=0):
+    """
+        Run and time an operation in a new process, returns its results as a dict
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_measure_in_process, args=(sender, path, operation, repetitions, warm_up, pages, seed))
+    process.start()
+    sender.close()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def _revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _league(path):
+    con = sqlite3.connect(path)
+    counts = dict((table, con.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0])
+                  for table in ("players", "teams", "games", "goals", "stats"))
+    con.close()
+    return counts
+
+
+def run(path, names=None, repetitions=None, seed=0):
+    """
+        Measure the operations (all of OPERATIONS by default) against a copy of the database at path
+    """
+    work_dir = tempfile.mkdtemp(prefix="foosball-benchmark-")
+    work_path = os.path.join(work_dir, "FB.db")
+    shutil.copy(path, work_path)
+    try:
+        results = dict(revision=_revision(), python=platform.python_version(), sqlite=sqlite3.sqlite_version,
+                       timestamp=tools.get_timestamp_for_now(), league=_league(work_path), operations={})
+
+        for name, operation, default_repetitions, warm_up, pages in OPERATIONS:
+            if names and name not in names:
+                continue
+            results["operations"][name] = measure(work_path, operation, repetitions or default_repetitions, warm_up, pages, seed)
+            print _format_line(name, results["operations"][name])
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def _format_line(name, result, baseline=None):
+    if "error" in result:
+        return "{:<24}{}".format(name, result["error"])
+
+    line = "{:<24}{:>12.3f} ms {:>12.3f} ms p90 {:>8} queries {:>10} KB peak".format(
+        name, result["median_ms"], result["p90_ms"], result["queries"], result["peak_rss_kb"])
+    if baseline and "median_ms" in baseline:
+        line += "   {:+.0%} time, {:+} queries".format(result["median_ms"] / baseline["median_ms"] - 1 if baseline["median_ms"] else 0,
+                                                     result["queries"] - baseline["queries"])
+    return line
+
+
+def compare(results, baseline):
+    """
+        The results next to the ones of another run, one line per operation
+    """
+    print "against {} ({})".format(baseline.get("revision"), baseline.get("timestamp"))
+    for name in sorted(results["operations"]):
+        print _format_line(name, results["operations"][name], baseline["operations"].get(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the foosball hot paths against a league database")
+    parser.add_argument("path", help="league database, see benchmarks.league; it is copied and not changed")
+    parser.add_argument("--only", nargs="+", choices=[name for name, _, _, _, _ in OPERATIONS], help="operations to run")
+    parser.add_argument("--repeat", type=int, help="calls of every operation, instead of their defaults")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run(args.path, names=args.only, repetitions=args.repeat, seed=args.seed)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,8 +8,38 @@ LEFT = "left"
 GAME_GOAL_LIMIT = 10
 GAME_TIME_LIMIT = 30 * 60
 
+GAMES_PAGE_SIZE = 50
+
+# newest stats rows in the tables of the player and team pages, their charts load the rating history on their own
+PROFILE_STATS_ROWS = 50
+
+# matchups suggested by /matchmaking
+MATCHMAKING_RESULTS = 10
+
+# rows of the win probability matrix kept in memory, each one has a value per team
+WIN_PROBABILITY_ROWS = 100
+
+# tries of the goal queue to write a batch of goals, waiting GOAL_WRITE_RETRY_SECONDS times the tries so far in between
+GOAL_WRITE_ATTEMPTS = 5
+GOAL_WRITE_RETRY_SECONDS = 0.2
+
+# the table of the routes without a /tables/<table_id> prefix
+DEFAULT_TABLE_ID = 1
+
 DBNAME = "FB.db"
 
+# log the SQL statements taking at least this many seconds to SLOW_QUERY_LOG, None to not log them; see slow_queries.py
+SLOW_QUERY_SECONDS = None
+SLOW_QUERY_LOG = "slow_queries.log"
+
+# processes serving requests with tornado_main, sharing the database; 0 starts one per CPU
+WORKER_PROCESSES = 1
+
+# With several worker processes /metrics adds up the metrics of every worker, whichever one answers the scrape: each
+# saves its own in METRICS_DIRECTORY every METRICS_SAVE_SECONDS, so those of the others can be that many seconds old
+METRICS_DIRECTORY = "metrics"
+METRICS_SAVE_SECONDS = 5
+
 DEFAULT_IMAGE = 'img/pin.png'
 
 
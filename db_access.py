@@ -1,58 +1,392 @@
-from models import Player, Team, Game, Stats
+from models import Player, Team, Game, Stats, GoalEvent, Ranking
+
+import bisect
+import collections
+import functools
+import threading
 
 import tools
+import stats_replay
+import migrations
+import matchmaking
 import elo
-
-import sqlite3 as lite
+import metrics
+from db_pool import ConnectionPool
 
 import config
 
 
+STATS_COLUMNS = ("stats_id", "player_id", "attack_player_id", "defense_player_id", "team_id",
+                 "wins", "draws", "losses", "goals_pro", "goals_against", "elo_rating", "timestamp")
+
+
+def _stats_columns(alias):
+    return ", ".join("{alias}.{column}".format(alias=alias, column=column) for column in STATS_COLUMNS)
+
+
+def _stats_from_row(row):
+    """
+        Build a Stats object from the STATS_COLUMNS part of a joined row (None if the join found nothing)
+    """
+    if row[0] is None:
+        return None
+    return Stats(**dict(zip(STATS_COLUMNS, row)))
+
+
+def _stats_key(stats):
+    """
+        The (column, entity id) pair identifying whose stats these are
+    """
+    for column in (stats_replay.PLAYER, stats_replay.ATTACK, stats_replay.DEFENSE, stats_replay.TEAM):
+        if getattr(stats, column) is not None:
+            return column, getattr(stats, column)
+
+
+def _game_entities(replay_game):
+    """
+        The player_ids and team_ids whose stats a stats_replay game changes
+    """
+    return dict(player_ids=[replay_game.left_defense_id, replay_game.left_attack_id, replay_game.right_defense_id, replay_game.right_attack_id],
+                team_ids=[replay_game.left_team_id, replay_game.right_team_id])
+
+
+def _chunks(ids, size=500):
+    """
+        Split ids in chunks that fit in the SQLite host parameter limit of an IN (...) clause
+    """
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+
+def _marks(ids):
+    return ", ".join("?" * len(ids))
+
+
+PLAYER_RANKING = "player"
+ATTACK_RANKING = "attack"
+DEFENSE_RANKING = "defense"
+WIN_PERC_RANKING = "win_perc"
+TEAM_RANKING = "team"
+
+# (entity_id, value) of each leaderboard, visible players only; ties keep the lowest id first
+_VISIBLE_PLAYER_STATS = """FROM players p JOIN current_stats cs ON cs.{column} = p.player_id
+                           LEFT JOIN hidden_players h ON h.player_id = p.player_id
+                           WHERE h.player_id IS NULL"""
+PLAYER_BOARDS = (
+    (PLAYER_RANKING, "SELECT p.player_id, cs.elo_rating " + _VISIBLE_PLAYER_STATS.format(column="player_id")),
+    (ATTACK_RANKING, "SELECT p.player_id, cs.elo_rating " + _VISIBLE_PLAYER_STATS.format(column="attack_player_id")),
+    (DEFENSE_RANKING, "SELECT p.player_id, cs.elo_rating " + _VISIBLE_PLAYER_STATS.format(column="defense_player_id")),
+    (WIN_PERC_RANKING, "SELECT p.player_id, CASE WHEN cs.wins + cs.losses + cs.draws = 0 THEN 0.0 " +
+                       "ELSE cs.wins / CAST(cs.wins + cs.losses + cs.draws AS REAL) END " + _VISIBLE_PLAYER_STATS.format(column="player_id")),
+)
+TEAM_BOARDS = (
+    (TEAM_RANKING, "SELECT t.team_id, cs.elo_rating FROM teams t JOIN current_stats cs ON cs.team_id = t.team_id"),
+)
+RANKING_QUERIES = PLAYER_BOARDS + TEAM_BOARDS
+
+
+# Buckets of get_rating_history, by the expression grouping the stats timestamps; None keeps every stats row
+GAME_BUCKET = "game"
+HOUR_BUCKET = "hour"
+DAY_BUCKET = "day"
+WEEK_BUCKET = "week"
+MONTH_BUCKET = "month"
+HISTORY_BUCKETS = {
+    GAME_BUCKET: None,
+    HOUR_BUCKET: "substr(timestamp, 1, 13)",
+    DAY_BUCKET: "substr(timestamp, 1, 10)",
+    WEEK_BUCKET: "strftime('%Y-%W', timestamp)",
+    MONTH_BUCKET: "substr(timestamp, 1, 7)",
+}
+
+
+# What the goal fast path needs to know about the open game
+OpenGame = collections.namedtuple("OpenGame", ["game_id", "timestamp", "goal_limit", "deadline"])
+
+
+def _writes(method):
+    """
+        Run a DBAccess method on the writer thread, the calling thread waits for it. The outermost write method runs
+        in a single transaction with the check of data_version before it and the bump after it.
+    """
+    @functools.wraps(method)
+    def write(self, *args, **kwargs):
+        if self.pool.in_writer():
+            if self._writing:
+                return method(self, *args, **kwargs)
+
+            self._writing = True
+            self._changed_games = []
+            try:
+                result = self.pool.transaction(self._versioned_write, method, *args, **kwargs)
+            except Exception:
+                # rolled back, the writer caches may be ahead of the database
+                self._cached_version = None
+                raise
+            finally:
+                self._writing = False
+                changed_games, self._changed_games = self._changed_games, []
+            for game in changed_games:
+                self._game_changed(game)
+            return result
+        try:
+            return self.pool.write(metrics.carry(write), self, *args, **kwargs)
+        finally:
+            self._forget_loaded()
+    return write
+
+
 class DBAccess:
-    con = None
+    pool = None
+    _open_games = None
+    # writer thread state: inside a write method, and the data version the writer caches were filled at
+    _writing = False
+    _cached_version = None
+    _changed_games = ()
+    # writes committed by this process; shared is set in worker processes that share the database with others
+    _write_count = 0
+    shared = False
 
     def __init__(self, database):
-        self.con = lite.connect(database=database, check_same_thread=False)
+        self.pool = ConnectionPool(database=database)
+        # OpenGame by table_id, only used on the writer thread
+        self._open_games = {}
+        self._local = threading.local()
+        # called with the Game after each change of a score or ended flag is committed
+        self.game_listeners = []
         self._create_all_tables()
 
     def __del__(self):
-        if self.con:
-            self.con.close()
+        if self.pool:
+            self.pool.close()
 
-    def _create_all_tables(self):
+    def close(self):
+        """
+            Finish the queued writes and close the connections, before forking worker processes
+        """
+        self.pool.close()
+
+    def start(self):
+        """
+            Open new connections and a writer thread after close(), in each forked worker process
+        """
+        self.pool.start()
+        self._open_games = {}
+        self._cached_version = None
+        self._local = threading.local()
+
+    @property
+    def data_version(self):
+        """
+            Bumped by every write, of this or any other process using the database
+        """
         cur = self.con.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS players (player_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                                           name TEXT, photo TEXT,
-                                                           player_stats_id INT, attack_stats_id INT, defense_stats_id INT)""")
+        cur.execute("SELECT value FROM meta WHERE key = 'data_version'")
+        return cur.fetchone()[0]
 
-        cur.execute("CREATE TABLE IF NOT EXISTS teams (team_id INTEGER PRIMARY KEY AUTOINCREMENT, defense_player_id INT, attack_player_id INT, team_stats_id INT)")
-        cur.execute("CREATE TABLE IF NOT EXISTS games (game_id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, left_team_id INT, right_team_id INT, left_score INT, right_score INT, ended INT)")
+    @property
+    def change_version(self):
+        """
+            Changes with every write. Without other processes that is a counter of this process, read without
+            touching the database; with them it is data_version, read once per unit of work.
+        """
+        if not self.shared:
+            return self._write_count
+
+        version = getattr(self._local, "version", None)
+        if version is None:
+            version = self.data_version
+            if getattr(self._local, "identity_map", None) is not None:
+                self._local.version = version
+        return version
+
+    def _versioned_write(self, method, *args, **kwargs):
+        self._check_data_version()
+        result = method(self, *args, **kwargs)
+        self._bump_data_version()
+        return result
+
+    def _check_data_version(self):
+        # another worker process wrote since our last write, the open games it knows of may have changed
+        if self.data_version != self._cached_version:
+            self._open_games.clear()
+
+    def _bump_data_version(self):
+        with self.con:
+            self.con.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version'")
+        self._cached_version = self.data_version
+        self._write_count += 1
+
+    @property
+    def con(self):
+        """
+            The connection of the current thread, see ConnectionPool
+        """
+        return self.pool.connection()
 
-        cur.execute("""CREATE TABLE IF NOT EXISTS stats (stats_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                                player_id INT, attack_player_id INT, defense_player_id INT, team_id INT,
-                                                wins INT, draws INT, losses INT,
-                                                goals_pro INT, goals_against INT,
-                                                elo_rating NUMBER,
-                                                timestamp TEXT)
-            """)
+    def _create_all_tables(self):
+        # the schema comes first, the write methods keep data_version in it
+        if self.pool.write(lambda: migrations.migrate(self.con)):
+            self.recalculate_stats()
+        else:
+            self._refresh_rankings()
 
-        cur.execute("""CREATE TABLE IF NOT EXISTS hidden_players (player_id INTEGER)""")
+    @_writes
+    def _refresh_rankings(self):
+        with self.con:
+            self._update_rankings(keep_deltas=True)
 
-        self.con.commit()
+    def begin_request(self):
+        """
+            Start a unit of work for the current thread: until end_request each player, team and stats row is loaded once and shared
+        """
+        self._local.identity_map = dict(players={}, teams={}, stats={})
+        self._local.version = None
+
+    def end_request(self):
+        self._local.identity_map = None
+        self._local.version = None
+        self.pool.release()
+
+    def _identity(self, kind):
+        identity_map = getattr(self._local, "identity_map", None)
+        if identity_map is None:
+            # no unit of work, objects are only shared within a single call
+            return {}
+        return identity_map[kind]
+
+    def _forget_loaded(self):
+        """
+            Drop the loaded objects after a write, the next reads will load them again
+        """
+        if getattr(self._local, "identity_map", None) is not None:
+            self.begin_request()
+
+    def _game_changed(self, game):
+        if self._writing:
+            # once the transaction of the write is committed
+            self._changed_games.append(game)
+            return
+        for listener in self.game_listeners:
+            listener(game)
 
     def get_visible_players(self):
         return self.get_hidden_players(hidden=False)
 
     def get_hidden_players(self, hidden=True):
+        return self._get_players_with_stats(where="WHERE h.player_id IS {} NULL".format("NOT" if hidden else ""))
+
+    def _get_players_with_stats(self, where="", params=None):
+        """
+            Load players together with their player, attack and defense stats in a single query
+        """
         cur = self.con.cursor()
-        sql = """SELECT player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id FROM players
-                 WHERE player_id {} in (SELECT player_id from hidden_players)""".format("not" if not hidden else "")
-        cur.execute(sql)
-        all_players = list(cur.fetchall())
-        return [Player(player_id=player_id, name=name, photo=photo, player_stats=self.get_stats(player_stats_id), attack_stats=self.get_stats(attack_stats_id), defense_stats=self.get_stats(defense_stats_id))
-                        for player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id in all_players]
 
+        q = """ SELECT p.player_id, p.name, p.photo,
+                       {ps_columns}, {as_columns}, {ds_columns}
+                FROM players p
+                LEFT JOIN current_stats ps ON ps.player_id = p.player_id
+                LEFT JOIN current_stats as_ ON as_.attack_player_id = p.player_id
+                LEFT JOIN current_stats ds ON ds.defense_player_id = p.player_id
+                LEFT JOIN hidden_players h ON h.player_id = p.player_id
+                {where}
+                ORDER BY p.player_id
+            """.format(ps_columns=_stats_columns("ps"), as_columns=_stats_columns("as_"), ds_columns=_stats_columns("ds"), where=where)
+
+        cur.execute(q, params or {})
+
+        players = self._identity("players")
+        n = len(STATS_COLUMNS)
+        all_players = []
+        for row in cur.fetchall():
+            player = players.get(row[0])
+            if player is None:
+                player = Player(player_id=row[0], name=row[1], photo=row[2],
+                                player_stats=self._shared_stats(row[3:3+n]),
+                                attack_stats=self._shared_stats(row[3+n:3+2*n]),
+                                defense_stats=self._shared_stats(row[3+2*n:3+3*n]))
+                players[player.player_id] = player
+            all_players.append(player)
+        return all_players
+
+    def _shared_stats(self, row):
+        stats = _stats_from_row(row)
+        if stats is None:
+            return None
+        return self._identity("stats").setdefault(stats.stats_id, stats)
+
+    def _load_players(self, player_ids):
+        """
+            Get players by id, loading the ones not seen yet in this unit of work with batched IN (...) queries
+        """
+        players = self._identity("players")
+        missing = set(player_id for player_id in player_ids if player_id is not None and player_id not in players)
+        for chunk in _chunks(sorted(missing)):
+            for player in self._get_players_with_stats(where="WHERE p.player_id IN ({})".format(_marks(chunk)), params=chunk):
+                players[player.player_id] = player
+        return dict((player_id, players.get(player_id)) for player_id in player_ids)
+
+    def _load_stats(self, stats_ids):
+        """
+            Get stats by id, loading the ones not seen yet in this unit of work with batched IN (...) queries
+        """
+        stats = self._identity("stats")
+        missing = set(stats_id for stats_id in stats_ids if stats_id is not None and stats_id not in stats)
+        cur = self.con.cursor()
+        for chunk in _chunks(sorted(missing)):
+            cur.execute("SELECT {} FROM stats WHERE stats_id IN ({})".format(", ".join(STATS_COLUMNS), _marks(chunk)), chunk)
+            for row in cur.fetchall():
+                stats.setdefault(row[0], _stats_from_row(row))
+        return dict((stats_id, stats.get(stats_id)) for stats_id in stats_ids)
 
+    def _load_teams(self, team_ids):
+        """
+            Get teams by id, loading the ones not seen yet in this unit of work with batched IN (...) queries
+        """
+        teams = self._identity("teams")
+        missing = set(team_id for team_id in team_ids if team_id is not None and team_id not in teams)
+        rows = []
+        for chunk in _chunks(sorted(missing)):
+            rows.extend(self._get_team_rows(where="WHERE t.team_id IN ({})".format(_marks(chunk)), params=chunk))
+        self._teams_from_rows(rows, teams=teams)
+        return dict((team_id, teams.get(team_id)) for team_id in team_ids)
+
+    def _get_team_rows(self, where="", params=None):
+        """
+            (team_id, defense_player_id, attack_player_id) + STATS_COLUMNS rows of teams with their current stats
+        """
+        cur = self.con.cursor()
+        cur.execute(""" SELECT t.team_id, t.defense_player_id, t.attack_player_id, {cs_columns}
+                        FROM teams t
+                        LEFT JOIN current_stats cs ON cs.team_id = t.team_id
+                        {where}
+                        ORDER BY t.team_id
+                    """.format(cs_columns=_stats_columns("cs"), where=where), params or {})
+        return list(cur.fetchall())
+
+    def _teams_from_rows(self, rows, teams=None):
+        """
+            Build teams from _get_team_rows rows, reusing already loaded ones
+        """
+        if teams is None:
+            teams = self._identity("teams")
+        players = self._load_players([player_id for row in rows for player_id in (row[1], row[2])])
+        all_teams = []
+        for row in rows:
+            team_id, defense_player_id, attack_player_id = row[:3]
+            team = teams.get(team_id)
+            if team is None:
+                team = Team(team_id=team_id,
+                            defense_player=players[defense_player_id],
+                            attack_player=players[attack_player_id],
+                            team_stats=self._shared_stats(row[3:]))
+                teams[team_id] = team
+            all_teams.append(team)
+        return all_teams
+
+
+    @_writes
     def hide_player(self, player_name, hidden):
 
         player = self.get_player_by_name(name=player_name)
@@ -65,41 +399,25 @@ class DBAccess:
         elif not player_exists and hidden:
             cur.execute("INSERT INTO hidden_players(player_id) VALUES(:player_id)", dict(player_id=player.player_id))
 
+        self._update_rankings(keep_deltas=True, player_ids=[player.player_id])
         self.con.commit()
 
 
 
     def get_player_by_name(self, name):
-        cur = self.con.cursor()
-
-        player_dict = dict(name=name)
-
-        cur.execute("SELECT player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id FROM players WHERE name LIKE :name", player_dict)
-        player_exists = cur.fetchone()
-        if player_exists:
-            player_id, _, photo, player_stats_id, attack_stats_id, defense_stats_id = player_exists
-            return Player(player_id=player_id, name=name, photo=photo, player_stats=self.get_stats(player_stats_id), attack_stats=self.get_stats(attack_stats_id), defense_stats=self.get_stats(defense_stats_id))
+        players = self._get_players_with_stats(where="WHERE p.name = :name COLLATE NOCASE", params=dict(name=name))
+        if players:
+            return players[0]
         else:
             return None
 
     def get_player(self, player_id):
-        cur = self.con.cursor()
-
-        cur.execute("SELECT player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id  FROM players WHERE player_id = :player_id", dict(player_id=player_id))
-        player_exists = cur.fetchone()
-        if player_exists:
-            player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id = player_exists
-            return Player(player_id=player_id, name=name, photo=photo, player_stats=self.get_stats(player_stats_id), attack_stats=self.get_stats(attack_stats_id), defense_stats=self.get_stats(defense_stats_id))
-        else:
-            return None
+        return self._load_players([player_id])[player_id]
 
     def get_all_players(self):
-        cur = self.con.cursor()
-        cur.execute("SELECT player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id FROM players")
-        all_players = list(cur.fetchall())
-        return [Player(player_id=player_id, name=name, photo=photo, player_stats=self.get_stats(player_stats_id), attack_stats=self.get_stats(attack_stats_id), defense_stats=self.get_stats(defense_stats_id))
-                        for player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id in all_players]
+        return self._get_players_with_stats()
 
+    @_writes
     def create_player(self, name, photo):
         cur = self.con.cursor()
 
@@ -114,20 +432,13 @@ class DBAccess:
             player_stats = self.add_first_stats(player_id=player_id)
             attack_stats = self.add_first_stats(attack_player_id=player_id)
             defense_stats = self.add_first_stats(defense_player_id=player_id)
-
-            self.update_player_stats(player_id=player_id,
-                                     player_stats_id=player_stats.stats_id,
-                                     attack_stats_id=attack_stats.stats_id,
-                                     defense_stats_id=defense_stats.stats_id)
+            with self.con:
+                self._update_rankings(keep_deltas=True, player_ids=[player_id])
+            self._forget_loaded()
 
             return Player(player_id=player_id, name=name, photo=photo, player_stats=player_stats, attack_stats=attack_stats, defense_stats=defense_stats)
 
-    def update_player_stats(self, player_id, player_stats_id, attack_stats_id, defense_stats_id):
-        cur = self.con.cursor()
-        cur.execute("UPDATE players SET player_stats_id = :player_stats_id, attack_stats_id = :attack_stats_id, defense_stats_id = :defense_stats_id   WHERE player_id = :player_id",
-                    dict(player_id=player_id, player_stats_id=player_stats_id, attack_stats_id=attack_stats_id, defense_stats_id=defense_stats_id))
-        self.con.commit()
-
+    @_writes
     def edit_player(self, player_name, new_player_name, new_player_photo):
         cur = self.con.cursor()
 
@@ -138,11 +449,13 @@ class DBAccess:
             player_dict = dict(name=new_player_name, photo=new_player_photo, player_id=player.player_id)
             cur.execute("UPDATE players SET name = :name, photo = :photo WHERE player_id = :player_id", player_dict)
             self.con.commit()
+            self._forget_loaded()
 
             player.name = new_player_name
             player.photo = new_player_photo
             return player
 
+    @_writes
     def edit_player(self, player_name, new_player_name, new_player_photo):
         cur = self.con.cursor()
 
@@ -153,6 +466,7 @@ class DBAccess:
             player_dict = dict(name=new_player_name, photo=new_player_photo, player_id=player.player_id)
             cur.execute("UPDATE players SET name = :name, photo = :photo WHERE player_id = :player_id", player_dict)
             self.con.commit()
+            self._forget_loaded()
 
             player.name = new_player_name
             player.photo = new_player_photo
@@ -160,31 +474,13 @@ class DBAccess:
 
 
     def get_all_teams(self):
-        cur = self.con.cursor()
-        cur.execute("SELECT team_id, defense_player_id, attack_player_id, team_stats_id FROM teams")
-        self.con.commit()
-        all_teams = list(cur.fetchall())
-        return [Team(team_id=team_id,
-                     defense_player=self.get_player(player_id=defense_player_id),
-                     attack_player=self.get_player(player_id=attack_player_id),
-                     team_stats=self.get_stats(team_stats_id))
-                    for team_id, defense_player_id, attack_player_id, team_stats_id in all_teams]
+        return self._teams_from_rows(self._get_team_rows())
 
     def get_team(self, team_id):
-        cur = self.con.cursor()
-
-        cur.execute("SELECT team_id, defense_player_id, attack_player_id, team_stats_id FROM teams WHERE team_id = :team_id",
-                    dict(team_id=team_id))
-        team_exists = cur.fetchone()
-        if team_exists:
-            team_id, defense_player_id, attack_player_id, team_stats_id  = team_exists
-            return Team(team_id=team_id,
-                        defense_player=self.get_player(player_id=defense_player_id),
-                        attack_player=self.get_player(player_id=attack_player_id),
-                        team_stats=self.get_stats(team_stats_id))
-        else:
-            return None
+        team_id = int(team_id)
+        return self._load_teams([team_id])[team_id]
 
+    @_writes
     def create_team(self, defense_player, attack_player):
 
         cur = self.con.cursor()
@@ -192,12 +488,10 @@ class DBAccess:
         team_dict = dict(defense_player=defense_player, attack_player=attack_player)
         team_dict_sql = dict(defense_player_id=defense_player.player_id, attack_player_id=attack_player.player_id)
 
-        cur.execute(
-            "SELECT team_id, defense_player_id, attack_player_id, team_stats_id FROM teams WHERE defense_player_id=:defense_player_id AND attack_player_id=:attack_player_id", team_dict_sql)
-        team_exists = cur.fetchone()
-        if team_exists:
-            team_id, _, _, team_stats_id = team_exists
-            return Team(team_id=team_id, team_stats=self.get_stats(team_stats_id), **team_dict)
+        team_rows = self._get_team_rows(where="WHERE t.defense_player_id = :defense_player_id AND t.attack_player_id = :attack_player_id", params=team_dict_sql)
+        if team_rows:
+            team_id = team_rows[0][0]
+            return Team(team_id=team_id, team_stats=_stats_from_row(team_rows[0][3:]), **team_dict)
         else:
             cur.execute("INSERT INTO teams(defense_player_id, attack_player_id) VALUES(:defense_player_id, :attack_player_id)",
                         team_dict_sql)
@@ -205,50 +499,104 @@ class DBAccess:
             team_id = cur.lastrowid
 
             team_stats = self.add_first_stats(team_id=team_id)
+            with self.con:
+                self._update_rankings(keep_deltas=True, team_ids=[team_id])
+            self._forget_loaded()
 
-            self.update_team_stats(team_id=team_id, team_stats_id=team_stats.stats_id)
-            
             return Team(team_id=team_id, team_stats=team_stats, **team_dict)
 
 
-    def update_team_stats(self, team_id, team_stats_id):
-        cur = self.con.cursor()
-        cur.execute("UPDATE teams SET team_stats_id = :team_stats_id WHERE team_id = :team_id",
-                    dict(team_id=team_id, team_stats_id=team_stats_id))
-        self.con.commit()
-
-
     def get_all_games(self):
         cur = self.con.cursor()
         cur.execute(
-            "SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended FROM games ORDER BY TIMESTAMP DESC")
+            "SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id FROM games ORDER BY TIMESTAMP DESC")
+
+        return self._games_from_rows(list(cur.fetchall()))
 
-        all_games = list(cur.fetchall())
+    def _games_from_rows(self, rows):
+        teams = self._load_teams([team_id for _, _, left_team_id, right_team_id, _, _, _, _ in rows for team_id in (left_team_id, right_team_id)])
         return [Game(game_id=game_id, timestamp=timestamp,
-                     left_team=self.get_team(left_team_id), right_team=self.get_team(right_team_id),
-                     left_score=left_score, right_score=right_score, ended=ended)
-                for game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended in all_games]
+                     left_team=teams[left_team_id], right_team=teams[right_team_id],
+                     left_score=left_score, right_score=right_score, ended=ended, table_id=table_id)
+                for game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id in rows]
+
+    def get_games_page(self, before_timestamp=None, before_game_id=None, page_size=config.GAMES_PAGE_SIZE, player_id=None, team_id=None,
+                       table_id=None):
+        """
+            Get one page of games, newest first, older than the (before_timestamp, before_game_id) cursor.
+            Returns the games and the cursor of the next (older) page, or None if this is the last one.
+        """
+        cur = self.con.cursor()
 
+        conditions = []
+        params = dict(page_size=page_size + 1, before_timestamp=before_timestamp, before_game_id=before_game_id,
+                      player_id=player_id, team_id=team_id, table_id=table_id)
+
+        if before_timestamp is not None:
+            if before_game_id is not None:
+                conditions.append("(timestamp < :before_timestamp OR (timestamp = :before_timestamp AND game_id < :before_game_id))")
+            else:
+                conditions.append("timestamp < :before_timestamp")
+        if table_id is not None:
+            conditions.append("table_id = :table_id")
+        if team_id is not None:
+            conditions.append("(left_team_id = :team_id OR right_team_id = :team_id)")
+        if player_id is not None:
+            conditions.append("""(left_team_id IN (SELECT team_id FROM teams WHERE defense_player_id = :player_id OR attack_player_id = :player_id)
+                                  OR right_team_id IN (SELECT team_id FROM teams WHERE defense_player_id = :player_id OR attack_player_id = :player_id))""")
+
+        q = """ SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id
+                FROM games
+                {where}
+                ORDER BY timestamp DESC, game_id DESC
+                LIMIT :page_size
+            """.format(where=("WHERE " + " AND ".join(conditions)) if conditions else "")
+
+        cur.execute(q, params)
+        rows = list(cur.fetchall())
+
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            game_id, timestamp = rows[-1][0], rows[-1][1]
+            next_cursor = (timestamp, game_id)
+        else:
+            next_cursor = None
+
+        return self._games_from_rows(rows), next_cursor
+
+    @_writes
     def delete_game_by_timestamp(self, timestamp):
         cur = self.con.cursor()
+        cur.execute("SELECT ended FROM games WHERE timestamp=:timestamp", dict(timestamp=timestamp))
+        counted = any(ended for ended, in cur.fetchall())
+
+        cur.execute("DELETE FROM goals WHERE game_id IN (SELECT game_id FROM games WHERE timestamp=:timestamp)", dict(timestamp=timestamp))
         cur.execute("DELETE FROM games WHERE timestamp=:timestamp", dict(timestamp=timestamp))
         self.con.commit()
-        self.recalculate_stats()
+        self._open_games.clear()
+
+        # only ended games are in the stats
+        if counted:
+            self.recalculate_stats_from(timestamp)
 
 
 
 
-    def get_game_by_timestamp(self, timestamp):
+    def get_game_by_timestamp(self, timestamp, table_id=None):
+        """
+            The game started at timestamp, on any table unless table_id is given
+        """
         cur = self.con.cursor()
 
-        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended " +
-                    "FROM games WHERE timestamp=:timestamp", dict(timestamp=timestamp))
+        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id " +
+                    "FROM games WHERE timestamp=:timestamp AND (:table_id IS NULL OR table_id = :table_id)",
+                    dict(timestamp=timestamp, table_id=table_id))
         game_exists = cur.fetchone()
         if game_exists:
-            game_id, _, left_team_id, right_team_id, left_score, right_score, ended = game_exists
+            game_id, _, left_team_id, right_team_id, left_score, right_score, ended, table_id = game_exists
             game = Game(game_id=game_id, timestamp=timestamp,
                         left_team=self.get_team(left_team_id), right_team=self.get_team(right_team_id),
-                        left_score=left_score, right_score=right_score, ended=ended)
+                        left_score=left_score, right_score=right_score, ended=ended, table_id=table_id)
 
             if game.game_should_end():
                 self.end_game(game)
@@ -256,123 +604,282 @@ class DBAccess:
         else:
             return None
 
-    def create_update_game(self, timestamp, left_team, right_team, left_score=0, right_score=0, ended=0):
+    @_writes
+    def create_update_game(self, timestamp, left_team, right_team, left_score=0, right_score=0, ended=0, table_id=config.DEFAULT_TABLE_ID):
         cur = self.con.cursor()
         # todo: check some sort of upsert
 
+        previous_game = self.get_game_by_timestamp(timestamp=timestamp, table_id=table_id)
+        if not previous_game:
+            # the timestamp identifies a game in the pages, a game started at the same second on another table
+            # gets an earlier free one (a later one would be in the future for the game clock)
+            timestamp = self._free_timestamp(timestamp)
+
         game_dict = dict(timestamp=timestamp, left_team=left_team, right_team=right_team,
-                         left_score=left_score, right_score=right_score, ended=ended)
+                         left_score=left_score, right_score=right_score, ended=ended, table_id=table_id)
 
         game_dict_sql = dict(timestamp=timestamp, left_team_id=left_team.team_id, right_team_id=right_team.team_id,
-                         left_score=left_score, right_score=right_score, ended=ended)
+                         left_score=left_score, right_score=right_score, ended=ended, table_id=table_id)
 
-        previous_game = self.get_game_by_timestamp(timestamp=timestamp)
         if previous_game:
             cur.execute("UPDATE games SET timestamp = :timestamp, left_team_id = :left_team_id, right_team_id = :right_team_id, " +
                         "left_score = :left_score, right_score = :right_score, ended = :ended " +
                         "WHERE game_id = :game_id",
                         dict(game_id=previous_game.game_id, **game_dict_sql))
+            # the goals log has to add up to the edited score
+            self._log_goals(previous_game.game_id, left_score - previous_game.left_score, right_score - previous_game.right_score)
             self.con.commit()
+            self._open_games.pop(table_id, None)
             game_id = previous_game.game_id
+
+            if previous_game.ended or ended:
+                self.recalculate_stats_from(timestamp)
         else:
-            self.end_all_opened_games()
-            cur.execute("INSERT INTO games(timestamp, left_team_id, right_team_id, left_score, right_score, ended) " +
-                        "VALUES(:timestamp, :left_team_id, :right_team_id, :left_score, :right_score, :ended)", game_dict_sql)
+            self.end_all_opened_games(table_id=table_id)
+            cur.execute("INSERT INTO games(timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id) " +
+                        "VALUES(:timestamp, :left_team_id, :right_team_id, :left_score, :right_score, :ended, :table_id)", game_dict_sql)
+            game_id = cur.lastrowid
+            self._log_goals(game_id, left_score, right_score)
 
             self.con.commit()
-            game_id = cur.lastrowid
+            self._open_games.pop(table_id, None)
 
-        return Game(game_id=game_id, **game_dict)
+        game = Game(game_id=game_id, **game_dict)
+        self._game_changed(game)
+        return game
 
 
-    def end_all_opened_games(self):
+    def _free_timestamp(self, timestamp):
         cur = self.con.cursor()
+        while True:
+            cur.execute("SELECT 1 FROM games WHERE timestamp = :timestamp", dict(timestamp=timestamp))
+            if cur.fetchone() is None:
+                return timestamp
+            timestamp = tools.get_timestamp_after(timestamp, seconds=-1)
 
-        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended " +
-                    "FROM games WHERE ended=:ended", dict(ended=0))
+    def _log_goals(self, game_id, left_value, right_value):
+        """
+            Log score changes made without goal events, does not commit
+        """
+        cur = self.con.cursor()
+        timestamp = tools.get_timestamp_for_now()
+        cur.executemany("INSERT INTO goals(game_id, side, value, timestamp) VALUES(?, ?, ?, ?)",
+                        [(game_id, side, value, timestamp) for side, value in ((config.LEFT, left_value), (config.RIGHT, right_value)) if value != 0])
+
+    @_writes
+    def end_all_opened_games(self, table_id=None):
+        """
+            End the open games of a table, or of every table if table_id is None
+        """
+        cur = self.con.cursor()
+
+        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id " +
+                    "FROM games WHERE ended=:ended AND (:table_id IS NULL OR table_id = :table_id)", dict(ended=0, table_id=table_id))
         open_games = list(cur.fetchall())
-        for (game_id, timestamp, _, _, left_score, right_score, ended) in open_games:
+        for (game_id, timestamp, _, _, left_score, right_score, ended, game_table_id) in open_games:
             cur.execute("UPDATE games SET ended = :ended WHERE game_id = :game_id",
                         dict(game_id=game_id, ended=1))
             self.con.commit()
+            self._open_games.pop(game_table_id, None)
+            self._game_changed(Game(game_id=game_id, timestamp=timestamp, left_team=None, right_team=None,
+                                    left_score=left_score, right_score=right_score, ended=1, table_id=game_table_id))
 
-    def _end_games_that_shouldnt_be_open(self):
+    def _end_games_that_shouldnt_be_open(self, table_id=None):
         cur = self.con.cursor()
 
-        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended " +
-                    "FROM games WHERE ended=:ended", dict(ended=0))
+        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id " +
+                    "FROM games WHERE ended=:ended AND (:table_id IS NULL OR table_id = :table_id)", dict(ended=0, table_id=table_id))
         open_games = list(cur.fetchall())
-        for (game_id, timestamp, _, _, left_score, right_score, ended) in open_games:
+        for (game_id, timestamp, _, _, left_score, right_score, ended, game_table_id) in open_games:
             game = Game(game_id=game_id, left_team=None, right_team=None, timestamp=timestamp, left_score=left_score,
-                        right_score=right_score, ended=ended)
+                        right_score=right_score, ended=ended, table_id=game_table_id)
             if game.game_should_end():
                 self.end_game(game)
 
-    def get_open_game(self):
-        self._end_games_that_shouldnt_be_open()
+    def get_open_game(self, table_id=config.DEFAULT_TABLE_ID):
+        self._end_games_that_shouldnt_be_open(table_id=table_id)
 
         cur = self.con.cursor()
 
-        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended " +
-                    "FROM games WHERE ended=:ended ORDER BY game_id desc", dict(ended=0))
+        cur.execute("SELECT game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id " +
+                    "FROM games WHERE table_id=:table_id AND ended=:ended ORDER BY game_id desc", dict(table_id=table_id, ended=0))
 
         open_game = cur.fetchone()
         if open_game:
-            game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended = open_game
+            game_id, timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id = open_game
             return Game(game_id=game_id, timestamp=timestamp,
                         left_team=self.get_team(left_team_id), right_team=self.get_team(right_team_id),
-                        left_score=left_score, right_score=right_score, ended=ended)
+                        left_score=left_score, right_score=right_score, ended=ended, table_id=table_id)
         else:
             return None
 
-    def goal(self, side, value=1):
-        open_game = self.get_open_game()
-        open_game.goal_scored(side=side, value=value)
-
+    def get_open_tables(self):
+        """
+            The ids of the tables with an open game
+        """
         cur = self.con.cursor()
+        cur.execute("SELECT DISTINCT table_id FROM games WHERE ended = 0 ORDER BY table_id")
+        return [table_id for table_id, in cur.fetchall()]
 
-        cur.execute("UPDATE games SET left_score = :left_score, right_score = :right_score, ended = :ended " +
-                    "WHERE game_id = :game_id",
-                    dict(game_id=open_game.game_id,
-                         left_score=open_game.left_score,
-                         right_score=open_game.right_score,
-                         ended=open_game.ended))
-        self.con.commit()
+    def _get_open_game_limits(self, table_id):
+        """
+            The open game of a table as an OpenGame, cached on the writer until a game of the table is created,
+            edited, ended or deleted
+        """
+        if table_id not in self._open_games:
+            self._load_open_game(table_id)
 
-        if open_game.game_should_end():
-            self.end_game(open_game)
+        open_game = self._open_games.get(table_id)
+        if open_game is not None and tools.get_timestamp_for_now() > open_game.deadline:
+            # out of time, whether it was cached or just loaded: end it the usual way and look again
+            self._end_games_that_shouldnt_be_open(table_id=table_id)
+            self._open_games.pop(table_id, None)
+            self._load_open_game(table_id)
 
-    def end_game(self, game):
+        return self._open_games.get(table_id)
+
+    def _load_open_game(self, table_id):
         cur = self.con.cursor()
-        cur.execute("UPDATE games SET ended = :ended WHERE game_id = :game_id",
-                    dict(game_id=game.game_id, ended=1))
-        self.con.commit()
+        cur.execute("SELECT game_id, timestamp FROM games WHERE table_id = :table_id AND ended = 0 ORDER BY game_id DESC LIMIT 1",
+                    dict(table_id=table_id))
+        open_game = cur.fetchone()
+        if open_game:
+            game_id, timestamp = open_game
+            self._open_games[table_id] = OpenGame(game_id=game_id, timestamp=timestamp, goal_limit=config.GAME_GOAL_LIMIT,
+                                                  deadline=tools.get_timestamp_after(timestamp, seconds=config.GAME_TIME_LIMIT))
 
-        game.ended = 1
-        self.add_stats_game(game=game)
+    @_writes
+    def goal(self, side, value=1, device=None, sequence=None, table_id=config.DEFAULT_TABLE_ID):
+        """
+            Add value goals to one side of the open game of a table, ending the game once it reaches the goal limit
+        """
+        return self.goals([GoalEvent(side=side, value=value, timestamp=tools.get_timestamp_for_now(), device=device, sequence=sequence,
+                                     table_id=table_id)])
 
+    @_writes
+    def goals(self, events):
+        """
+            Apply GoalEvents of any number of tables, in order within each table. Returns the number of events applied.
+        """
+        tables = collections.OrderedDict()
+        for event in events:
+            tables.setdefault(event.table_id, []).append(event)
 
+        return sum(self._table_goals(table_id, table_events) for table_id, table_events in tables.items())
 
-    def get_stats(self, stats_id):
-        cur = self.con.cursor()
+    def _table_goals(self, table_id, events):
+        """
+            Log GoalEvents in order for the open game of a table and add them to its score with a single UPDATE. Events
+            already logged in the game for the same (device, sequence) are ignored. Once the game reaches the goal limit it is ended
+            and the remaining events are dropped, as there is no open game for them.
+        """
+        open_game = self._get_open_game_limits(table_id)
+        if open_game is None:
+            return 0
 
-        q = """ SELECT stats_id, player_id, attack_player_id, defense_player_id, team_id, wins, draws, losses, goals_pro, goals_against, elo_rating, timestamp
-                FROM STATS
-                WHERE stats_id = :stats_id
-            """
+        cur = self.con.cursor()
+        cur.execute("SELECT left_score, right_score FROM games WHERE game_id = :game_id AND ended = 0", dict(game_id=open_game.game_id))
+        scores = cur.fetchone()
+        if scores is None:
+            # ended without this cache knowing, the goals are for the game open now if there is one
+            self._open_games.pop(table_id, None)
+            return self._table_goals(table_id, events)
+
+        scores = dict(zip((config.LEFT, config.RIGHT), scores))
+        increments = dict.fromkeys(scores, 0)
+        applied = 0
+
+        with self.con:
+            for event in events:
+                if event.side not in scores:
+                    continue
+
+                cur.execute("INSERT OR IGNORE INTO goals(game_id, side, value, timestamp, device, sequence) " +
+                            "VALUES(:game_id, :side, :value, :timestamp, :device, :sequence)",
+                            dict(game_id=open_game.game_id, **event._asdict()))
+                if cur.rowcount == 0:
+                    # a retry of a goal we already have
+                    continue
+
+                scores[event.side] += event.value
+                increments[event.side] += event.value
+                applied += 1
+                if max(scores.values()) >= open_game.goal_limit:
+                    break
+
+            cur.execute("UPDATE games SET left_score = left_score + :left, right_score = right_score + :right WHERE game_id = :game_id AND ended = 0",
+                        dict(game_id=open_game.game_id, **increments))
+
+        game = Game(game_id=open_game.game_id, timestamp=open_game.timestamp, left_team=None, right_team=None,
+                    left_score=scores[config.LEFT], right_score=scores[config.RIGHT], table_id=table_id)
+        if max(scores.values()) >= open_game.goal_limit:
+            self.end_game(game)
+        elif applied:
+            self._game_changed(game)
+
+        return applied
+
+    def get_goals(self, game_id):
+        """
+            The goals of a game in the order they were received, as dicts with the running score after each one
+        """
+        cur = self.con.cursor()
+        cur.execute("SELECT side, value, timestamp, device, sequence FROM goals WHERE game_id = :game_id ORDER BY goal_id", dict(game_id=game_id))
+
+        scores = {config.LEFT: 0, config.RIGHT: 0}
+        timeline = []
+        for side, value, timestamp, device, sequence in cur.fetchall():
+            scores[side] += value
+            timeline.append(dict(side=side, value=value, timestamp=timestamp, device=device, sequence=sequence,
+                                 left_score=scores[config.LEFT], right_score=scores[config.RIGHT]))
+        return timeline
+
+    @_writes
+    def rebuild_game_score(self, game_id):
+        """
+            Set the score of a game back to the sum of its logged goals
+        """
+        cur = self.con.cursor()
+        game_dict = dict(game_id=game_id, left=config.LEFT, right=config.RIGHT)
+
+        with self.con:
+            cur.execute("SELECT timestamp, left_score, right_score, ended, table_id FROM games WHERE game_id = :game_id", game_dict)
+            before = cur.fetchone()
+            cur.execute("""UPDATE games SET left_score = (SELECT IFNULL(SUM(value), 0) FROM goals WHERE game_id = :game_id AND side = :left),
+                                            right_score = (SELECT IFNULL(SUM(value), 0) FROM goals WHERE game_id = :game_id AND side = :right)
+                           WHERE game_id = :game_id""", game_dict)
+            cur.execute("SELECT timestamp, left_score, right_score, ended, table_id FROM games WHERE game_id = :game_id", game_dict)
+            after = cur.fetchone()
+
+        if after and after != before:
+            timestamp, left_score, right_score, ended, table_id = after
+            # the stats of an ended game depend on its score
+            if ended:
+                self.recalculate_stats_from(timestamp)
+            self._game_changed(Game(game_id=game_id, timestamp=timestamp, left_team=None, right_team=None,
+                                    left_score=left_score, right_score=right_score, ended=ended, table_id=table_id))
+
+    @_writes
+    def end_game(self, game):
+        cur = self.con.cursor()
 
-        cur.execute(q, dict(stats_id=stats_id))
+        # ending the game and its stats go in the same transaction
+        with self.con:
+            cur.execute("UPDATE games SET ended = 1 WHERE game_id = :game_id AND ended = 0", dict(game_id=game.game_id))
+            game.ended = 1
+            if cur.rowcount == 0:
+                # already ended, e.g. by another reader that found it out of time too
+                return
 
-        stats_exists = cur.fetchone()
-        if stats_exists:
-            _, player_id, attack_player_id, defense_player_id, team_id, wins, draws, losses, goals_pro, goals_against, elo_rating, timestamp = stats_exists
-            return Stats(stats_id=stats_id, player_id=player_id, attack_player_id=attack_player_id, defense_player_id=defense_player_id, team_id=team_id,
-                         wins=wins, draws=draws, losses=losses, goals_pro=goals_pro, goals_against=goals_against,
-                         elo_rating=elo_rating, timestamp=timestamp)
+            replay_game = self._write_game_stats(game=game)
+            self._update_rankings(**_game_entities(replay_game))
 
-        else:
-           return None
+        self._open_games.pop(game.table_id, None)
+        self._forget_loaded()
+        self._game_changed(game)
 
+    def get_stats(self, stats_id):
+        return self._load_stats([stats_id])[stats_id]
 
 
 
@@ -421,9 +928,42 @@ class DBAccess:
         return stats_list
 
 
+    def get_rating_history(self, player_id=None, attack_player_id=None, defense_player_id=None, team_id=None,
+                           since=None, before=None, bucket=DAY_BUCKET):
+        """
+            (timestamp, elo_rating) of the stats from since (included) to before, oldest first, only the last of each bucket
+        """
+        assert 1 == (player_id is not None) + (attack_player_id is not None) + (defense_player_id is not None) + (team_id is not None), "Use only one of these (player_id, attacker_id, defender_id, team_id)"
+
+        ids_dict = dict(player_id=player_id, attack_player_id=attack_player_id, defense_player_id=defense_player_id, team_id=team_id)
+        s_id = [column for column, entity_id in ids_dict.items() if entity_id is not None][0]
+
+        where = "{s_id} = :entity_id".format(s_id=s_id)
+        if since is not None:
+            where += " AND timestamp >= :since"
+        if before is not None:
+            where += " AND timestamp < :before"
+
+        if HISTORY_BUCKETS[bucket] is None:
+            q = "SELECT timestamp, elo_rating FROM stats WHERE {where} ORDER BY timestamp, stats_id".format(where=where)
+        else:
+            # with a single MAX() SQLite takes the other columns from the row holding the maximum
+            q = """ SELECT MAX(timestamp), elo_rating
+                    FROM stats
+                    WHERE {where}
+                    GROUP BY {bucket}
+                    ORDER BY 1
+                """.format(where=where, bucket=HISTORY_BUCKETS[bucket])
+
+        cur = self.con.cursor()
+        cur.execute(q, dict(entity_id=ids_dict[s_id], since=since, before=before))
+        return list(cur.fetchall())
+
+    @_writes
     def add_first_stats(self, player_id=None, attack_player_id=None, defense_player_id=None, team_id=None, timestamp=tools.get_timestamp_for_now()):
         return self.increment_stats(player_id=player_id, attack_player_id=attack_player_id, defense_player_id=defense_player_id, team_id=team_id, timestamp=timestamp)
 
+    @_writes
     def increment_stats(self,
                         player_id=None,
                         attack_player_id=None,
@@ -438,7 +978,13 @@ class DBAccess:
         """
 
         cur = self.con.cursor()
-        stats = self.get_all_stats(player_id=player_id, attack_player_id=attack_player_id, defense_player_id=defense_player_id, team_id=team_id, limit=1)[0]
+
+        ids_dict = dict(player_id=player_id, attack_player_id=attack_player_id, defense_player_id=defense_player_id, team_id=team_id)
+        s_id, entity_id = [(column, value) for column, value in ids_dict.items() if value is not None][0]
+
+        cur.execute("SELECT {columns} FROM current_stats WHERE {s_id} = :entity_id".format(columns=", ".join(STATS_COLUMNS), s_id=s_id),
+                    dict(entity_id=entity_id))
+        stats = _stats_from_row(cur.fetchone() or (None,)) or Stats(**ids_dict)
 
 
         stats.update(i_wins=i_wins, i_draws=i_draws, i_losses=i_losses, i_goals_pro=i_goals_pro, i_goals_against=i_goals_against, i_elo_rating=i_elo_rating, timestamp=timestamp)
@@ -457,146 +1003,381 @@ class DBAccess:
 
 
         cur.execute(s, stats.__dict__)
+        stats.stats_id = cur.lastrowid
+
+        cur.execute("INSERT OR REPLACE INTO current_stats({}) VALUES({})".format(", ".join(STATS_COLUMNS), ", ".join(":" + column for column in STATS_COLUMNS)),
+                    stats.__dict__)
         self.con.commit()
 
-        stats.stats_id = cur.lastrowid
         return stats
 
 
+    @_writes
     def add_stats_game(self, game):
         if not game.ended:
             raise Exception("Game not ended")
 
-        stats_timestamp = game.timestamp
-
-        game = self.get_game_by_timestamp(timestamp=stats_timestamp)
-
-        # Get all stats
+        with self.con:
+            replay_game = self._write_game_stats(game=game)
+            self._update_rankings(**_game_entities(replay_game))
 
-        elo_left_team = game.left_team.team_stats.elo_rating
-        elo_right_team = game.right_team.team_stats.elo_rating
-        elo_attack_left = game.left_team.attack_player.attack_stats.elo_rating
-        elo_defense_left = game.left_team.defense_player.defense_stats.elo_rating
-        elo_attack_right = game.right_team.attack_player.attack_stats.elo_rating
-        elo_defense_right = game.right_team.defense_player.defense_stats.elo_rating
+        self._forget_loaded()
 
-        elo_player_attack_left = game.left_team.attack_player.player_stats.elo_rating
-        elo_player_defense_left = game.left_team.defense_player.player_stats.elo_rating
-        elo_player_attack_right = game.right_team.attack_player.player_stats.elo_rating
-        elo_player_defense_right = game.right_team.defense_player.player_stats.elo_rating
-
-
-        # Score percentages
-
-        if (game.left_score+game.right_score) != 0:
-            score_p_left = game.left_score / float(game.left_score+game.right_score)
-            score_p_right = 1.0 - score_p_left
-        else:
-            score_p_left = 0.5
-            score_p_right = 0.5
-
-        i_elo_left_team = elo.rating_increment(score_perc=score_p_left, diff_ratings=(elo_left_team - elo_right_team))
-        i_elo_right_team = elo.rating_increment(score_perc=score_p_right, diff_ratings=(elo_right_team - elo_left_team))
+    def _write_game_stats(self, game):
+        """
+            Add the stats of an ended game: all its stats rows in one batch and the pointers moved together. Does not commit.
+            Returns the game as replayed.
+        """
+        replay_game, = self._get_replay_games(where="g.game_id = :game_id", params=dict(game_id=game.game_id))
 
-        i_elo_left_players_pos = elo.rating_increment(score_perc=score_p_left, diff_ratings=((elo_attack_left+elo_defense_left) - (elo_attack_right+elo_defense_right)))
-        i_elo_right_players_pos = elo.rating_increment(score_perc=score_p_right, diff_ratings=((elo_attack_right+elo_defense_right)-(elo_attack_left+elo_defense_left)))
+        initial = self._get_current_stats(player_ids=(replay_game.left_defense_id, replay_game.left_attack_id,
+                                                      replay_game.right_defense_id, replay_game.right_attack_id),
+                                          team_ids=(replay_game.left_team_id, replay_game.right_team_id))
 
-        i_elo_left_players_ind = elo.rating_increment(score_perc=score_p_left, diff_ratings=((elo_player_attack_left+elo_player_defense_left) - (elo_player_attack_right+elo_player_defense_right)))
-        i_elo_right_players_ind = elo.rating_increment(score_perc=score_p_right, diff_ratings=((elo_player_attack_right+elo_player_defense_right) - (elo_player_attack_left+elo_player_defense_left)))
+        self._write_replayed_stats(first_keys=[], games=[replay_game], initial=initial)
+        return replay_game
 
+    def _get_current_stats(self, player_ids=None, team_ids=None):
+        """
+            Values of the current stats of the players and teams (all of them if no ids are given), by (column, entity id)
+        """
+        cur = self.con.cursor()
 
-        # Increments for left or right teams
-        left_dict_goals_increment = dict(i_wins=int(game.left_score > game.right_score),
-                                         i_draws=int(game.left_score == game.right_score),
-                                         i_losses=int(game.left_score < game.right_score),
-                                         i_goals_pro=game.left_score,
-                                         i_goals_against=game.right_score,
-                                         timestamp=stats_timestamp)
+        where = ""
+        params = []
+        if player_ids is not None or team_ids is not None:
+            player_ids, team_ids = list(player_ids or []), list(team_ids or [])
+            where = "WHERE player_id IN ({players}) OR attack_player_id IN ({players}) OR defense_player_id IN ({players}) OR team_id IN ({teams})".format(
+                players=_marks(player_ids), teams=_marks(team_ids))
+            params = player_ids * 3 + team_ids
 
-        right_dict_goals_increment = dict(i_wins=int(game.right_score > game.left_score),
-                                          i_draws=int(game.left_score == game.right_score),
-                                          i_losses=int(game.right_score < game.left_score),
-                                          i_goals_pro=game.right_score,
-                                          i_goals_against=game.left_score,
-                                          timestamp=stats_timestamp)
+        cur.execute("SELECT {columns} FROM current_stats {where}".format(columns=", ".join(STATS_COLUMNS), where=where), params)
 
+        current = {}
+        for row in cur.fetchall():
+            stats = _stats_from_row(row)
+            current[_stats_key(stats)] = stats_replay.stats_values(stats)
+        return current
 
+    def get_balanced_matchups(self, player_ids, limit=config.MATCHMAKING_RESULTS):
+        """
+            The most balanced matchmaking.Matchups of four of the players, by their current ratings
+        """
+        player_ids = list(player_ids)
+        ratings = matchmaking.Ratings(player={}, attack={}, defense={}, team={})
+        by_column = {stats_replay.PLAYER: ratings.player, stats_replay.ATTACK: ratings.attack, stats_replay.DEFENSE: ratings.defense}
+        for (column, entity_id), values in self._get_current_stats(player_ids=player_ids, team_ids=[]).items():
+            if column in by_column:
+                by_column[column][entity_id] = values[stats_replay.ELO_RATING]
 
-        new_left_team_stats = self.increment_stats(team_id=game.left_team.team_id, i_elo_rating=i_elo_left_team, **left_dict_goals_increment)
-        self.update_team_stats(team_id=game.left_team.team_id, team_stats_id=new_left_team_stats.stats_id)
+        cur = self.con.cursor()
+        cur.execute(""" SELECT t.defense_player_id, t.attack_player_id, cs.elo_rating
+                        FROM teams t
+                        JOIN current_stats cs ON cs.team_id = t.team_id
+                        WHERE t.defense_player_id IN ({players}) AND t.attack_player_id IN ({players})
+                    """.format(players=_marks(player_ids)), player_ids * 2)
+        for defense_player_id, attack_player_id, elo_rating in cur.fetchall():
+            ratings.team[defense_player_id, attack_player_id] = elo_rating
+
+        return matchmaking.balanced_matchups(player_ids, ratings, limit=limit)
+
+    @property
+    def ratings_version(self):
+        """
+            (ratings_epoch, newest current stats id): with the same epoch, only the current stats newer than that id changed since
+        """
+        cur = self.con.cursor()
+        cur.execute("SELECT (SELECT value FROM meta WHERE key = 'ratings_epoch'), (SELECT MAX(stats_id) FROM current_stats)")
+        return tuple(cur.fetchone())
 
-        new_right_team_stats = self.increment_stats(team_id=game.right_team.team_id, i_elo_rating=i_elo_right_team, **right_dict_goals_increment)
-        self.update_team_stats(team_id=game.right_team.team_id, team_stats_id=new_right_team_stats.stats_id)
+    def get_side_ratings(self, since_stats_id=None):
+        """
+            (team_id, team rating, sum of the players ratings, defense plus attack rating, defense_player_id,
+            attack_player_id) of every team, or only of the teams whose ratings changed after since_stats_id
+        """
+        cur = self.con.cursor()
 
+        where = ""
+        params = []
+        if since_stats_id is not None:
+            cur.execute("SELECT player_id, attack_player_id, defense_player_id, team_id FROM current_stats WHERE stats_id > :stats_id",
+                        dict(stats_id=since_stats_id))
+            player_ids = set()
+            team_ids = set()
+            for player_id, attack_player_id, defense_player_id, team_id in cur.fetchall():
+                if team_id is not None:
+                    team_ids.add(team_id)
+                else:
+                    player_ids.add(next(entity_id for entity_id in (player_id, attack_player_id, defense_player_id) if entity_id is not None))
+            player_ids, team_ids = sorted(player_ids), sorted(team_ids)
+
+            # past a few hundred ids reading every team is faster than the IN (...) lists, and keeps below their parameter limit
+            if len(player_ids) + len(team_ids) <= 500:
+                where = "WHERE t.team_id IN ({teams}) OR t.defense_player_id IN ({players}) OR t.attack_player_id IN ({players})".format(
+                    teams=_marks(team_ids), players=_marks(player_ids))
+                params = team_ids + player_ids * 2
+
+        cur.execute(""" SELECT t.team_id, ts.elo_rating, dp.elo_rating, ap.elo_rating, ds.elo_rating, as_.elo_rating,
+                               t.defense_player_id, t.attack_player_id
+                        FROM teams t
+                        LEFT JOIN current_stats ts ON ts.team_id = t.team_id
+                        LEFT JOIN current_stats dp ON dp.player_id = t.defense_player_id
+                        LEFT JOIN current_stats ap ON ap.player_id = t.attack_player_id
+                        LEFT JOIN current_stats ds ON ds.defense_player_id = t.defense_player_id
+                        LEFT JOIN current_stats as_ ON as_.attack_player_id = t.attack_player_id
+                        {where}
+                        ORDER BY t.team_id
+                    """.format(where=where), params)
+
+        side_ratings = []
+        for row in cur.fetchall():
+            team_id, team, defense_player, attack_player, defense, attack = [elo.INITIAL_RATING if value is None else value for value in row[:6]]
+            side_ratings.append((team_id, team, defense_player + attack_player, defense + attack, row[6], row[7]))
+        return side_ratings
+
+    def get_player_ratings(self, since_stats_id=None):
+        """
+            {player_id: (player rating, attack rating, defense rating)} of every player, or only of the players whose
+            ratings changed after since_stats_id
+        """
+        cur = self.con.cursor()
 
-        new_left_attack_attack_stats = self.increment_stats(attack_player_id=game.left_team.attack_player.player_id, i_elo_rating=i_elo_left_players_pos, **left_dict_goals_increment)
-        new_left_attack_player_stats = self.increment_stats(player_id=game.left_team.attack_player.player_id, i_elo_rating=i_elo_left_players_ind, **left_dict_goals_increment)
+        where = ""
+        params = {}
+        if since_stats_id is not None:
+            where = """WHERE p.player_id IN (SELECT COALESCE(player_id, attack_player_id, defense_player_id) FROM current_stats
+                                             WHERE stats_id > :stats_id AND team_id IS NULL)"""
+            params = dict(stats_id=since_stats_id)
+
+        cur.execute(""" SELECT p.player_id, ps.elo_rating, as_.elo_rating, ds.elo_rating
+                        FROM players p
+                        LEFT JOIN current_stats ps ON ps.player_id = p.player_id
+                        LEFT JOIN current_stats as_ ON as_.attack_player_id = p.player_id
+                        LEFT JOIN current_stats ds ON ds.defense_player_id = p.player_id
+                        {where}
+                    """.format(where=where), params)
+
+        return dict((row[0], tuple(elo.INITIAL_RATING if value is None else value for value in row[1:])) for row in cur.fetchall())
+
+    @_writes
+    def recalculate_stats(self, parallel=False):
+        """
+            Rebuild the whole stats history by replaying every ended game in memory, and write it in one transaction
+        """
+        cur = self.con.cursor()
 
-        self.update_player_stats(player_id=game.left_team.attack_player.player_id,
-                                 player_stats_id=new_left_attack_player_stats.stats_id,
-                                 attack_stats_id=new_left_attack_attack_stats.stats_id,
-                                 defense_stats_id=game.left_team.attack_player.defense_stats.stats_id) # not changed
+        with self.con:
+            cur.execute("DELETE FROM stats")
+            cur.execute("DELETE FROM current_stats")
+            cur.execute("DELETE FROM stats_compactions")
+            cur.execute("UPDATE meta SET value = value + 1 WHERE key = 'ratings_epoch'")
 
+            cur.execute("SELECT player_id FROM players ORDER BY player_id")
+            player_ids = [player_id for player_id, in cur.fetchall()]
+            cur.execute("SELECT team_id FROM teams ORDER BY team_id")
+            team_ids = [team_id for team_id, in cur.fetchall()]
 
-        new_left_defense_defense_stats = self.increment_stats(defense_player_id=game.left_team.defense_player.player_id, i_elo_rating=i_elo_left_players_pos, **left_dict_goals_increment)
-        if game.left_team.attack_player.player_id != game.left_team.defense_player.player_id:
-            new_left_defense_player_stats = self.increment_stats(player_id=game.left_team.defense_player.player_id, i_elo_rating=i_elo_left_players_ind, **left_dict_goals_increment)
-        else:
-            new_left_defense_player_stats = new_left_attack_player_stats
+            first_keys = [(column, player_id) for player_id in player_ids for column in (stats_replay.PLAYER, stats_replay.ATTACK, stats_replay.DEFENSE)]
+            first_keys += [(stats_replay.TEAM, team_id) for team_id in team_ids]
 
-        self.update_player_stats(player_id=game.left_team.defense_player.player_id,
-                                 player_stats_id=new_left_defense_player_stats.stats_id,
-                                 attack_stats_id=game.left_team.defense_player.attack_stats.stats_id, #not changed
-                                 defense_stats_id=new_left_defense_defense_stats.stats_id)
+            self._write_replayed_stats(first_keys=first_keys, games=self._get_replay_games(where="g.ended = 1"), initial={}, parallel=parallel)
+            self._update_rankings()
 
+        self._forget_loaded()
 
-        new_right_attack_attack_stats = self.increment_stats(attack_player_id=game.right_team.attack_player.player_id, i_elo_rating=i_elo_right_players_pos, **right_dict_goals_increment)
-        new_right_attack_player_stats = self.increment_stats(player_id=game.right_team.attack_player.player_id, i_elo_rating=i_elo_right_players_ind, **right_dict_goals_increment)
+    @_writes
+    def recalculate_stats_from(self, timestamp, parallel=False):
+        """
+            Recalculate the stats of the games played since timestamp (included), keeping the older stats history
+        """
+        cur = self.con.cursor()
 
-        self.update_player_stats(player_id=game.right_team.attack_player.player_id,
-                                 player_stats_id=new_right_attack_player_stats.stats_id,
-                                 attack_stats_id=new_right_attack_attack_stats.stats_id,
-                                 defense_stats_id=game.right_team.attack_player.defense_stats.stats_id) # not changed
+        # the compacted history only has the last stats of each day, so replay the whole day
+        cur.execute("SELECT MAX(compacted_until) FROM stats_compactions")
+        compacted_until = cur.fetchone()[0]
+        if compacted_until is not None and timestamp < compacted_until:
+            timestamp = timestamp[:10]
+
+        with self.con:
+            cur.execute("SELECT {} FROM current_stats WHERE timestamp >= :timestamp".format(", ".join(STATS_COLUMNS)), dict(timestamp=timestamp))
+            outdated = [_stats_key(_stats_from_row(row)) for row in cur.fetchall()]
+
+            cur.execute("DELETE FROM stats WHERE timestamp >= :timestamp", dict(timestamp=timestamp))
+            cur.execute("DELETE FROM current_stats WHERE timestamp >= :timestamp", dict(timestamp=timestamp))
+            cur.execute("UPDATE meta SET value = value + 1 WHERE key = 'ratings_epoch'")
+
+            # bring the outdated current stats back to the last ones before timestamp
+            for column in (stats_replay.PLAYER, stats_replay.ATTACK, stats_replay.DEFENSE, stats_replay.TEAM):
+                cur.executemany("""INSERT INTO current_stats({columns})
+                                   SELECT {columns} FROM stats WHERE {column} = ? ORDER BY timestamp DESC, stats_id DESC LIMIT 1
+                                """.format(columns=", ".join(STATS_COLUMNS), column=column),
+                                [(entity_id, ) for key_column, entity_id in outdated if key_column == column])
+
+            # players and teams created after timestamp have no stats left
+            first_keys = []
+            for column in (stats_replay.PLAYER, stats_replay.ATTACK, stats_replay.DEFENSE):
+                cur.execute("SELECT player_id FROM players WHERE player_id NOT IN (SELECT {column} FROM current_stats WHERE {column} IS NOT NULL) ORDER BY player_id".format(column=column))
+                first_keys += [(column, player_id) for player_id, in cur.fetchall()]
+            cur.execute("SELECT team_id FROM teams WHERE team_id NOT IN (SELECT team_id FROM current_stats WHERE team_id IS NOT NULL) ORDER BY team_id")
+            first_keys += [(stats_replay.TEAM, team_id) for team_id, in cur.fetchall()]
+
+            # and replay from there
+            games = self._get_replay_games(where="g.ended = 1 AND g.timestamp >= :timestamp", params=dict(timestamp=timestamp))
+            self._write_replayed_stats(first_keys=first_keys, games=games, initial=self._get_current_stats(), parallel=parallel)
+            self._update_rankings()
+
+        self._forget_loaded()
+
+    @_writes
+    def compact_stats_history(self, before_timestamp):
+        """
+            Keep only the last stats of each day in the history before before_timestamp, the current stats are untouched
+        """
+        cur = self.con.cursor()
 
-        new_right_defense_defense_stats = self.increment_stats(defense_player_id=game.right_team.defense_player.player_id, i_elo_rating=i_elo_right_players_pos, **right_dict_goals_increment)
-        if game.right_team.attack_player.player_id != game.right_team.defense_player.player_id:
-            new_right_defense_player_stats = self.increment_stats(player_id=game.right_team.defense_player.player_id, i_elo_rating=i_elo_right_players_ind, **right_dict_goals_increment)
-        else:
-            new_right_defense_player_stats = new_right_attack_player_stats
+        cur.execute("SELECT {} FROM stats WHERE timestamp < :before_timestamp ORDER BY timestamp, stats_id".format(", ".join(STATS_COLUMNS)),
+                    dict(before_timestamp=before_timestamp))
+        last_of_day = {}
+        superseded = []
+        for row in cur.fetchall():
+            stats = _stats_from_row(row)
+            key = _stats_key(stats) + (stats.timestamp[:10], )
+            if key in last_of_day:
+                superseded.append((last_of_day[key], ))
+            last_of_day[key] = stats.stats_id
 
-        self.update_player_stats(player_id=game.right_team.defense_player.player_id,
-                                 player_stats_id=new_right_defense_player_stats.stats_id,
-                                 attack_stats_id=game.right_team.defense_player.attack_stats.stats_id, #not changed
-                                 defense_stats_id=new_right_defense_defense_stats.stats_id)
+        with self.con:
+            cur.executemany("DELETE FROM stats WHERE stats_id = ?", superseded)
+            cur.execute("INSERT INTO stats_compactions(compacted_until) VALUES(:before_timestamp)", dict(before_timestamp=before_timestamp))
 
+        return len(superseded)
 
+    def get_rankings(self, board):
+        """
+            The Rankings of a leaderboard, best first
+        """
+        cur = self.con.cursor()
+        cur.execute("SELECT entity_id, position, previous_position FROM rankings WHERE board = :board ORDER BY position", dict(board=board))
+        rows = list(cur.fetchall())
 
+        load = self._load_teams if board == TEAM_RANKING else self._load_players
+        entities = load([entity_id for entity_id, _, _ in rows])
+        return [Ranking(position=position, previous_position=previous_position, entity=entities[entity_id])
+                for entity_id, position, previous_position in rows]
 
-    def recalculate_stats(self):
+    def _update_rankings(self, keep_deltas=False, player_ids=None, team_ids=None):
+        """
+            Re-rank the leaderboards from the current stats, only writing the rows that changed. previous_position becomes
+            the position before this update, or with keep_deltas (no game played) moves along so the last changes are kept.
+            Given player_ids or team_ids, only those players and teams changed: only their boards are re-ranked, and
+            only between the positions they leave and the ones they take. Does not commit.
+        """
         cur = self.con.cursor()
+        if player_ids is None and team_ids is None:
+            for board, query in RANKING_QUERIES:
+                cur.execute("SELECT entity_id, position, previous_position, value FROM rankings WHERE board = :board", dict(board=board))
+                old = dict((row[0], row[1:]) for row in cur.fetchall())
+
+                cur.execute(query)
+                self._write_rankings(board, sorted((-value, entity_id) for entity_id, value in cur.fetchall()), 1, old, keep_deltas)
+            return
+
+        boards = [(board, query, "player_id", sorted(set(player_ids))) for board, query in PLAYER_BOARDS if player_ids]
+        boards += [(board, query, "team_id", sorted(set(team_ids))) for board, query in TEAM_BOARDS if team_ids]
+        for board, query, id_column, entity_ids in boards:
+            cur.execute("SELECT entity_id, position, previous_position, value FROM rankings WHERE board = ? AND entity_id IN ({})".format(
+                _marks(entity_ids)), [board] + entity_ids)
+            moving = dict((row[0], row[1:]) for row in cur.fetchall())
+            cur.execute("SELECT * FROM ({}) WHERE {} IN ({})".format(query, id_column, _marks(entity_ids)), entity_ids)
+            ranked = sorted((-value, entity_id) for entity_id, value in cur.fetchall())
+
+            # the others keep their values and order: where each moving entity lands among them bounds what moves
+            bounds = [position for position, _, _ in moving.values()]
+            for value, entity_id in ranked:
+                cur.execute(""" SELECT (SELECT COUNT(*) FROM rankings WHERE board = :board AND value > :value)
+                                     + (SELECT COUNT(*) FROM rankings WHERE board = :board AND value = :value AND entity_id < :entity_id)
+                            """, dict(board=board, value=-value, entity_id=entity_id))
+                ahead = cur.fetchone()[0] - sum(1 for other, (_, _, other_value) in moving.items() if (-other_value, other) < (value, entity_id))
+                bounds += [ahead + 1, ahead + len(ranked)]
+            # nothing moves without bounds; taking in or leaving out an entity moves everything after it
+            first = min(bounds or [0])
+            last = max(bounds or [0]) if set(entity_id for _, entity_id in ranked) == set(moving) else None
+
+            cur.execute(""" SELECT entity_id, position, previous_position, value FROM rankings
+                            WHERE board = :board AND position >= :first AND (:last IS NULL OR position <= :last)
+                            ORDER BY position
+                        """, dict(board=board, first=first, last=last))
+            old = dict(moving)
+            for row in cur.fetchall():
+                if row[0] not in moving:
+                    old[row[0]] = row[1:]
+                    bisect.insort(ranked, (-row[3], row[0]))
+            self._write_rankings(board, ranked, first, old, keep_deltas)
+
+            if not keep_deltas:
+                cur.execute(""" UPDATE rankings SET previous_position = position
+                                WHERE board = :board AND previous_position != position AND (position < :first OR position > :last)
+                            """, dict(board=board, first=first, last=last))
+
+    def _write_rankings(self, board, ranked, first, old, keep_deltas):
+        """
+            Write the (-value, entity_id) of ranked from position first, old has the (position, previous_position, value)
+            of the entities they had until now. What is left of old is not ranked anymore, like hidden players.
+        """
+        changed = []
+        for position, (value, entity_id) in enumerate(ranked, first):
+            value = -value
+            if entity_id not in old:
+                changed.append((board, entity_id, position, position, value))
+                continue
+
+            old_position, old_previous_position, old_value = old.pop(entity_id)
+            if keep_deltas:
+                previous_position = old_previous_position + position - old_position
+            else:
+                previous_position = old_position
+            if (position, previous_position, value) != (old_position, old_previous_position, old_value):
+                changed.append((board, entity_id, position, previous_position, value))
 
-        cur.execute("DELETE FROM STATS")
-        self.con.commit()
-
-        players = self.get_all_players()
-        for player in players:
-            player_stats = self.add_first_stats(player_id=player.player_id, timestamp=config.FIRST_TIMESTAMP)
-            attack_stats = self.add_first_stats(attack_player_id=player.player_id, timestamp=config.FIRST_TIMESTAMP)
-            defense_stats = self.add_first_stats(defense_player_id=player.player_id, timestamp=config.FIRST_TIMESTAMP)
+        cur = self.con.cursor()
+        cur.executemany("INSERT OR REPLACE INTO rankings(board, entity_id, position, previous_position, value) VALUES(?, ?, ?, ?, ?)", changed)
+        cur.executemany("DELETE FROM rankings WHERE board = ? AND entity_id = ?", [(board, entity_id) for entity_id in old])
 
-            self.update_player_stats(player_id=player.player_id,
-                                     player_stats_id=player_stats.stats_id,
-                                     attack_stats_id=attack_stats.stats_id,
-                                     defense_stats_id=defense_stats.stats_id)
+    def _get_replay_games(self, where, params=None):
+        cur = self.con.cursor()
+        cur.execute("""SELECT g.timestamp,
+                              g.left_team_id, lt.defense_player_id, lt.attack_player_id,
+                              g.right_team_id, rt.defense_player_id, rt.attack_player_id,
+                              g.left_score, g.right_score
+                       FROM games g
+                       JOIN teams lt ON lt.team_id = g.left_team_id
+                       JOIN teams rt ON rt.team_id = g.right_team_id
+                       WHERE {where}
+                       ORDER BY g.timestamp, g.game_id""".format(where=where), params or {})
+        return [stats_replay.ReplayGame(*row) for row in cur.fetchall()]
+
+    def _write_replayed_stats(self, first_keys, games, initial, parallel=False):
+        """
+            Write first stats for first_keys and the stats of the replayed games with a single executemany,
+            then replace the current stats with the newest ones. Does not commit.
+        """
+        cur = self.con.cursor()
 
+        rows = [(column, entity_id, tuple(stats_replay.first_values()) + (config.FIRST_TIMESTAMP,)) for column, entity_id in first_keys]
+        rows += stats_replay.replay_games(games, initial, parallel=parallel)
 
-        teams = self.get_all_teams()
-        for team in teams:
-            team_stats = self.add_first_stats(team_id=team.team_id, timestamp=config.FIRST_TIMESTAMP)
-            self.update_team_stats(team_id=team.team_id, team_stats_id=team_stats.stats_id)
+        cur.execute("SELECT MAX(IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'stats'), 0), IFNULL((SELECT MAX(stats_id) FROM stats), 0))")
+        next_stats_id = cur.fetchone()[0] + 1
 
-        games = reversed(self.get_all_games())
-        for game in games:
-            self.add_stats_game(game=game)
+        stats_rows = []
+        newest = {}
+        for stats_id, (column, entity_id, values) in enumerate(rows, next_stats_id):
+            ids = dict(player_id=None, attack_player_id=None, defense_player_id=None, team_id=None)
+            ids[column] = entity_id
+            stats_rows.append((stats_id, ids["player_id"], ids["attack_player_id"], ids["defense_player_id"], ids["team_id"]) + tuple(values))
+            newest[column, entity_id] = len(stats_rows) - 1
 
+        cur.executemany("INSERT INTO stats({}) VALUES({})".format(", ".join(STATS_COLUMNS), _marks(STATS_COLUMNS)), stats_rows)
 
+        cur.executemany("INSERT OR REPLACE INTO current_stats({}) VALUES({})".format(", ".join(STATS_COLUMNS), _marks(STATS_COLUMNS)),
+                        [stats_rows[index] for index in sorted(newest.values())])
@@ -0,0 +1,187 @@
+import atexit
+import sys
+import threading
+import weakref
+import Queue
+
+import sqlite3 as lite
+
+
+def _close_at_exit(pool_ref):
+    pool = pool_ref()
+    if pool is not None:
+        pool.close()
+
+
+class _HeldCommits(object):
+    """
+        Mixed into the connection class of the writer: inside ConnectionPool.transaction commits wait for its end
+    """
+    holding = False
+
+    def commit(self):
+        if not self.holding:
+            super(_HeldCommits, self).commit()
+
+
+class ConnectionPool:
+    """
+        SQLite connections for a multithreaded server: every thread reads through its own connection and all
+        writes run one at a time on a single writer thread. In WAL mode readers never wait for the writer.
+        A thread done with a request releases its connection, up to idle_readers of them wait for the next threads
+        instead of being opened again, as with a thread per request.
+    """
+    # sqlite3.Connection subclass used for every connection, to instrument the queries
+    connection_factory = lite.Connection
+
+    def __init__(self, database, timeout=30.0, idle_readers=8):
+        self.database = database
+        self.timeout = timeout
+        self.idle_readers = idle_readers
+
+        self._writer = None
+        self.start()
+
+        # let the queued writes finish before the interpreter goes away, without keeping the pool alive until then
+        atexit.register(_close_at_exit, weakref.ref(self))
+
+    def start(self):
+        """
+            Start the writer thread, with new connections. A forked worker process starts the pool again after close()
+        """
+        self._local = threading.local()
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._jobs = Queue.Queue()
+        self._writer_con = None
+
+        ready = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, args=(ready,), name="db-writer")
+        self._writer.daemon = True
+        self._writer.start()
+        ready.wait()
+
+    def _connect(self, factory=None, check_same_thread=True):
+        return lite.connect(database=self.database, timeout=self.timeout, factory=factory or self.connection_factory,
+                            check_same_thread=check_same_thread)
+
+    def in_writer(self):
+        return threading.current_thread() is self._writer
+
+    def connection(self):
+        """
+            The connection of the current thread: the writer one on the writer thread, a read only one elsewhere
+        """
+        if self.in_writer():
+            return self._writer_con
+
+        con = getattr(self._local, "con", None)
+        if con is None:
+            with self._idle_lock:
+                con = self._idle.pop() if self._idle else None
+            if con is None:
+                # released connections go from thread to thread, one at a time
+                con = self._connect(check_same_thread=False)
+                con.execute("PRAGMA query_only = 1")
+            self._local.con = con
+        return con
+
+    def release(self):
+        """
+            Done with the read connection of the current thread for now, the next thread asking for one may take it
+        """
+        con = getattr(self._local, "con", None)
+        if con is None or self.in_writer():
+            return
+
+        self._local.con = None
+        with self._idle_lock:
+            if len(self._idle) < self.idle_readers:
+                self._idle.append(con)
+                return
+        con.close()
+
+    def write(self, function, *args, **kwargs):
+        """
+            Run function on the writer thread and wait for its result (or exception)
+        """
+        if self.in_writer():
+            return function(*args, **kwargs)
+
+        done = threading.Event()
+        result = {}
+        self._jobs.put((function, args, kwargs, done, result))
+        done.wait()
+
+        if "error" in result:
+            error_type, error, traceback = result["error"]
+            raise error_type, error, traceback
+        return result["value"]
+
+    def transaction(self, function, *args, **kwargs):
+        """
+            On the writer thread, run function in a single transaction holding the write lock of the database from the
+            start, so no other process writes in between: committed when function returns, rolled back if it raises.
+            The commits function makes wait for the end, a transaction within a transaction is part of it.
+        """
+        con = self._writer_con
+        if con.holding:
+            return function(*args, **kwargs)
+
+        con.execute("BEGIN IMMEDIATE")
+        con.holding = True
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            con.holding = False
+            con.rollback()
+            raise
+        con.holding = False
+        con.commit()
+        return result
+
+    def queue_size(self):
+        return self._jobs.qsize()
+
+    def _write_loop(self, ready):
+        self._writer_con = self._connect(type("WriterConnection", (_HeldCommits, self.connection_factory), {}))
+        self._writer_con.execute("PRAGMA journal_mode = WAL")
+        self._writer_con.execute("PRAGMA synchronous = NORMAL")
+        ready.set()
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            function, args, kwargs, done, result = job
+            try:
+                result["value"] = function(*args, **kwargs)
+            except Exception:
+                result["error"] = sys.exc_info()
+                # don't leave a half done transaction for the next write
+                self._writer_con.rollback()
+            finally:
+                done.set()
+
+        self._writer_con.close()
+
+    def close(self):
+        """
+            Stop the writer thread once the queued writes are done and close the connection of the current thread and
+            the idle ones
+        """
+        if self._writer.is_alive():
+            self._jobs.put(None)
+            # on the writer itself (a DBAccess collected during a write) it stops after the current job
+            if not self.in_writer():
+                self._writer.join()
+
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for con in idle:
+            con.close()
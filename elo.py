@@ -1,3 +1,14 @@
+"""
+    Elo ratings of the players, positions and teams, as rated by Bonzini USA.
+
+    The batch functions at the bottom, used for the win probability matrix, run on NumPy when it is installed; replaying
+    the stats stays on the scalar ones, as each game starts from the ratings the one before left. NumPy is optional
+    and is not in requirements.txt: without it, or where its pow() does not give the very values of math.pow, they
+    fall back to loops over the scalar functions, with the same results only slower. vectorized tells which is used,
+    and python -m benchmarks.elo_batch times both. To get the faster one:
+
+        pip install numpy
+"""
 import math
 
 INITIAL_RATING = 1000
@@ -15,7 +26,10 @@ def rating_increment(score_perc, diff_ratings):
 
 
 def predicted_score(diff, MAX_SCORE):
-    expected = wining_expectancy(diff)
+    return predicted_score_from_expectancy(wining_expectancy(diff), MAX_SCORE)
+
+
+def predicted_score_from_expectancy(expected, MAX_SCORE):
     if expected > 0.5:
         predicted_right_score = int(round(MAX_SCORE * ((1.0-expected) / expected)))
         predicted_left_score = MAX_SCORE
@@ -28,3 +42,71 @@ def predicted_score(diff, MAX_SCORE):
 
 
 
+
+
+# The same for whole sequences of matchups at once: NumPy arrays in and out when NumPy is installed, lists
+# otherwise. Either way every value is exactly the one of the scalar function for that matchup.
+
+def _python_expectancies(diffs):
+    return [wining_expectancy(diff) for diff in diffs]
+
+
+def _python_increments(score_percs, diffs):
+    return [rating_increment(score_perc, diff) for score_perc, diff in zip(score_percs, diffs)]
+
+
+def _python_predicted_scores(diffs, MAX_SCORE):
+    scores = [predicted_score(diff, MAX_SCORE) for diff in diffs]
+    return [left for left, _ in scores], [right for _, right in scores]
+
+
+def _numpy_expectancies(diffs):
+    return 1.0 / (numpy.power(10.0, -numpy.asarray(diffs) / F) + 1)
+
+
+def _numpy_increments(score_percs, diffs):
+    return K * (numpy.asarray(score_percs, dtype=float) - _numpy_expectancies(diffs))
+
+
+def _round(values):
+    # round() of Python 2, halves away from zero, for values >= 0: numpy.round takes halves to even
+    floors = numpy.floor(values)
+    return floors + (values - floors >= 0.5)
+
+
+def _numpy_predicted_scores(diffs, MAX_SCORE):
+    expected = _numpy_expectancies(diffs)
+    favourite = expected > 0.5
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ratios = numpy.where(favourite, (1.0-expected) / expected, expected / (1.0-expected))
+    scores = _round(MAX_SCORE * ratios).astype(int)
+    return numpy.where(favourite, MAX_SCORE, scores), numpy.where(favourite, scores, MAX_SCORE)
+
+
+def _numpy_matches_math():
+    # numpy.power is the C pow() behind math.pow on most builds; where it is not, results could differ in the last bit
+    diffs = [float(diff) for diff in range(-2000, 2001)] + [diff + 0.37 for diff in range(-200, 200)]
+    return list(_numpy_expectancies(diffs)) == _python_expectancies(diffs)
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+vectorized = numpy is not None and _numpy_matches_math()
+
+
+def wining_expectancies(diffs):
+    return _numpy_expectancies(diffs) if vectorized else _python_expectancies(diffs)
+
+
+def rating_increments(score_percs, diffs):
+    return _numpy_increments(score_percs, diffs) if vectorized else _python_increments(score_percs, diffs)
+
+
+def predicted_scores(diffs, MAX_SCORE):
+    """
+        (left scores, right scores) of every diff
+    """
+    return _numpy_predicted_scores(diffs, MAX_SCORE) if vectorized else _python_predicted_scores(diffs, MAX_SCORE)
@@ -1,16 +1,38 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, Response, request, g, jsonify, render_template, redirect, url_for
 from flask_bootstrap import Bootstrap
 from flask.ext.uploads import UploadSet, IMAGES, configure_uploads, UploadNotAllowed
 
 from models import Player, Team, Game, Stats
-from db_access import DBAccess
+from db_access import DBAccess, PLAYER_RANKING, ATTACK_RANKING, DEFENSE_RANKING, WIN_PERC_RANKING, TEAM_RANKING, HISTORY_BUCKETS, DAY_BUCKET
+from goal_queue import GoalQueue
+from live import LiveScores, game_event, sse
+from view_cache import ViewCache
+from db_pool import ConnectionPool
+from slow_queries import SlowQueryLog
+from win_probabilities import WinProbabilities
+from stats_replay import LADDERS, TEAM_LADDER
 import config
+import logging
+import metrics
+import time
 import tools
 
 app = Flask(__name__)
 Bootstrap(app)
 
+ConnectionPool.connection_factory = metrics.MetricsConnection
+if config.SLOW_QUERY_SECONDS is not None:
+    metrics.slow_query_log = SlowQueryLog(config.SLOW_QUERY_LOG, threshold=config.SLOW_QUERY_SECONDS)
 db = DBAccess(database=config.DBNAME)
+goals = GoalQueue(db)
+live_scores = LiveScores()
+db.game_listeners.append(live_scores.publish)
+view_cache = ViewCache(get_version=lambda: db.change_version)
+win_probabilities = WinProbabilities(db)
+
+metrics.GOAL_QUEUE_DEPTH.set_function(lambda: goals.depth())
+metrics.WRITE_QUEUE_DEPTH.set_function(lambda: db.pool.queue_size())
+metrics.LIVE_VIEWERS.set_function(lambda: live_scores.viewers())
 
 app.config['UPLOADS_DEFAULT_DEST'] = 'static/uploads'
 #app.config['UPLOADS_DEFAULT_URL'] = ''
@@ -19,6 +41,26 @@ photos = UploadSet('photos', IMAGES)
 configure_uploads(app, (photos,))
 
 
+@app.before_request
+def begin_db_request():
+    g.started = time.time()
+    metrics.begin_tally()
+    db.begin_request()
+
+
+@app.teardown_request
+def end_db_request(exception=None):
+    db.end_request()
+
+    endpoint = (request.endpoint or "not_found",)
+    tally = metrics.end_tally()
+    if tally is not None:
+        metrics.REQUEST_STATEMENTS.observe(tally.statements, endpoint)
+        metrics.REQUEST_SQL_SECONDS.observe(tally.seconds, endpoint)
+    if 'started' in g:
+        metrics.REQUEST_SECONDS.observe(time.time() - g.started, endpoint)
+
+
 @app.errorhandler(405)
 def method_not_allowed(error=None):
     app.logger.warning('Method Not Allowed: ' + request.method, )
@@ -33,11 +75,23 @@ def method_not_allowed(error=None):
     return resp
 
 
-@app.route('/')
-def home_page():
-    game = db.get_open_game()
+def bad_request(text):
+    message = {
+        'status': 400,
+        'message': text,
+    }
+    resp = jsonify(message)
+    resp.status_code = 400
+
+    return resp
+
+
+@app.route('/', defaults={'table_id': config.DEFAULT_TABLE_ID})
+@app.route('/tables/<int:table_id>')
+def home_page(table_id):
+    game = db.get_open_game(table_id=table_id)
     if not game:
-        return redirect(url_for("games_get_post"))
+        return redirect(url_for("games_get_post", table_id=table_id))
     else:
         return redirect(url_for('games_get', timestamp=game.timestamp))
 
@@ -65,14 +119,41 @@ def players_get_post():
 
 
 @app.route('/players/<name>')
+@view_cache.cached()
 def players_name_get(name):
     player = db.get_player_by_name(name=name)
-    player_stats = db.get_all_stats(player_id=player.player_id)
-    attacker_stats = db.get_all_stats(attack_player_id=player.player_id)
-    defender_stats = db.get_all_stats(defense_player_id=player.player_id)
+    player_stats = db.get_all_stats(player_id=player.player_id, limit=config.PROFILE_STATS_ROWS)
+    attacker_stats = db.get_all_stats(attack_player_id=player.player_id, limit=config.PROFILE_STATS_ROWS)
+    defender_stats = db.get_all_stats(defense_player_id=player.player_id, limit=config.PROFILE_STATS_ROWS)
     return render_template('player_page.html', player=player, player_stats=player_stats, attacker_stats=attacker_stats, defender_stats=defender_stats)
 
 
+# the stats column of each ladder of a player
+_PLAYER_LADDERS = {PLAYER_RANKING: 'player_id', ATTACK_RANKING: 'attack_player_id', DEFENSE_RANKING: 'defense_player_id'}
+
+
+def _rating_history(**entity):
+    # ?since=<timestamp>&before=<timestamp>&bucket=game|hour|day|week|month
+    bucket = request.args.get('bucket', DAY_BUCKET)
+    if bucket not in HISTORY_BUCKETS:
+        return bad_request('Unknown bucket: ' + bucket)
+
+    history = db.get_rating_history(since=request.args.get('since'), before=request.args.get('before'), bucket=bucket, **entity)
+    return jsonify({'bucket': bucket, 'history': history})
+
+
+@app.route('/players/<name>/history', defaults={'ladder': PLAYER_RANKING})
+@app.route('/players/<name>/history/<ladder>')
+@view_cache.cached()
+def player_history(name, ladder):
+    player = db.get_player_by_name(name=name)
+    if not player:
+        return bad_request('Unknown player: ' + name)
+    if ladder not in _PLAYER_LADDERS:
+        return bad_request('Unknown ladder: ' + ladder)
+    return _rating_history(**{_PLAYER_LADDERS[ladder]: player.player_id})
+
+
 @app.route('/players/<name>/edit', methods=['POST', 'GET'])
 def player_name_edit(name):
     if request.method == 'GET':
@@ -101,6 +182,7 @@ def player_name_edit(name):
     return redirect(url_for('players_name_get', name=edited_player.name))
 
 @app.route('/teams')
+@view_cache.cached()
 def teams_get():
     all_teams = db.get_all_teams()
     sorted_teams = sorted(all_teams, key=lambda team: -team.team_stats.elo_rating)
@@ -110,12 +192,39 @@ def teams_get():
 @app.route('/teams/<team_id>', methods=['GET'])
 def teams_name_get(team_id):
     team = db.get_team(team_id=team_id)
-    team_stats = db.get_all_stats(team_id=team_id)
+    team_stats = db.get_all_stats(team_id=team_id, limit=config.PROFILE_STATS_ROWS)
     return render_template('team_page.html', team=team, team_stats=team_stats)
 
 
-@app.route('/games', methods=['GET', 'POST'])
-def games_get_post():
+@app.route('/teams/<int:team_id>/history')
+@view_cache.cached()
+def team_history(team_id):
+    return _rating_history(team_id=team_id)
+
+
+@app.route('/teams/<int:team_id>/win_probabilities', methods=['GET'])
+@view_cache.cached()
+def team_win_probabilities(team_id):
+    # ?ladder=team|individual|position, and against=<team_id> (repeated) for only some of the other teams
+    ladder = request.args.get('ladder', TEAM_LADDER)
+    if ladder not in LADDERS:
+        return bad_request('Unknown ladder: ' + ladder)
+
+    against = request.args.getlist('against', type=int)
+    try:
+        if against:
+            probabilities = dict((other, win_probabilities.expectancy(ladder, team_id, other)) for other in against)
+        else:
+            probabilities = win_probabilities.against_all(ladder, team_id)
+    except KeyError, e:
+        return bad_request('Unknown team: {}'.format(e))
+
+    return jsonify({'team_id': team_id, 'ladder': ladder, 'win_probabilities': probabilities})
+
+
+@app.route('/games', methods=['GET', 'POST'], defaults={'table_id': None})
+@app.route('/tables/<int:table_id>/games', methods=['GET', 'POST'])
+def games_get_post(table_id):
     #all_players = db.get_all_players()
     all_players = db.get_visible_players()
 
@@ -131,12 +240,24 @@ def games_get_post():
         right_team = db.create_team(defense_player=db.get_player_by_name(right_defense_player_name),
                                     attack_player=db.get_player_by_name(right_attack_player_name))
 
-        game = db.create_update_game(timestamp=timestamp, left_team=left_team, right_team=right_team)
+        game = db.create_update_game(timestamp=timestamp, left_team=left_team, right_team=right_team,
+                                     table_id=table_id or config.DEFAULT_TABLE_ID)
         return redirect(url_for('games_get', timestamp=game.timestamp))
 
     else:
-        all_games = db.get_all_games()
-        return render_template('games.html', players=all_players, games=all_games)
+        filters = dict(player=request.args.get('player'), team=request.args.get('team', type=int))
+        filters = dict((key, value) for key, value in filters.items() if value is not None)
+
+        player = db.get_player_by_name(filters['player']) if 'player' in filters else None
+        if 'player' in filters and not player:
+            return bad_request('Unknown player: ' + filters['player'])
+        games, older = db.get_games_page(before_timestamp=request.args.get('before'),
+                                         before_game_id=request.args.get('before_id', type=int),
+                                         player_id=player.player_id if player else None,
+                                         team_id=filters.get('team'),
+                                         table_id=table_id)
+        return render_template('games.html', players=all_players, games=games, older=older,
+                               is_first_page='before' not in request.args, filters=filters, table_id=table_id)
 
 
 @app.route('/games/<timestamp>', methods=['GET', 'PUT', 'DELETE', 'POST'])
@@ -144,7 +265,7 @@ def games_get(timestamp):
     #all_players = db.get_all_players()
     all_players = db.get_visible_players()
     game = db.get_game_by_timestamp(timestamp)
-    return render_template('game_page.html', game=game, players=all_players)
+    return render_template('game_page.html', game=game, players=all_players, win_probabilities=win_probabilities)
 
 
 @app.route('/games/<timestamp>/delete', methods=['POST'])
@@ -156,9 +277,19 @@ def game_timestamp_delete(timestamp):
     return redirect(url_for('games_get_post'))
 
 
+@app.route('/games/<timestamp>/rebuild_score', methods=['POST'])
+def game_timestamp_rebuild_score(timestamp):
+    # the score back to the sum of the goals logged for the game, after a score was edited by mistake
+    game = db.get_game_by_timestamp(timestamp)
+    if not game:
+        return "Game not found", 404
+
+    db.rebuild_game_score(game.game_id)
+    return redirect(url_for('games_get', timestamp=timestamp))
 
 
 @app.route('/games/ajax/<timestamp>', methods=['GET', 'PUT', 'DELETE', 'POST'])
+@view_cache.cached(time_sensitive=True)
 def games_get_score_and_time(timestamp):
     game = db.get_game_by_timestamp(timestamp)
     output = {'score': "{} x {}".format(game.left_score, game.right_score),
@@ -167,90 +298,202 @@ def games_get_score_and_time(timestamp):
     return jsonify(output)
 
 
+@app.route('/games/<timestamp>/goals', methods=['GET'])
+def games_get_goals(timestamp):
+    game = db.get_game_by_timestamp(timestamp)
+    return jsonify({'goals': db.get_goals(game.game_id)})
+
+
+@app.route('/games/stream/<timestamp>', methods=['GET'])
+def games_stream(timestamp):
+    # subscribe before loading the game so no goal falls in between
+    events = live_scores.events(timestamp)
+    game = db.get_game_by_timestamp(timestamp)
+    if not game:
+        events.close()
+        return "Game not found", 404
+
+    def stream():
+        try:
+            yield sse(game_event(game))
+
+            ended = game.ended
+            while not ended:
+                event = next(events)
+                if event is None:
+                    if game.time_left() < 0:
+                        # out of time, loading the game ends it and publishes the final score
+                        db.get_game_by_timestamp(timestamp)
+                else:
+                    ended = event["ended"]
+                yield sse(event)
+        finally:
+            events.close()
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
 @app.route('/games/<timestamp>/end', methods=['GET'])
 def end_game(timestamp):
-    # ignoring timestamp, close everything
-    db.end_all_opened_games()
+    # close everything on the table of the game
+    game = db.get_game_by_timestamp(timestamp)
+    db.end_all_opened_games(table_id=game.table_id if game else config.DEFAULT_TABLE_ID)
     return redirect(url_for('games_get', timestamp=timestamp))
 
 
-@app.route('/goal/<side>', methods=['POST'])
-def goal(side):
-    goal_value(side, value=1)
+@app.route('/goal/<side>', methods=['POST'], defaults={'table_id': config.DEFAULT_TABLE_ID})
+@app.route('/tables/<int:table_id>/goal/<side>', methods=['POST'])
+def goal(side, table_id):
+    goal_value(side, value=1, table_id=table_id)
     print "Received" + request.data
     return "OK"
 
-@app.route('/goal/<side>/<value>', methods=['POST'])
-def goal_value(side, value):
-    db.goal(side=side, value=int(value))
+@app.route('/goal/<side>/<value>', methods=['POST'], defaults={'table_id': config.DEFAULT_TABLE_ID})
+@app.route('/tables/<int:table_id>/goal/<side>/<value>', methods=['POST'])
+def goal_value(side, value, table_id):
+    goals.put(side=side, value=int(value), device=request.args.get('device'), sequence=request.args.get('sequence', type=int),
+              table_id=table_id)
     print "Received" + request.data
     return "OK"
 
 
-@app.route('/is_game_on', methods=['GET'])
-def is_game_on():
-    game = db.get_open_game()
+@app.route('/goal/queue', methods=['GET'])
+def goal_queue_depth():
+    return jsonify({'depth': goals.depth()})
+
+
+@app.route('/tables', methods=['GET'])
+@view_cache.cached(time_sensitive=True)
+def open_tables():
+    # the games going on at every table, for a live view of all of them
+    tables = []
+    for table_id in db.get_open_tables():
+        game = db.get_open_game(table_id=table_id)
+        if game:
+            tables.append({'table_id': table_id, 'timestamp': game.timestamp, 'score': "{} x {}".format(game.left_score, game.right_score),
+                           'time': game.time_left_string()})
+    return jsonify({'tables': tables})
+
+
+@app.route('/is_game_on', methods=['GET'], defaults={'table_id': config.DEFAULT_TABLE_ID})
+@app.route('/tables/<int:table_id>/is_game_on', methods=['GET'])
+@view_cache.cached(time_sensitive=True)
+def is_game_on(table_id):
+    game = db.get_open_game(table_id=table_id)
     if game:
         return "Yes"
     else:
         return "No"
 
-@app.route('/rankings', methods=['GET'])
-def rankings_get():
-    #all_players = db.get_all_players()
-    all_players = db.get_visible_players()
+def _rankings():
+    return dict(players_ranking=db.get_rankings(PLAYER_RANKING),
+                attack_ranking=db.get_rankings(ATTACK_RANKING),
+                defense_ranking=db.get_rankings(DEFENSE_RANKING),
+                win_perc_ranking=db.get_rankings(WIN_PERC_RANKING),
+                team_ranking=db.get_rankings(TEAM_RANKING))
 
-    players_ranking = list(enumerate(sorted(all_players, key=lambda p: p.player_stats.elo_rating, reverse=True)))
-    attack_ranking = list(enumerate(sorted(all_players, key=lambda p: p.attack_stats.elo_rating, reverse=True)))
-    defense_ranking = list(enumerate(sorted(all_players, key=lambda p: p.defense_stats.elo_rating, reverse=True)))
-    win_perc_ranking = list(enumerate(sorted(all_players, key=lambda p: p.player_stats.perc_win(), reverse=True)))
 
-    all_teams = db.get_all_teams()
-    team_ranking = list(enumerate(sorted(all_teams, key=lambda t: t.team_stats.elo_rating, reverse=True)))
-    return render_template('stats_page.html', players_ranking=players_ranking, attack_ranking=attack_ranking, defense_ranking=defense_ranking, team_ranking=team_ranking, win_perc_ranking=win_perc_ranking)
+@app.route('/rankings', methods=['GET'])
+@view_cache.cached()
+def rankings_get():
+    return render_template('stats_page.html', **_rankings())
 
 @app.route('/elo', methods=['GET'])
+@view_cache.cached()
 def elo_get():
-    #all_players = db.get_all_players()
-    all_players = db.get_visible_players()
+    return render_template('elo_page.html', **_rankings())
 
-    players_ranking = list(enumerate(sorted(all_players, key=lambda p: p.player_stats.elo_rating, reverse=True)))
-    attack_ranking = list(enumerate(sorted(all_players, key=lambda p: p.attack_stats.elo_rating, reverse=True)))
-    defense_ranking = list(enumerate(sorted(all_players, key=lambda p: p.defense_stats.elo_rating, reverse=True)))
-    win_perc_ranking = list(enumerate(sorted(all_players, key=lambda p: p.player_stats.perc_win(), reverse=True)))
 
-    all_teams = db.get_all_teams()
-    team_ranking = list(enumerate(sorted(all_teams, key=lambda t: t.team_stats.elo_rating, reverse=True)))
-    return render_template('elo_page.html', players_ranking=players_ranking, attack_ranking=attack_ranking, defense_ranking=defense_ranking, team_ranking=team_ranking, win_perc_ranking=win_perc_ranking)
 
 
+@app.route('/matchmaking', methods=['GET'])
+@view_cache.cached()
+def matchmaking_get():
+    # /matchmaking?player=<name>&player=<name>... with the 4 to 20 players present
+    names = request.args.getlist('player')
+    players = [db.get_player_by_name(name=name) for name in names]
+    unknown = [name for name, player in zip(names, players) if player is None]
+    if unknown:
+        return bad_request('Unknown players: ' + ', '.join(unknown))
+
+    try:
+        matchups = db.get_balanced_matchups([player.player_id for player in players],
+                                            limit=request.args.get('limit', default=config.MATCHMAKING_RESULTS, type=int))
+    except ValueError, e:
+        return bad_request(str(e))
+
+    names = dict((player.player_id, player.name) for player in players)
+    return jsonify({'matchups': [{'left': {'defense': names[matchup.left_defense_id], 'attack': names[matchup.left_attack_id]},
+                                  'right': {'defense': names[matchup.right_defense_id], 'attack': names[matchup.right_attack_id]},
+                                  'expectancy': {'player': matchup.player_expectancy,
+                                                 'position': matchup.position_expectancy,
+                                                 'team': matchup.team_expectancy},
+                                  'imbalance': matchup.imbalance}
+                                 for matchup in matchups]})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_get():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/redo_stats', methods=['GET'])
 def redo_stats():
-    db.recalculate_stats()
+    # ?parallel=1 replays the three rating ladders in their own processes
+    db.recalculate_stats(parallel=request.args.get('parallel', 0, type=int) == 1)
     return "Stats recalculated"
 
 
+@app.route('/compact_stats', methods=['POST'])
+def compact_stats():
+    # ?before=<timestamp>: before it the stats history keeps only the last stats of each day
+    before = request.args.get('before', '')
+    try:
+        tools.get_timestamp_after(before, 0)
+    except ValueError:
+        return bad_request("before must be a timestamp like {}".format(config.FIRST_TIMESTAMP))
+
+    return "{} stats rows compacted".format(db.compact_stats_history(before_timestamp=before))
+
+
 photos = UploadSet('photos', IMAGES)
 
 def flask_main():
-    app.run(debug=True, host='0.0.0.0', threaded=False, port=7008)
+    app.run(debug=True, host='0.0.0.0', threaded=True, port=7008)
 
-def tornado_main():
-    from tornado.wsgi import WSGIContainer
+def tornado_main(processes=config.WORKER_PROCESSES):
     from tornado.httpserver import HTTPServer
-    from tornado.ioloop import IOLoop
+    from tornado.ioloop import IOLoop, PeriodicCallback
+    from tornado.netutil import bind_sockets
+    from tornado.process import fork_processes
+
+    from tornado_app import make_application
 
     try:
-        http_server = HTTPServer(WSGIContainer(app))
-        http_server.listen(int(7008))
-        IOLoop.instance().start()
+        sockets = bind_sockets(int(7008))
+        if processes != 1:
+            # threads and SQLite connections don't survive a fork, every worker opens its own
+            goals.close()
+            db.close()
+            metrics.share(config.METRICS_DIRECTORY)
+            fork_processes(processes)
+            db.start()
+            # the other workers write too, the ETags have to follow the database
+            db.shared = True
+            goals.start()
+            PeriodicCallback(metrics.save, config.METRICS_SAVE_SECONDS * 1000).start()
+
+        application = make_application(app, db=db, goals=goals, live_scores=live_scores, view_cache=view_cache,
+                                       poll_changes=processes != 1)
+        http_server = HTTPServer(application)
+        http_server.add_sockets(sockets)
+        IOLoop.current().start()
     except Exception, e:
         print "Application crashed...", str(e)
 
 
 if __name__ == '__main__':
+    logging.basicConfig()
     tornado_main()
 
 
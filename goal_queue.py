@@ -0,0 +1,107 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+import Queue
+
+from models import GoalEvent
+import config
+import metrics
+import tools
+
+
+logger = logging.getLogger(__name__)
+
+
+class GoalQueue:
+    """
+        Write-behind queue of goal events: put() returns at once and a background thread applies the queued
+        goals in batches, one DBAccess.goals call (and one commit) per table in a batch. A failed write is tried
+        again config.GOAL_WRITE_ATTEMPTS times before its goals are dropped.
+    """
+
+    def __init__(self, db, batch_size=100):
+        self.db = db
+        self.batch_size = batch_size
+
+        self._events = Queue.Queue()
+        self.start()
+
+        # goals still in the queue are written before the interpreter goes away
+        atexit.register(self.close)
+
+    def start(self):
+        """
+            Start the background thread, again after close() in a forked worker process
+        """
+        self._thread = threading.Thread(target=self._drain_loop, name="goal-queue")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, side, value=1, device=None, sequence=None, table_id=config.DEFAULT_TABLE_ID):
+        event = GoalEvent(side=side, value=value, timestamp=tools.get_timestamp_for_now(), device=device, sequence=sequence,
+                          table_id=table_id)
+        self._events.put((time.time(), event))
+
+    def depth(self):
+        """
+            Number of goal events waiting to be written
+        """
+        return self._events.qsize()
+
+    def flush(self):
+        """
+            Wait until every goal queued so far is written
+        """
+        self._events.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._events.put(None)
+            self._thread.join()
+
+    def _next_batch(self):
+        batch = [self._events.get()]
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self._events.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _drain_loop(self):
+        while True:
+            batch = self._next_batch()
+            events = filter(None, batch)
+            try:
+                # each table is written in its own transaction, so a failure is retried for that table alone
+                tables = collections.OrderedDict()
+                for received, event in events:
+                    tables.setdefault(event.table_id, []).append((received, event))
+                for table_events in tables.values():
+                    self._write(table_events)
+            finally:
+                for _ in batch:
+                    self._events.task_done()
+
+            if len(events) < len(batch):
+                break
+
+    def _write(self, events):
+        for attempt in range(1, config.GOAL_WRITE_ATTEMPTS + 1):
+            try:
+                self.db.goals([event for _, event in events])
+            except Exception:
+                logger.exception("Could not write %d goals, attempt %d of %d", len(events), attempt, config.GOAL_WRITE_ATTEMPTS)
+                if attempt < config.GOAL_WRITE_ATTEMPTS:
+                    time.sleep(config.GOAL_WRITE_RETRY_SECONDS * attempt)
+                continue
+
+            written = time.time()
+            for received, _ in events:
+                metrics.GOAL_LAG_SECONDS.observe(written - received)
+            return
+
+        metrics.GOALS_DROPPED.inc(amount=len(events))
+        logger.error("Dropped %d goals: %s", len(events), [event for _, event in events])
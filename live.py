@@ -0,0 +1,199 @@
+import datetime
+import json
+import threading
+import Queue
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue as TornadoQueue
+from tornado.web import RequestHandler, HTTPError
+
+
+# Seconds between keepalive comments on an idle stream, also how often a stream checks the game time
+KEEPALIVE_SECONDS = 15
+
+
+def game_event(game):
+    return dict(score="{} x {}".format(game.left_score, game.right_score),
+                time=game.time_left_string(),
+                time_left=game.time_left(),
+                ended=bool(game.ended))
+
+
+def sse(event):
+    """
+        An event as a Server-Sent Events message, a keepalive comment for None
+    """
+    if event is None:
+        return ": keepalive\n\n"
+    return "data: {}\n\n".format(json.dumps(event))
+
+
+class LiveScores:
+    """
+        Pushes the score changes of a game to the pages watching it. DBAccess publishes every change it writes and
+        each stream subscribes to its game, so the work done follows the goals and not the number of viewers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        # (score, ended) last published for each watched game
+        self._published = {}
+
+    def publish(self, game, only_changes=False):
+        event = game_event(game)
+        with self._lock:
+            published = (event["score"], event["ended"])
+            if only_changes and self._published.get(game.timestamp) == published:
+                return
+            if game.timestamp in self._subscribers:
+                self._published[game.timestamp] = published
+            callbacks = list(self._subscribers.get(game.timestamp, ()))
+        for callback in callbacks:
+            callback(event)
+
+    def timestamps(self):
+        """
+            The games being watched
+        """
+        with self._lock:
+            return self._subscribers.keys()
+
+    def subscribe(self, timestamp, callback):
+        with self._lock:
+            self._subscribers.setdefault(timestamp, set()).add(callback)
+
+    def unsubscribe(self, timestamp, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(timestamp, set())
+            callbacks.discard(callback)
+            if not callbacks:
+                self._subscribers.pop(timestamp, None)
+                self._published.pop(timestamp, None)
+
+    def viewers(self):
+        with self._lock:
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+    def events(self, timestamp, timeout=KEEPALIVE_SECONDS):
+        """
+            For threaded servers: subscribe now, iterate the returned Subscription and close it when done
+        """
+        return Subscription(self, timestamp, timeout)
+
+
+class Subscription:
+    """
+        The events published for a game, None after timeout seconds without one
+    """
+
+    def __init__(self, live_scores, timestamp, timeout):
+        self.live_scores = live_scores
+        self.timestamp = timestamp
+        self.timeout = timeout
+
+        self._events = Queue.Queue()
+        self.live_scores.subscribe(self.timestamp, self._events.put)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self._events.get(timeout=self.timeout)
+        except Queue.Empty:
+            return None
+
+    def close(self):
+        self.live_scores.unsubscribe(self.timestamp, self._events.put)
+
+
+class LiveScoreHandler(RequestHandler):
+    """
+        The live score stream served from the Tornado IOLoop, so a viewer costs an open socket and not a thread.
+        The game is loaded on the executor, the IOLoop never waits on the database.
+    """
+
+    def initialize(self, live_scores, load_game, executor):
+        self.live_scores = live_scores
+        self.load_game = load_game
+        self.executor = executor
+
+    @gen.coroutine
+    def get(self, timestamp):
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        events = TornadoQueue()
+        io_loop = IOLoop.current()
+
+        def callback(event):
+            io_loop.add_callback(events.put, event)
+
+        # subscribe before loading the game so no goal falls in between
+        self.live_scores.subscribe(timestamp, callback)
+        try:
+            game = yield self.executor.submit(self.load_game, timestamp)
+            if game is None:
+                raise HTTPError(404)
+
+            self.write(sse(game_event(game)))
+            yield self.flush()
+
+            ended = game.ended
+            while not ended:
+                try:
+                    event = yield events.get(timeout=datetime.timedelta(seconds=KEEPALIVE_SECONDS))
+                    ended = event["ended"]
+                except gen.TimeoutError:
+                    event = None
+                    if game.time_left() < 0:
+                        # out of time, loading the game ends it and publishes the final score
+                        yield self.executor.submit(self.load_game, timestamp)
+
+                self.write(sse(event))
+                yield self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.live_scores.unsubscribe(timestamp, callback)
+
+
+class ChangePoller:
+    """
+        With several worker processes the goals of a game may be written by another process than the one streaming
+        it. This checks the shared data version every interval seconds and, when it changed, loads the watched
+        games again and publishes the ones whose score changed.
+    """
+
+    def __init__(self, live_scores, get_version, load_game, executor, interval=0.5):
+        self.live_scores = live_scores
+        self.get_version = get_version
+        self.load_game = load_game
+        self.executor = executor
+        self.interval = interval
+
+        self._version = None
+        self._polling = False
+
+    def start(self):
+        PeriodicCallback(self.poll, self.interval * 1000).start()
+
+    @gen.coroutine
+    def poll(self):
+        if self._polling:
+            return
+
+        self._polling = True
+        try:
+            version = yield self.executor.submit(self.get_version)
+            if version != self._version:
+                self._version = version
+                for timestamp in self.live_scores.timestamps():
+                    game = yield self.executor.submit(self.load_game, timestamp)
+                    if game is not None:
+                        self.live_scores.publish(game, only_changes=True)
+        finally:
+            self._polling = False
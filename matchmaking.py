@@ -0,0 +1,157 @@
+"""
+    The most balanced 2 vs 2 games among the players present, rated on the individual, position and team ladders.
+"""
+import bisect
+import collections
+import heapq
+import itertools
+import math
+
+import elo
+
+
+MIN_PLAYERS = 4
+MAX_PLAYERS = 20
+
+# each side is first matched against the sides this close to it on each ladder
+NEIGHBOURS = 3
+
+# ways of sharing the worst imbalance still wanted between the individual, position and team ladders
+SHARES = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0), (0.5, 0.5, 0.0), (0.5, 0.0, 0.5), (0.0, 0.5, 0.5),
+          (1 / 3.0, 1 / 3.0, 1 / 3.0))
+
+# Current elo ratings: player, attack and defense by player id, team by (defense player id, attack player id);
+# whoever is missing has the initial rating
+Ratings = collections.namedtuple("Ratings", ["player", "attack", "defense", "team"])
+
+# The expectancies are those of the left side winning, imbalance is how far they are from an even game on average
+Matchup = collections.namedtuple("Matchup", ["left_defense_id", "left_attack_id", "right_defense_id", "right_attack_id",
+                                             "player_expectancy", "position_expectancy", "team_expectancy", "imbalance"])
+
+
+def _rating(ratings, key):
+    return ratings.get(key, elo.INITIAL_RATING)
+
+
+def balanced_matchups(player_ids, ratings, limit=10):
+    """
+        The limit most balanced matchups of four of the players, with who defends and who attacks, most balanced first
+    """
+    player_ids = sorted(set(player_ids))
+    if not MIN_PLAYERS <= len(player_ids) <= MAX_PLAYERS:
+        raise ValueError("Matchmaking needs {} to {} players, not {}".format(MIN_PLAYERS, MAX_PLAYERS, len(player_ids)))
+    if limit < 1:
+        return []
+
+    search = _MatchupSearch(player_ids, ratings, limit)
+    # the closest sides first, to bring the worst of the best down early
+    for ladder in range(len(search.ladders)):
+        search.scan(ladder, 1.0, NEIGHBOURS)
+    # A matchup more balanced than the worst is more balanced than its share of the worst on at least one ladder,
+    # whatever the shares, so only the ladders of the shares leaving the fewest pairs of sides need to be gone through
+    shares = min(SHARES, key=search.count)
+    for ladder, share in enumerate(shares):
+        if share:
+            search.scan(ladder, share, len(search.sides))
+
+    return sorted((_matchup(ratings, *side_ids) for _, side_ids in search.best), key=lambda matchup: (matchup.imbalance, matchup[:4]))
+
+
+def _power(rating):
+    return math.pow(10.0, rating / elo.F)
+
+
+class _MatchupSearch:
+    """
+        The best matchups found so far, and the sides sorted on each ladder to look for better ones
+    """
+
+    def __init__(self, player_ids, ratings, limit):
+        # A side is a defender and an attacker. The expectancy of a rating a against a rating b is
+        # 10^(a/F) / (10^(a/F) + 10^(b/F)), so with those powers computed once per side and ladder, how far a matchup
+        # is from an even game on a ladder takes a division instead of a power: |pa - pb| / (pa + pb) is twice that.
+        self.sides = list(itertools.permutations(player_ids, 2))
+        self.powers = ([_power(_rating(ratings.player, defense_id) + _rating(ratings.player, attack_id)) for defense_id, attack_id in self.sides],
+                       [_power(_rating(ratings.defense, defense_id) + _rating(ratings.attack, attack_id)) for defense_id, attack_id in self.sides],
+                       [_power(_rating(ratings.team, side)) for side in self.sides])
+        # On each ladder the sides sorted by power get less balanced against a side the further up they are
+        self.ladders = [sorted(xrange(len(self.sides)), key=powers.__getitem__) for powers in self.powers]
+        self.sorted_powers = [[powers[k] for k in ordered] for powers, ordered in zip(self.powers, self.ladders)]
+        # the weaker pair of players is on the left, like the players of a side are in order of player id
+        self.order = [(self.powers[0][k], min(side), max(side)) for k, side in enumerate(self.sides)]
+
+        self.limit = limit
+        # the worst of the best matchups so far on top, in sums of the three |pa - pb| / (pa + pb), six times the
+        # imbalance; a matchup has to be more balanced than the worst to get in
+        self.best = []
+        self.worst = float("inf")
+        self.seen = set()
+
+    def _ratio(self, share):
+        # how many times the power of a side the sides further up are when as unbalanced against it as share of the worst
+        bound = share * self.worst
+        return (1 + bound) / (1 - bound) if bound < 1 else float("inf")
+
+    def count(self, shares):
+        """
+            How many pairs of sides are more balanced than their share of the worst on a ladder, over the ladders
+        """
+        count = 0
+        for ladder, share in enumerate(shares):
+            if share:
+                ratio = self._ratio(share)
+                sorted_powers = self.sorted_powers[ladder]
+                count += sum(bisect.bisect_left(sorted_powers, power * ratio, i + 1) - i - 1 for i, power in enumerate(sorted_powers))
+        return count
+
+    def scan(self, ladder, share, reach):
+        """
+            Tries each side against the sides up to reach further up the ladder, as long as they are more balanced
+            against it than share of the worst
+        """
+        powers = self.powers[ladder]
+        ordered = self.ladders[ladder]
+        player_powers, position_powers, team_powers = self.powers
+        sides, order, seen, best = self.sides, self.order, self.seen, self.best
+        for i, k in enumerate(ordered):
+            a, b = sides[k]
+            bound = powers[k] * self._ratio(share)
+            for j in xrange(i + 1, min(i + 1 + reach, len(ordered))):
+                m = ordered[j]
+                if powers[m] >= bound:
+                    break
+                c, d = sides[m]
+                if c == a or c == b or d == a or d == b:
+                    continue
+                left, right = (k, m) if order[k] < order[m] else (m, k)
+                if (left, right) in seen:
+                    continue
+                seen.add((left, right))
+
+                p, q = player_powers[left], player_powers[right]
+                imbalance = abs(p - q) / (p + q)
+                p, q = position_powers[left], position_powers[right]
+                imbalance += abs(p - q) / (p + q)
+                p, q = team_powers[left], team_powers[right]
+                imbalance += abs(p - q) / (p + q)
+                if imbalance >= self.worst:
+                    continue
+                if len(best) < self.limit:
+                    heapq.heappush(best, (-imbalance, sides[left] + sides[right]))
+                else:
+                    heapq.heapreplace(best, (-imbalance, sides[left] + sides[right]))
+                if len(best) == self.limit:
+                    self.worst = -best[0][0]
+                    bound = powers[k] * self._ratio(share)
+
+
+def _matchup(ratings, left_defense_id, left_attack_id, right_defense_id, right_attack_id):
+    player_expectancy = elo.wining_expectancy(_rating(ratings.player, left_defense_id) + _rating(ratings.player, left_attack_id) -
+                                              _rating(ratings.player, right_defense_id) - _rating(ratings.player, right_attack_id))
+    position_expectancy = elo.wining_expectancy(_rating(ratings.defense, left_defense_id) + _rating(ratings.attack, left_attack_id) -
+                                                _rating(ratings.defense, right_defense_id) - _rating(ratings.attack, right_attack_id))
+    team_expectancy = elo.wining_expectancy(_rating(ratings.team, (left_defense_id, left_attack_id)) -
+                                            _rating(ratings.team, (right_defense_id, right_attack_id)))
+    imbalance = (abs(player_expectancy - 0.5) + abs(position_expectancy - 0.5) + abs(team_expectancy - 0.5)) / 3
+    return Matchup(left_defense_id, left_attack_id, right_defense_id, right_attack_id, player_expectancy, position_expectancy,
+                   team_expectancy, imbalance)
@@ -0,0 +1,306 @@
+"""
+    Counters, gauges and histograms of the server, served on /metrics in the Prometheus text format.
+
+    Cheap enough to leave on: an update is a lock and an addition, the text is only built when scraped.
+    Worker processes of a prefork server each count their own, see share.
+"""
+import bisect
+import cPickle as pickle
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REGISTRY = []
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join("{}=\"{}\"".format(name, value) for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def add(values, other):
+        for labels, value in other.items():
+            values[labels] = values.get(labels, 0) + value
+        return values
+
+    def lines(self, values):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} counter".format(self.name)
+        for labels, value in sorted(values.items()):
+            yield "{}{} {}".format(self.name, _labels_text(self.labels, labels), _number(value))
+
+
+class Gauge:
+    """
+        A value read when scraped, from a function set with set_function
+    """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.function = None
+        REGISTRY.append(self)
+
+    def set_function(self, function):
+        self.function = function
+
+    def snapshot(self):
+        return self.function() if self.function is not None else None
+
+    @staticmethod
+    def add(value, other):
+        if value is None or other is None:
+            return other if value is None else value
+        return value + other
+
+    def lines(self, value):
+        if value is None:
+            return
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} gauge".format(self.name)
+        yield "{} {}".format(self.name, _number(value))
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+
+        self._lock = threading.Lock()
+        # labels: [count per bucket (not cumulative) and one for +Inf, sum]
+        self._values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+
+    @staticmethod
+    def add(values, other):
+        for labels, (counts, total) in other.items():
+            if labels in values:
+                counts_so_far, total_so_far = values[labels]
+                counts, total = [a + b for a, b in zip(counts_so_far, counts)], total_so_far + total
+            values[labels] = (counts, total)
+        return values
+
+    def lines(self, values):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} histogram".format(self.name)
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield "{}_bucket{} {}".format(self.name, _labels_text(self.labels, labels, [("le", bound)]), cumulative)
+            yield "{}_sum{} {}".format(self.name, _labels_text(self.labels, labels), _number(total))
+            yield "{}_count{} {}".format(self.name, _labels_text(self.labels, labels), cumulative)
+
+
+# set by share: the directory where the worker processes save their values
+_shared_directory = None
+_save_lock = threading.Lock()
+
+
+def share(directory):
+    """
+        Before forking the worker processes of a prefork server. A scrape is answered by whichever worker accepts it,
+        so each one saves its values in directory (see save) and render adds up those every worker saved last.
+        The values of a worker that died stay in, its counters still count towards the totals.
+    """
+    global _shared_directory
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for path in glob.glob(os.path.join(directory, "*.metrics")):
+        os.remove(path)
+    _shared_directory = directory
+
+
+def save():
+    """
+        Save the values of this process for render in the other worker processes, call it every few seconds
+    """
+    path = os.path.join(_shared_directory, "{}.metrics".format(os.getpid()))
+    with _save_lock:
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump([metric.snapshot() for metric in REGISTRY], f, pickle.HIGHEST_PROTOCOL)
+        # readers only ever see whole files
+        os.rename(path + ".tmp", path)
+
+
+def _worker_values():
+    save()
+    totals = None
+    for path in glob.glob(os.path.join(_shared_directory, "*.metrics")):
+        with open(path, "rb") as f:
+            values = pickle.load(f)
+        totals = values if totals is None else [metric.add(total, value) for metric, total, value in zip(REGISTRY, totals, values)]
+    return totals
+
+
+def render():
+    """
+        Every metric in the Prometheus text exposition format, added up over the worker processes if shared
+    """
+    values = _worker_values() if _shared_directory is not None else [metric.snapshot() for metric in REGISTRY]
+    return "\n".join(line for metric, value in zip(REGISTRY, values) for line in metric.lines(value)) + "\n"
+
+
+REQUEST_SECONDS = Histogram("foosball_request_duration_seconds", "Time to answer a request", labels=("endpoint",))
+REQUEST_STATEMENTS = Histogram("foosball_request_sql_statements", "SQL statements run for a request, including its writes",
+                               buckets=STATEMENT_BUCKETS, labels=("endpoint",))
+REQUEST_SQL_SECONDS = Histogram("foosball_request_sql_seconds", "Time spent executing SQL statements for a request", labels=("endpoint",))
+
+SQL_STATEMENTS = Counter("foosball_sql_statements_total", "SQL statements executed")
+SQL_SECONDS = Counter("foosball_sql_statement_seconds_total", "Time spent executing SQL statements")
+SQL_COMMITS = Counter("foosball_sql_commits_total", "Transactions committed")
+
+VIEW_CACHE = Counter("foosball_view_cache_requests_total", "Read views answered by the view cache", labels=("result",))
+
+GOAL_LAG_SECONDS = Histogram("foosball_goal_ingestion_lag_seconds", "Time from receiving a goal to its write being committed")
+GOALS_DROPPED = Counter("foosball_goals_dropped_total", "Goal events the goal queue could not write")
+GOAL_QUEUE_DEPTH = Gauge("foosball_goal_queue_depth", "Goal events waiting to be written")
+WRITE_QUEUE_DEPTH = Gauge("foosball_db_write_queue_depth", "Writes waiting for the writer thread")
+LIVE_VIEWERS = Gauge("foosball_live_viewers", "Open live score streams")
+
+
+# SQL statements of the current request, also counted for the writes it waits on
+
+class Tally:
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+_local = threading.local()
+
+
+def begin_tally():
+    _local.tally = Tally()
+
+
+def end_tally():
+    tally = getattr(_local, "tally", None)
+    _local.tally = None
+    return tally
+
+
+def carry(function):
+    """
+        function counting its statements in the tally of the calling thread, whatever thread runs it
+    """
+    tally = getattr(_local, "tally", None)
+    if tally is None:
+        return function
+
+    def carried(*args, **kwargs):
+        _local.tally = tally
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.tally = None
+    return carried
+
+
+# a slow_queries.SlowQueryLog, to log the statements slower than its threshold
+slow_query_log = None
+
+
+def _statement_done(seconds):
+    SQL_STATEMENTS.inc()
+    SQL_SECONDS.inc(amount=seconds)
+    tally = getattr(_local, "tally", None)
+    if tally is not None:
+        tally.statements += 1
+        tally.seconds += seconds
+
+
+class MetricsCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        started = time.time()
+        try:
+            return sqlite3.Cursor.execute(self, sql, parameters)
+        finally:
+            seconds = time.time() - started
+            _statement_done(seconds)
+            if slow_query_log is not None and seconds >= slow_query_log.threshold:
+                slow_query_log.record(self.connection, sql, parameters, seconds)
+
+    def executemany(self, sql, parameters):
+        started = time.time()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, parameters)
+        finally:
+            seconds = time.time() - started
+            _statement_done(seconds)
+            if slow_query_log is not None and seconds >= slow_query_log.threshold:
+                slow_query_log.record(self.connection, sql, parameters, seconds, many=True)
+
+
+class MetricsConnection(sqlite3.Connection):
+    """
+        Use as ConnectionPool.connection_factory to count and time the statements and commits
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        sqlite3.Connection.__init__(self, database, *args, **kwargs)
+        # for slow_queries to explain the statements on a connection of its own
+        self.database = database
+
+    def cursor(self, factory=MetricsCursor):
+        # Connection.execute and executemany go through here as well
+        return sqlite3.Connection.cursor(self, factory)
+
+    def commit(self):
+        sqlite3.Connection.commit(self)
+        SQL_COMMITS.inc()
@@ -0,0 +1,183 @@
+"""
+    Schema migrations of the foosball database.
+
+    Each migration takes a cursor and brings the schema one version up. They run in order, once, and the version
+    reached is recorded in the schema_version table. A migration returns True when the stats must be recalculated
+    afterwards. Migrations must be safe to run again, as SQLite commits before each schema change.
+"""
+import config
+
+
+def create_tables(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS players (player_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                       name TEXT, photo TEXT,
+                                                       player_stats_id INT, attack_stats_id INT, defense_stats_id INT)""")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS teams (team_id INTEGER PRIMARY KEY AUTOINCREMENT, defense_player_id INT, attack_player_id INT, team_stats_id INT)")
+    cur.execute("CREATE TABLE IF NOT EXISTS games (game_id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, left_team_id INT, right_team_id INT, left_score INT, right_score INT, ended INT)")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS stats (stats_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                            player_id INT, attack_player_id INT, defense_player_id INT, team_id INT,
+                                            wins INT, draws INT, losses INT,
+                                            goals_pro INT, goals_against INT,
+                                            elo_rating NUMBER,
+                                            timestamp TEXT)
+        """)
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS hidden_players (player_id INTEGER)""")
+
+
+def add_indexes(cur):
+    # latest stats of a player, position or team (get_all_stats, increment_stats, recalculate_stats_from)
+    cur.execute("CREATE INDEX IF NOT EXISTS stats_player_id_timestamp ON stats(player_id, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS stats_attack_player_id_timestamp ON stats(attack_player_id, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS stats_defense_player_id_timestamp ON stats(defense_player_id, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS stats_team_id_timestamp ON stats(team_id, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS stats_timestamp ON stats(timestamp)")
+
+    # get_open_game, get_game_by_timestamp and the games listing
+    cur.execute("CREATE INDEX IF NOT EXISTS games_ended_game_id ON games(ended, game_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS games_timestamp ON games(timestamp)")
+
+    # get_player_by_name compares names case insensitively
+    cur.execute("CREATE INDEX IF NOT EXISTS players_name ON players(name COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS hidden_players_player_id ON hidden_players(player_id)")
+
+    # create_team lookup; older databases may have the same team twice, keep the first one
+    merged = _merge_duplicate_teams(cur)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS teams_defense_player_id_attack_player_id ON teams(defense_player_id, attack_player_id)")
+
+    return merged
+
+
+def _merge_duplicate_teams(cur):
+    cur.execute("SELECT defense_player_id, attack_player_id, MIN(team_id) FROM teams " +
+                "GROUP BY defense_player_id, attack_player_id HAVING COUNT(*) > 1")
+    duplicated = list(cur.fetchall())
+
+    for defense_player_id, attack_player_id, team_id in duplicated:
+        team_dict = dict(defense_player_id=defense_player_id, attack_player_id=attack_player_id, team_id=team_id)
+        duplicates = "SELECT team_id FROM teams WHERE defense_player_id = :defense_player_id AND attack_player_id = :attack_player_id AND team_id != :team_id"
+        cur.execute("UPDATE games SET left_team_id = :team_id WHERE left_team_id IN ({})".format(duplicates), team_dict)
+        cur.execute("UPDATE games SET right_team_id = :team_id WHERE right_team_id IN ({})".format(duplicates), team_dict)
+        cur.execute("DELETE FROM stats WHERE team_id IN ({})".format(duplicates), team_dict)
+        cur.execute("DELETE FROM teams WHERE team_id IN ({})".format(duplicates), team_dict)
+
+    return len(duplicated) > 0
+
+
+def add_current_stats(cur):
+    # the newest stats of each player, position and team, updated in place; stats keeps the history.
+    # players.*_stats_id and teams.team_stats_id are no longer maintained
+    cur.execute("""CREATE TABLE IF NOT EXISTS current_stats (stats_id INTEGER PRIMARY KEY,
+                                                    player_id INT, attack_player_id INT, defense_player_id INT, team_id INT,
+                                                    wins INT, draws INT, losses INT,
+                                                    goals_pro INT, goals_against INT,
+                                                    elo_rating NUMBER,
+                                                    timestamp TEXT)
+        """)
+    for column in ("player_id", "attack_player_id", "defense_player_id", "team_id"):
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS current_stats_{column} ON current_stats({column})".format(column=column))
+
+        cur.execute("""INSERT OR REPLACE INTO current_stats
+                       SELECT * FROM stats s
+                       WHERE s.{column} IS NOT NULL
+                         AND s.stats_id = (SELECT stats_id FROM stats WHERE {column} = s.{column} ORDER BY timestamp DESC, stats_id DESC LIMIT 1)
+                    """.format(column=column))
+
+    # the history before compacted_until only keeps the last stats of each day
+    cur.execute("CREATE TABLE IF NOT EXISTS stats_compactions (compacted_until TEXT)")
+
+
+def add_goals(cur):
+    # every goal as received, games.left_score and right_score are the sums of their goals
+    cur.execute("""CREATE TABLE IF NOT EXISTS goals (goal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                            game_id INT, side TEXT, value INT,
+                                            timestamp TEXT,
+                                            device TEXT, sequence INT)
+        """)
+    cur.execute("CREATE INDEX IF NOT EXISTS goals_game_id ON goals(game_id, goal_id)")
+    # a device retrying a goal sends the same sequence number again
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS goals_device_sequence ON goals(device, sequence)")
+
+    # older games only have their final score
+    cur.execute("DELETE FROM goals WHERE device IS NULL AND game_id IN (SELECT game_id FROM games)")
+    for side in ("left", "right"):
+        cur.execute("""INSERT INTO goals(game_id, side, value, timestamp)
+                       SELECT game_id, '{side}', {side}_score, timestamp FROM games WHERE {side}_score != 0
+                    """.format(side=side))
+
+
+def add_rankings(cur):
+    # leaderboard positions, kept up to date by DBAccess when stats or hidden players change
+    cur.execute("""CREATE TABLE IF NOT EXISTS rankings (board TEXT, entity_id INT, position INT, previous_position INT,
+                                                        PRIMARY KEY (board, entity_id))""")
+    cur.execute("CREATE INDEX IF NOT EXISTS rankings_board_position ON rankings(board, position)")
+
+
+def add_table_ids(cur):
+    # one server for many tables, each with its own open game; the games so far were played on the default table
+    cur.execute("PRAGMA table_info(games)")
+    if "table_id" not in [column[1] for column in cur.fetchall()]:
+        cur.execute("ALTER TABLE games ADD COLUMN table_id INT NOT NULL DEFAULT {}".format(config.DEFAULT_TABLE_ID))
+
+    # get_open_game of a table
+    cur.execute("CREATE INDEX IF NOT EXISTS games_table_id_ended_game_id ON games(table_id, ended, game_id)")
+
+
+def add_meta(cur):
+    # data_version is bumped by every write, worker processes sharing the database compare it to see each other's writes
+    cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+    cur.execute("INSERT OR IGNORE INTO meta(key, value) VALUES('data_version', 0)")
+
+
+def add_ratings_epoch(cur):
+    # bumped when current stats are rewritten in place, instead of superseded by newer stats rows
+    cur.execute("INSERT OR IGNORE INTO meta(key, value) VALUES('ratings_epoch', 0)")
+
+
+def add_ranking_values(cur):
+    # the value each entity is ranked by, so a game re-ranks its own players and teams among the others without re-reading every board
+    cur.execute("PRAGMA table_info(rankings)")
+    if "value" not in [column[1] for column in cur.fetchall()]:
+        cur.execute("ALTER TABLE rankings ADD COLUMN value NUMBER")
+    cur.execute("CREATE INDEX IF NOT EXISTS rankings_board_value ON rankings(board, value)")
+
+
+def add_goals_per_game(cur):
+    # a sequence number only has to be unique within a game, a board restarted with the same boot id still scores in the next games
+    cur.execute("DROP INDEX IF EXISTS goals_device_sequence")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS goals_game_id_device_sequence ON goals(game_id, device, sequence)")
+
+
+MIGRATIONS = [
+    create_tables,
+    add_indexes,
+    add_current_stats,
+    add_goals,
+    add_rankings,
+    add_table_ids,
+    add_meta,
+    add_ratings_epoch,
+    add_ranking_values,
+    add_goals_per_game,
+]
+
+
+def migrate(con):
+    """
+        Bring the database up to the latest schema version, returns True if the stats must be recalculated
+    """
+    cur = con.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)")
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    version = cur.fetchone()[0] or 0
+
+    recalculate_stats = False
+    for migration_version, migration in enumerate(MIGRATIONS, 1):
+        if migration_version > version:
+            recalculate_stats = migration(cur) or recalculate_stats
+            cur.execute("INSERT INTO schema_version(version) VALUES(:version)", dict(version=migration_version))
+            con.commit()
+
+    return recalculate_stats
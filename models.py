@@ -1,6 +1,16 @@
+import collections
+
 import config
 import tools
 import elo
+import stats_replay
+
+
+# A goal as sent by the table or the game page, device and sequence identify retries of the same goal
+GoalEvent = collections.namedtuple("GoalEvent", ["side", "value", "timestamp", "device", "sequence", "table_id"])
+
+# A place on a leaderboard, entity being a Player or a Team; positions start at 1
+Ranking = collections.namedtuple("Ranking", ["position", "previous_position", "entity"])
 
 
 class Player(object):
@@ -23,6 +33,10 @@ class Team(object):
         self.attack_player = attack_player
         self.team_stats = team_stats
 
+    @property
+    def pair(self):
+        return self.defense_player.player_id, self.attack_player.player_id
+
     def summary(self):
         if self.defense_player == self.attack_player:
             return "{defense}".format(defense=self.defense_player.name)
@@ -31,7 +45,7 @@ class Team(object):
 
 
 class Game(object):
-    def __init__(self, game_id, timestamp, left_team, right_team, left_score=0, right_score=0, ended=0):
+    def __init__(self, game_id, timestamp, left_team, right_team, left_score=0, right_score=0, ended=0, table_id=config.DEFAULT_TABLE_ID):
         self.game_id = game_id
         self.timestamp = timestamp
         self.left_team = left_team
@@ -39,6 +53,7 @@ class Game(object):
         self.left_score = left_score
         self.right_score = right_score
         self.ended = ended
+        self.table_id = table_id
 
     def goal_scored(self, side, value=1):
         if side == config.RIGHT:
@@ -66,31 +81,43 @@ class Game(object):
 
         return should_end
 
-    def predicted_player_score(self):
-        elo_left = (self.left_team.defense_player.player_stats.elo_rating + self.left_team.attack_player.player_stats.elo_rating)
-        elo_right = (self.right_team.defense_player.player_stats.elo_rating + self.right_team.attack_player.player_stats.elo_rating)
-        #diff = self.left_team.team_stats.elo_rating - self.right_team.team_stats.elo_rating
-        diff = elo_left - elo_right
-        predicted_left_score, predicted_right_score = elo.predicted_score(diff=diff, MAX_SCORE=config.GAME_GOAL_LIMIT)
+    def predicted_player_score(self, win_probabilities=None):
+        if win_probabilities is not None:
+            expected = win_probabilities.pairing_expectancy(stats_replay.INDIVIDUAL_LADDER, self.left_team.pair, self.right_team.pair)
+        else:
+            elo_left = (self.left_team.defense_player.player_stats.elo_rating + self.left_team.attack_player.player_stats.elo_rating)
+            elo_right = (self.right_team.defense_player.player_stats.elo_rating + self.right_team.attack_player.player_stats.elo_rating)
+            #diff = self.left_team.team_stats.elo_rating - self.right_team.team_stats.elo_rating
+            diff = elo_left - elo_right
+            expected = elo.wining_expectancy(diff)
+
+        predicted_left_score, predicted_right_score = elo.predicted_score_from_expectancy(expected, MAX_SCORE=config.GAME_GOAL_LIMIT)
 
         return "{left} x {right}".format(left=predicted_left_score, right=predicted_right_score)
 
-    def predicted_team_score(self):
-        elo_left = (self.left_team.team_stats.elo_rating)
-        elo_right = (self.right_team.team_stats.elo_rating)
-        diff = elo_left - elo_right
+    def predicted_team_score(self, win_probabilities=None):
+        if win_probabilities is not None:
+            expected = win_probabilities.pairing_expectancy(stats_replay.TEAM_LADDER, self.left_team.pair, self.right_team.pair)
+        else:
+            elo_left = (self.left_team.team_stats.elo_rating)
+            elo_right = (self.right_team.team_stats.elo_rating)
+            diff = elo_left - elo_right
+            expected = elo.wining_expectancy(diff)
 
-        predicted_left_score, predicted_right_score = elo.predicted_score(diff=diff, MAX_SCORE=config.GAME_GOAL_LIMIT)
+        predicted_left_score, predicted_right_score = elo.predicted_score_from_expectancy(expected, MAX_SCORE=config.GAME_GOAL_LIMIT)
 
         return "{left} x {right}".format(left=predicted_left_score, right=predicted_right_score)
 
-    def predicted_position_score(self):
-
-        elo_left = (self.left_team.defense_player.defense_stats.elo_rating + self.left_team.attack_player.attack_stats.elo_rating)
-        elo_right = (self.right_team.defense_player.defense_stats.elo_rating + self.right_team.attack_player.attack_stats.elo_rating)
-        diff = elo_left - elo_right
+    def predicted_position_score(self, win_probabilities=None):
+        if win_probabilities is not None:
+            expected = win_probabilities.pairing_expectancy(stats_replay.POSITION_LADDER, self.left_team.pair, self.right_team.pair)
+        else:
+            elo_left = (self.left_team.defense_player.defense_stats.elo_rating + self.left_team.attack_player.attack_stats.elo_rating)
+            elo_right = (self.right_team.defense_player.defense_stats.elo_rating + self.right_team.attack_player.attack_stats.elo_rating)
+            diff = elo_left - elo_right
+            expected = elo.wining_expectancy(diff)
 
-        predicted_left_score, predicted_right_score = elo.predicted_score(diff=diff, MAX_SCORE=config.GAME_GOAL_LIMIT)
+        predicted_left_score, predicted_right_score = elo.predicted_score_from_expectancy(expected, MAX_SCORE=config.GAME_GOAL_LIMIT)
 
         return "{left} x {right}".format(left=predicted_left_score, right=predicted_right_score)
 
@@ -0,0 +1,141 @@
+"""
+    Opt-in log of slow SQL statements, with the DBAccess method that ran them and their query plan.
+
+    Set config.SLOW_QUERY_SECONDS to record every statement taking at least that long to config.SLOW_QUERY_LOG, one
+    JSON object per line. The EXPLAIN QUERY PLAN of a statement is captured the first time it is slow, on a connection
+    of its own so that it never commits the transaction the statement ran in. Rank the statements by total time with:
+
+        python slow_queries.py [log]
+"""
+import argparse
+import collections
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+import config
+import tools
+
+
+# seconds to wait for a lock on the schema before giving up on a plan
+EXPLAIN_TIMEOUT = 1.0
+
+def _calling_method():
+    # the innermost DBAccess method on the stack
+    frame = sys._getframe(2)
+    while frame is not None:
+        if os.path.basename(frame.f_code.co_filename).startswith("db_access.py"):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+def query_plan(database, sql, parameters=()):
+    """
+        The EXPLAIN QUERY PLAN of a statement, one line per step indented under its parent. It runs on a read only
+        connection of its own: sqlite3 commits the open transaction of a connection before an EXPLAIN, so explaining
+        on the connection of a write would commit it halfway.
+    """
+    connection = sqlite3.connect(database, timeout=EXPLAIN_TIMEOUT)
+    try:
+        connection.execute("PRAGMA query_only = 1")
+        cur = connection.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+
+        depths = {0: -1}
+        plan = []
+        for step_id, parent_id, _, detail in cur.fetchall():
+            depths[step_id] = depths.get(parent_id, -1) + 1
+            plan.append("  " * depths[step_id] + detail)
+        return plan
+    finally:
+        connection.close()
+
+
+class SlowQueryLog:
+
+    def __init__(self, path, threshold):
+        self.path = path
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._explained = set()
+
+    def record(self, connection, sql, parameters, seconds, many=False):
+        """
+            Log a statement that took seconds to run, parameters are the sequence of executemany when many
+        """
+        method = _calling_method()
+
+        with self._lock:
+            explain = sql not in self._explained
+            self._explained.add(sql)
+
+        if many:
+            # executemany may have been given an iterator, already consumed
+            parameters = list(parameters) if isinstance(parameters, (list, tuple)) else []
+
+        plan = None
+        if explain:
+            database = getattr(connection, "database", None)
+            try:
+                if database is None:
+                    raise TypeError("the connection does not say its database, use metrics.MetricsConnection")
+                plan = query_plan(database, sql, (parameters[0] if parameters else ()) if many else parameters)
+            except (sqlite3.Error, TypeError, KeyError), e:
+                plan = ["could not explain: {}".format(e)]
+
+        entry = dict(timestamp=tools.get_timestamp_for_now(), seconds=round(seconds, 6), sql=sql, method=method,
+                     parameters=(len(parameters) if many else parameters), many=many, plan=plan)
+        line = json.dumps(entry, default=repr)
+        with self._lock:
+            with open(self.path, "a") as log:
+                log.write(line + "\n")
+
+
+def summary(path):
+    """
+        The logged statements grouped by SQL text, most total time first, as dicts
+    """
+    statements = collections.OrderedDict()
+    with open(path) as log:
+        for line in log:
+            entry = json.loads(line)
+            statement = statements.setdefault(entry["sql"], dict(sql=entry["sql"], count=0, seconds=0.0, max_seconds=0.0,
+                                                                 methods=set(), plan=None))
+            statement["count"] += 1
+            statement["seconds"] += entry["seconds"]
+            statement["max_seconds"] = max(statement["max_seconds"], entry["seconds"])
+            if entry["method"]:
+                statement["methods"].add(entry["method"])
+            if entry["plan"] is not None and statement["plan"] is None:
+                statement["plan"] = entry["plan"]
+
+    for statement in statements.values():
+        # SQLite says SCAN for a full table scan, SEARCH when it uses an index
+        statement["full_scan"] = any(step.strip().startswith("SCAN") for step in statement["plan"] or ())
+    return sorted(statements.values(), key=lambda statement: -statement["seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank the statements of a slow query log by total time")
+    parser.add_argument("path", nargs="?", default=config.SLOW_QUERY_LOG)
+    parser.add_argument("--limit", type=int, default=20, help="number of statements to show")
+    args = parser.parse_args()
+
+    for statement in summary(args.path)[:args.limit]:
+        print "{seconds:.3f}s total, {count} times, {mean:.1f} ms mean, {max:.1f} ms max{scan} in {methods}".format(
+            seconds=statement["seconds"], count=statement["count"], mean=1000 * statement["seconds"] / statement["count"],
+            max=1000 * statement["max_seconds"], scan=", FULL SCAN" if statement["full_scan"] else "",
+            methods=", ".join(sorted(statement["methods"])) or "?")
+        print "    " + re.sub(r"\s+", " ", statement["sql"]).strip()
+        plan = statement["plan"]
+        for step in plan or ["(no plan captured)" if plan is None else "(no steps to plan)"]:
+            print "        " + step
+        print
+
+
+if __name__ == '__main__':
+    main()
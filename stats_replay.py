@@ -0,0 +1,167 @@
+import collections
+import multiprocessing
+
+import elo
+
+
+# Stats are kept per (column, entity id), the column being the one that identifies the entity in the stats table
+PLAYER = "player_id"
+ATTACK = "attack_player_id"
+DEFENSE = "defense_player_id"
+TEAM = "team_id"
+
+# The rating ladders are independent of each other: a team, position or individual rating only depends on
+# ratings of the same ladder, so each ladder can be replayed on its own (and in parallel)
+TEAM_LADDER = "team"
+POSITION_LADDER = "position"
+INDIVIDUAL_LADDER = "individual"
+LADDERS = (TEAM_LADDER, POSITION_LADDER, INDIVIDUAL_LADDER)
+
+WINS, DRAWS, LOSSES, GOALS_PRO, GOALS_AGAINST, ELO_RATING = range(6)
+
+
+def first_values():
+    return [0, 0, 0, 0, 0, elo.INITIAL_RATING]
+
+
+def stats_values(stats):
+    return [stats.wins, stats.draws, stats.losses, stats.goals_pro, stats.goals_against, stats.elo_rating]
+
+
+# The few fields of an ended game that matter for the stats
+ReplayGame = collections.namedtuple("ReplayGame", ["timestamp",
+                                                   "left_team_id", "left_defense_id", "left_attack_id",
+                                                   "right_team_id", "right_defense_id", "right_attack_id",
+                                                   "left_score", "right_score"])
+
+
+def _score_percentages(game):
+    if (game.left_score + game.right_score) != 0:
+        score_p_left = game.left_score / float(game.left_score + game.right_score)
+        score_p_right = 1.0 - score_p_left
+    else:
+        score_p_left = 0.5
+        score_p_right = 0.5
+    return score_p_left, score_p_right
+
+
+def _goals_increments(game):
+    left = (int(game.left_score > game.right_score),
+            int(game.left_score == game.right_score),
+            int(game.left_score < game.right_score),
+            game.left_score,
+            game.right_score)
+    right = (int(game.right_score > game.left_score),
+             int(game.left_score == game.right_score),
+             int(game.right_score < game.left_score),
+             game.right_score,
+             game.left_score)
+    return left, right
+
+
+def replay_ladder(ladder, games, initial):
+    """
+        Replay games on one rating ladder, starting from the initial {(column, entity_id): values} stats.
+        Returns the new stats as (game index, slot, column, entity_id, values) rows, slots giving
+        the order in which add_stats_game writes the stats of a game.
+    """
+    current = dict((key, list(values)) for key, values in initial.items())
+    rows = []
+
+    def increment(index, slot, key, goals_increment, i_elo_rating, timestamp):
+        values = current.get(key)
+        if values is None:
+            values = current[key] = first_values()
+        for i, inc in enumerate(goals_increment):
+            values[i] += inc
+        values[ELO_RATING] += i_elo_rating
+        rows.append((index, slot, key[0], key[1], tuple(values) + (timestamp,)))
+
+    def rating(key):
+        values = current.get(key)
+        return values[ELO_RATING] if values else elo.INITIAL_RATING
+
+    for index, game in enumerate(games):
+        score_p_left, score_p_right = _score_percentages(game)
+        left_increment, right_increment = _goals_increments(game)
+
+        if ladder == TEAM_LADDER:
+            elo_left_team = rating((TEAM, game.left_team_id))
+            elo_right_team = rating((TEAM, game.right_team_id))
+
+            i_elo_left_team = elo.rating_increment(score_perc=score_p_left, diff_ratings=(elo_left_team - elo_right_team))
+            i_elo_right_team = elo.rating_increment(score_perc=score_p_right, diff_ratings=(elo_right_team - elo_left_team))
+
+            increment(index, 0, (TEAM, game.left_team_id), left_increment, i_elo_left_team, game.timestamp)
+            increment(index, 1, (TEAM, game.right_team_id), right_increment, i_elo_right_team, game.timestamp)
+
+        elif ladder == POSITION_LADDER:
+            elo_attack_left = rating((ATTACK, game.left_attack_id))
+            elo_defense_left = rating((DEFENSE, game.left_defense_id))
+            elo_attack_right = rating((ATTACK, game.right_attack_id))
+            elo_defense_right = rating((DEFENSE, game.right_defense_id))
+
+            i_elo_left_players_pos = elo.rating_increment(score_perc=score_p_left, diff_ratings=((elo_attack_left+elo_defense_left) - (elo_attack_right+elo_defense_right)))
+            i_elo_right_players_pos = elo.rating_increment(score_perc=score_p_right, diff_ratings=((elo_attack_right+elo_defense_right)-(elo_attack_left+elo_defense_left)))
+
+            increment(index, 2, (ATTACK, game.left_attack_id), left_increment, i_elo_left_players_pos, game.timestamp)
+            increment(index, 4, (DEFENSE, game.left_defense_id), left_increment, i_elo_left_players_pos, game.timestamp)
+            increment(index, 6, (ATTACK, game.right_attack_id), right_increment, i_elo_right_players_pos, game.timestamp)
+            increment(index, 8, (DEFENSE, game.right_defense_id), right_increment, i_elo_right_players_pos, game.timestamp)
+
+        elif ladder == INDIVIDUAL_LADDER:
+            elo_player_attack_left = rating((PLAYER, game.left_attack_id))
+            elo_player_defense_left = rating((PLAYER, game.left_defense_id))
+            elo_player_attack_right = rating((PLAYER, game.right_attack_id))
+            elo_player_defense_right = rating((PLAYER, game.right_defense_id))
+
+            i_elo_left_players_ind = elo.rating_increment(score_perc=score_p_left, diff_ratings=((elo_player_attack_left+elo_player_defense_left) - (elo_player_attack_right+elo_player_defense_right)))
+            i_elo_right_players_ind = elo.rating_increment(score_perc=score_p_right, diff_ratings=((elo_player_attack_right+elo_player_defense_right) - (elo_player_attack_left+elo_player_defense_left)))
+
+            increment(index, 3, (PLAYER, game.left_attack_id), left_increment, i_elo_left_players_ind, game.timestamp)
+            if game.left_attack_id != game.left_defense_id:
+                increment(index, 5, (PLAYER, game.left_defense_id), left_increment, i_elo_left_players_ind, game.timestamp)
+            increment(index, 7, (PLAYER, game.right_attack_id), right_increment, i_elo_right_players_ind, game.timestamp)
+            if game.right_attack_id != game.right_defense_id:
+                increment(index, 9, (PLAYER, game.right_defense_id), right_increment, i_elo_right_players_ind, game.timestamp)
+
+        else:
+            raise Exception("Unknown rating ladder: {}".format(ladder))
+
+    return rows
+
+
+def _replay_ladder_star(args):
+    return replay_ladder(*args)
+
+
+def replay_games(games, initial, parallel=False):
+    """
+        Replay games on every rating ladder, starting from the initial {(column, entity_id): values} stats.
+        Returns the new stats as (column, entity_id, values) rows, in the order add_stats_game would write them.
+    """
+    jobs = [(ladder, games, dict((key, values) for key, values in initial.items() if _ladder(key[0]) == ladder))
+            for ladder in LADDERS]
+
+    if parallel and games:
+        pool = multiprocessing.Pool(processes=len(LADDERS))
+        try:
+            ladder_rows = pool.map(_replay_ladder_star, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        ladder_rows = [replay_ladder(*job) for job in jobs]
+
+    rows = [row for rows in ladder_rows for row in rows]
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return [(column, entity_id, values) for _, _, column, entity_id, values in rows]
+
+
+def _ladder(column):
+    if column == TEAM:
+        return TEAM_LADDER
+    elif column in (ATTACK, DEFENSE):
+        return POSITION_LADDER
+    else:
+        return INDIVIDUAL_LADDER
@@ -0,0 +1,52 @@
+"""
+    A throwaway foosball database for the tests.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from db_access import DBAccess
+import config
+
+
+def timestamp_ago(seconds):
+    return (datetime.datetime.now() - datetime.timedelta(seconds=seconds)).strftime(config.TIMESTAMP_FORMAT)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+        self.db is a DBAccess on a new database in a temporary directory
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="foosball-test-")
+        self.path = os.path.join(self.directory, "FB.db")
+        self.db = DBAccess(database=self.path)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory)
+
+    def players(self, *names):
+        for name in names:
+            self.db.create_player(name=name, photo="/static/" + config.DEFAULT_IMAGE)
+        return [self.db.get_player_by_name(name=name) for name in names]
+
+    def teams(self, a, b, c, d):
+        """
+            (a defending, b attacking) and (c defending, d attacking) of new players named a, b, c and d
+        """
+        players = self.players(a, b, c, d)
+        return (self.db.create_team(defense_player=players[0], attack_player=players[1]),
+                self.db.create_team(defense_player=players[2], attack_player=players[3]))
+
+    def play(self, left_team, right_team, left_score, right_score, seconds_ago=3600):
+        """
+            An ended game started seconds_ago
+        """
+        game = self.db.create_update_game(timestamp=timestamp_ago(seconds_ago), left_team=left_team, right_team=right_team,
+                                          left_score=left_score, right_score=right_score)
+        self.db.end_game(game)
+        return game
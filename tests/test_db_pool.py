@@ -0,0 +1,69 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import weakref
+
+from db_pool import ConnectionPool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="foosball-test-")
+        self.pool = ConnectionPool(database=os.path.join(self.directory, "FB.db"))
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def test_close_on_the_writer_thread(self):
+        self.pool.write(self.pool.close)
+
+        self.pool._writer.join(5)
+        self.assertFalse(self.pool._writer.is_alive())
+
+    def test_transaction_commits_once_at_the_end(self):
+        def create():
+            with self.pool.connection() as con:
+                con.execute("CREATE TABLE t (x INT)")
+
+        def insert_and_fail():
+            for x in (1, 2):
+                with self.pool.connection() as con:
+                    con.execute("INSERT INTO t VALUES (?)", (x, ))
+            raise ValueError("after the commits")
+
+        self.pool.write(create)
+        self.assertRaises(ValueError, self.pool.write, self.pool.transaction, insert_and_fail)
+        self.assertEqual(0, self.pool.connection().execute("SELECT COUNT(*) FROM t").fetchone()[0])
+
+    def request(self, connections):
+        def run():
+            connections.append(self.pool.connection())
+            connections[-1].execute("SELECT 1")
+            self.pool.release()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    def test_released_connections_serve_the_next_threads(self):
+        connections = []
+        for _ in range(3):
+            self.request(connections)
+        self.assertEqual(1, len(set(connections)))
+
+    def test_closed_pool_is_not_kept_alive(self):
+        pool = ConnectionPool(database=os.path.join(self.directory, "other.db"))
+        pool.close()
+        pool_ref = weakref.ref(pool)
+
+        del pool
+        gc.collect()
+        self.assertIsNone(pool_ref())
+
+
+if __name__ == '__main__':
+    unittest.main()
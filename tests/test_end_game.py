@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+from tests.support import DatabaseTestCase, timestamp_ago
+import config
+
+
+class EndGameTest(DatabaseTestCase):
+
+    def test_ending_twice_counts_the_game_once(self):
+        left_team, right_team = self.teams("a", "b", "c", "d")
+        game = self.play(left_team, right_team, 3, 1)
+
+        self.db.end_game(game)
+
+        self.assertEqual(1, self.db.get_player_by_name("a").player_stats.wins)
+        self.assertEqual(2, len(self.db.get_all_stats(team_id=left_team.team_id)))
+
+    def test_readers_finding_a_game_out_of_time_end_it_once(self):
+        left_team, right_team = self.teams("a", "b", "c", "d")
+        game = self.db.create_update_game(timestamp=timestamp_ago(config.GAME_TIME_LIMIT + 60), left_team=left_team,
+                                          right_team=right_team, left_score=3, right_score=1)
+
+        start = threading.Event()
+        errors = []
+
+        def read():
+            start.wait()
+            try:
+                self.db.get_game_by_timestamp(game.timestamp)
+            except Exception, e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(8)]
+        for reader in readers:
+            reader.start()
+        start.set()
+        for reader in readers:
+            reader.join()
+
+        self.assertEqual([], errors)
+        self.assertTrue(self.db.get_game_by_timestamp(game.timestamp).ended)
+        self.assertEqual(1, self.db.get_player_by_name("a").player_stats.wins)
+        self.assertEqual(1, self.db.get_player_by_name("c").player_stats.losses)
+        self.assertEqual(2, len(self.db.get_all_stats(team_id=left_team.team_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from goal_queue import GoalQueue
+import config
+import metrics
+
+
+class FlakyGoals(object):
+    """
+        A DBAccess.goals that fails the first failures calls
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.written = []
+
+    def goals(self, events):
+        if self.failures:
+            self.failures -= 1
+            raise Exception("database is locked")
+        self.written.extend(events)
+        return len(events)
+
+
+class GoalQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.retry_seconds = config.GOAL_WRITE_RETRY_SECONDS
+        config.GOAL_WRITE_RETRY_SECONDS = 0
+
+    def tearDown(self):
+        config.GOAL_WRITE_RETRY_SECONDS = self.retry_seconds
+
+    def drain(self, db, *sides):
+        goals = GoalQueue(db)
+        for sequence, side in enumerate(sides):
+            goals.put(side=side, device="sensor", sequence=sequence)
+        goals.flush()
+        goals.close()
+
+    def test_failed_write_is_retried(self):
+        db = FlakyGoals(failures=config.GOAL_WRITE_ATTEMPTS - 1)
+        self.drain(db, config.LEFT, config.RIGHT)
+
+        self.assertEqual([(config.LEFT, 0), (config.RIGHT, 1)], [(event.side, event.sequence) for event in db.written])
+
+    def test_goals_are_dropped_after_the_last_attempt(self):
+        dropped = metrics.GOALS_DROPPED.value()
+        db = FlakyGoals(failures=config.GOAL_WRITE_ATTEMPTS)
+        self.drain(db, config.LEFT)
+
+        self.assertEqual([], db.written)
+        self.assertEqual(dropped + 1, metrics.GOALS_DROPPED.value())
+
+
+if __name__ == '__main__':
+    unittest.main()
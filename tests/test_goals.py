@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+import time
+import unittest
+
+from models import GoalEvent
+from tests.support import DatabaseTestCase, timestamp_ago
+import config
+
+
+class GoalsTest(DatabaseTestCase):
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        left_team, right_team = self.teams("a", "b", "c", "d")
+        self.game = self.db.create_update_game(timestamp=timestamp_ago(10), left_team=left_team, right_team=right_team)
+
+    def score(self):
+        game = self.db.get_game_by_timestamp(self.game.timestamp)
+        return game.left_score, game.right_score
+
+    def event(self, side, device, sequence):
+        return GoalEvent(side=side, value=1, timestamp=timestamp_ago(0), device=device, sequence=sequence, table_id=config.DEFAULT_TABLE_ID)
+
+    def test_retried_goal_counts_once(self):
+        self.assertEqual(1, self.db.goal(config.LEFT, device="sensor", sequence=1))
+        self.assertEqual(0, self.db.goal(config.LEFT, device="sensor", sequence=1))
+        self.assertEqual(1, self.db.goal(config.RIGHT, device="sensor", sequence=2))
+
+        self.assertEqual((1, 1), self.score())
+        self.assertEqual(2, len(self.db.get_goals(self.game.game_id)))
+
+    def test_retries_within_a_batch(self):
+        events = [self.event(config.LEFT, "sensor", 1), self.event(config.LEFT, "sensor", 1), self.event(config.RIGHT, "sensor", 2),
+                  self.event(config.LEFT, "sensor", 1)]
+        self.assertEqual(2, self.db.goals(events))
+        self.assertEqual((1, 1), self.score())
+
+    def test_sequences_are_per_device(self):
+        self.db.goal(config.LEFT, device="left sensor", sequence=1)
+        self.db.goal(config.LEFT, device="right sensor", sequence=1)
+        self.assertEqual((2, 0), self.score())
+
+    def test_sequences_are_per_game(self):
+        self.db.goal(config.LEFT, device="sensor", sequence=1)
+        next_game = self.db.create_update_game(timestamp=timestamp_ago(5), left_team=self.game.left_team, right_team=self.game.right_team)
+        # a board restarted with the same boot id numbers its goals from 1 again
+        self.assertEqual(1, self.db.goal(config.LEFT, device="sensor", sequence=1))
+        self.assertEqual(1, len(self.db.get_goals(next_game.game_id)))
+
+    def test_goals_without_a_device_all_count(self):
+        self.db.goal(config.LEFT)
+        self.db.goal(config.LEFT)
+        self.assertEqual((2, 0), self.score())
+
+    def test_goal_after_the_time_limit_of_a_game_not_cached(self):
+        left_team, right_team = self.teams("e", "f", "g", "h")
+        late_game = self.db.create_update_game(timestamp=timestamp_ago(config.GAME_TIME_LIMIT + 120), left_team=left_team,
+                                               right_team=right_team, left_score=1)
+        # as after a restart, the open game has to be read again
+        self.db._open_games.clear()
+
+        self.assertEqual(0, self.db.goal(config.LEFT, device="sensor", sequence=1))
+        late_game = self.db.get_game_by_timestamp(late_game.timestamp)
+        self.assertEqual((1, 0, 1), (late_game.left_score, late_game.right_score, late_game.ended))
+
+    def test_goal_for_a_game_ended_without_the_cache_knowing(self):
+        self.db.goal(config.LEFT)
+        ended_game = self.db._open_games[config.DEFAULT_TABLE_ID]
+        next_game = self.db.create_update_game(timestamp=timestamp_ago(5), left_team=self.game.left_team, right_team=self.game.right_team)
+        self.db._open_games[config.DEFAULT_TABLE_ID] = ended_game
+
+        self.assertEqual(1, self.db.goal(config.LEFT))
+        self.assertEqual(1, self.db.get_game_by_timestamp(next_game.timestamp).left_score)
+
+    def test_goal_while_another_process_writes(self):
+        self.db.goal(config.LEFT)
+        next_timestamp = timestamp_ago(5)
+
+        # another process ends the game and starts the next one, holding the write lock meanwhile
+        con = sqlite3.connect(self.path, isolation_level=None)
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("UPDATE games SET ended = 1 WHERE game_id = ?", (self.game.game_id, ))
+        con.execute("INSERT INTO games(timestamp, left_team_id, right_team_id, left_score, right_score, ended, table_id) "
+                    "VALUES(?, ?, ?, 0, 0, 0, ?)", (next_timestamp, self.game.left_team.team_id, self.game.right_team.team_id,
+                                                    config.DEFAULT_TABLE_ID))
+        con.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version'")
+
+        goal = threading.Thread(target=self.db.goal, args=(config.LEFT, ))
+        goal.start()
+        # the goal waits for the lock, then sees the next game
+        time.sleep(0.3)
+        con.execute("COMMIT")
+        con.close()
+        goal.join()
+
+        self.assertEqual((1, 0), self.score())
+        self.assertEqual(1, self.db.get_game_by_timestamp(next_timestamp).left_score)
+
+    def test_score_rebuilt_from_the_goals(self):
+        self.db.goal(config.LEFT, device="sensor", sequence=1)
+        self.db.goal(config.LEFT, device="sensor", sequence=2)
+
+        def lose_the_score():
+            with self.db.con:
+                self.db.con.execute("UPDATE games SET left_score = 7 WHERE game_id = :game_id", dict(game_id=self.game.game_id))
+        self.db.pool.write(lose_the_score)
+        self.assertEqual((7, 0), self.score())
+
+        self.db.rebuild_game_score(self.game.game_id)
+        self.assertEqual((2, 0), self.score())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import itertools
+import random
+import unittest
+
+import elo
+import matchmaking
+
+
+def brute_force(player_ids, ratings, limit):
+    """
+        Imbalances of the limit most balanced matchups, out of every matchup of four of the players
+    """
+    imbalances = []
+    for left_defense_id, left_attack_id, right_defense_id, right_attack_id in itertools.permutations(player_ids, 4):
+        # each matchup once, not also with the sides switched
+        if min(left_defense_id, left_attack_id) > min(right_defense_id, right_attack_id):
+            continue
+        imbalances.append(matchmaking._matchup(ratings, left_defense_id, left_attack_id, right_defense_id, right_attack_id).imbalance)
+    return sorted(imbalances)[:limit]
+
+
+class BalancedMatchupsTest(unittest.TestCase):
+
+    def test_same_as_brute_force(self):
+        rng = random.Random(3)
+        for _ in range(30):
+            player_ids = rng.sample(range(1, 100), rng.randint(matchmaking.MIN_PLAYERS, 9))
+            spread = rng.choice([0, 5, 100, 400, 1000])
+
+            def rating():
+                return elo.INITIAL_RATING + rng.uniform(-spread, spread)
+
+            # about half the pairs are teams already
+            ratings = matchmaking.Ratings(player=dict((player_id, rating()) for player_id in player_ids),
+                                          attack=dict((player_id, rating()) for player_id in player_ids),
+                                          defense=dict((player_id, rating()) for player_id in player_ids),
+                                          team=dict((pair, rating()) for pair in itertools.permutations(player_ids, 2) if rng.random() < 0.5))
+
+            matchups = matchmaking.balanced_matchups(player_ids, ratings, limit=7)
+            expected = brute_force(player_ids, ratings, 7)
+            self.assertEqual(len(expected), len(matchups))
+            for matchup, imbalance in zip(matchups, expected):
+                self.assertAlmostEqual(imbalance, matchup.imbalance)
+            self.assertEqual(len(matchups), len(set(frozenset([matchup[:2], matchup[2:4]]) for matchup in matchups)))
+
+    def test_too_few_players(self):
+        self.assertRaises(ValueError, matchmaking.balanced_matchups, [1, 2, 3], matchmaking.Ratings({}, {}, {}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
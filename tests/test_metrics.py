@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import metrics
+
+
+class SharedMetricsTest(unittest.TestCase):
+    """
+        /metrics of a prefork server, with the values another worker process saved
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="foosball-test-")
+        metrics.share(self.directory)
+
+    def tearDown(self):
+        metrics._shared_directory = None
+        shutil.rmtree(self.directory)
+
+    def other_worker(self):
+        metrics.save()
+        shutil.copy(os.path.join(self.directory, "{}.metrics".format(os.getpid())), os.path.join(self.directory, "other.metrics"))
+
+    def sample(self, name):
+        for line in metrics.render().splitlines():
+            if line.startswith(name + " "):
+                return float(line.split()[1])
+
+    def test_counters_are_added_up(self):
+        metrics.GOALS_DROPPED.inc()
+        self.other_worker()
+        dropped = metrics.GOALS_DROPPED.value()
+
+        metrics.GOALS_DROPPED.inc()
+        self.assertEqual(2 * dropped + 1, self.sample("foosball_goals_dropped_total"))
+
+    def test_histograms_are_added_up(self):
+        metrics.GOAL_LAG_SECONDS.observe(0.002)
+        self.other_worker()
+        count = self.sample("foosball_goal_ingestion_lag_seconds_count")
+
+        metrics.GOAL_LAG_SECONDS.observe(20.0)
+        self.assertEqual(count + 1, self.sample("foosball_goal_ingestion_lag_seconds_count"))
+        self.assertEqual(count + 1, self.sample('foosball_goal_ingestion_lag_seconds_bucket{le="+Inf"}'))
+
+    def test_sharing_again_forgets_the_workers_of_before(self):
+        self.other_worker()
+        metrics.share(self.directory)
+        self.assertEqual([], os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from db_access import DBAccess
+import config
+import elo
+import migrations
+
+
+GAME_TIMESTAMP = "2016-03-01 12:00:00"
+WINNER_RATING = elo.INITIAL_RATING + 25
+
+
+class MigrationsTest(unittest.TestCase):
+    """
+        A database of the first schema, as the server wrote it before schema versions, opened by DBAccess
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="foosball-test-")
+        self.path = os.path.join(self.directory, "FB.db")
+
+        con = sqlite3.connect(self.path)
+        cur = con.cursor()
+        migrations.create_tables(cur)
+        for player_id, name in enumerate("abcd", 1):
+            stats_ids = []
+            for column in ("player_id", "attack_player_id", "defense_player_id"):
+                cur.execute("INSERT INTO stats({}, wins, draws, losses, goals_pro, goals_against, elo_rating, timestamp) "
+                            "VALUES(?, 0, 0, 0, 0, 0, ?, ?)".format(column), (player_id, elo.INITIAL_RATING, config.FIRST_TIMESTAMP))
+                stats_ids.append(cur.lastrowid)
+            cur.execute("INSERT INTO players(player_id, name, photo, player_stats_id, attack_stats_id, defense_stats_id) VALUES(?, ?, ?, ?, ?, ?)",
+                        [player_id, name, "/static/" + config.DEFAULT_IMAGE] + stats_ids)
+        self.cur = cur
+        self.con = con
+
+    def tearDown(self):
+        self.con.close()
+        shutil.rmtree(self.directory)
+
+    def team(self, defense_player_id, attack_player_id):
+        self.cur.execute("INSERT INTO teams(defense_player_id, attack_player_id) VALUES(?, ?)", (defense_player_id, attack_player_id))
+        team_id = self.cur.lastrowid
+        self.cur.execute("INSERT INTO stats(team_id, wins, draws, losses, goals_pro, goals_against, elo_rating, timestamp) "
+                         "VALUES(?, 0, 0, 0, 0, 0, ?, ?)", (team_id, elo.INITIAL_RATING, config.FIRST_TIMESTAMP))
+        self.cur.execute("UPDATE teams SET team_stats_id = ? WHERE team_id = ?", (self.cur.lastrowid, team_id))
+        return team_id
+
+    def game(self, left_team_id, right_team_id, left_score, right_score):
+        self.cur.execute("INSERT INTO games(timestamp, left_team_id, right_team_id, left_score, right_score, ended) VALUES(?, ?, ?, ?, ?, 1)",
+                         (GAME_TIMESTAMP, left_team_id, right_team_id, left_score, right_score))
+        return self.cur.lastrowid
+
+    def open(self):
+        self.con.commit()
+        db = DBAccess(database=self.path)
+        self.addCleanup(db.close)
+        return db
+
+    def test_latest_schema(self):
+        self.team(1, 2)
+        self.team(3, 4)
+        db = self.open()
+
+        cur = db.con.cursor()
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        self.assertEqual(len(migrations.MIGRATIONS), cur.fetchone()[0])
+        self.assertEqual(["a", "b", "c", "d"], sorted(player.name for player in db.get_all_players()))
+        self.assertEqual(2, len(db.get_all_teams()))
+
+    def test_stats_and_goals_of_the_games_so_far(self):
+        left_team_id, right_team_id = self.team(1, 2), self.team(3, 4)
+        game_id = self.game(left_team_id, right_team_id, 5, 3)
+        self.cur.execute("INSERT INTO stats(player_id, wins, draws, losses, goals_pro, goals_against, elo_rating, timestamp) "
+                         "VALUES(1, 1, 0, 0, 5, 3, ?, ?)", (WINNER_RATING, GAME_TIMESTAMP))
+        self.cur.execute("UPDATE players SET player_stats_id = ? WHERE player_id = 1", (self.cur.lastrowid, ))
+        db = self.open()
+
+        player = db.get_player_by_name("a")
+        self.assertEqual((1, WINNER_RATING), (player.player_stats.wins, player.player_stats.elo_rating))
+        self.assertEqual(elo.INITIAL_RATING, player.attack_stats.elo_rating)
+
+        goals = db.get_goals(game_id)
+        self.assertEqual((5, 3), (goals[-1]["left_score"], goals[-1]["right_score"]))
+
+    def test_duplicate_teams_are_merged(self):
+        left_team_id, duplicate_team_id, right_team_id = self.team(1, 2), self.team(1, 2), self.team(3, 4)
+        self.game(duplicate_team_id, right_team_id, 5, 3)
+        db = self.open()
+
+        self.assertEqual([left_team_id, right_team_id], sorted(team.team_id for team in db.get_all_teams()))
+        self.assertEqual(left_team_id, db.get_game_by_timestamp(GAME_TIMESTAMP).left_team.team_id)
+        # merging recalculates the stats, the game of the duplicate now counts for the team kept
+        self.assertEqual(1, db.get_team(left_team_id).team_stats.wins)
+        self.assertEqual(1, db.get_player_by_name("a").player_stats.wins)
+
+    def test_opening_again_runs_no_migration(self):
+        self.game(self.team(1, 2), self.team(3, 4), 5, 3)
+        self.open().close()
+        self.open()
+
+        cur = self.con.cursor()
+        cur.execute("SELECT COUNT(*) FROM schema_version")
+        self.assertEqual(len(migrations.MIGRATIONS), cur.fetchone()[0])
+        cur.execute("SELECT COUNT(*) FROM goals")
+        self.assertEqual(2, cur.fetchone()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
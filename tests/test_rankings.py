@@ -0,0 +1,69 @@
+import random
+import unittest
+
+from tests.support import DatabaseTestCase, timestamp_ago
+import config
+import db_access
+
+
+class RankingsTest(DatabaseTestCase):
+
+    def expected(self):
+        players = self.db.get_visible_players()
+        teams = self.db.get_all_teams()
+        ranked = lambda entities, value, entity_id: [entity_id(entity) for entity in
+                                                     sorted(entities, key=lambda entity: (-value(entity), entity_id(entity)))]
+        player_id = lambda player: player.player_id
+        return {db_access.PLAYER_RANKING: ranked(players, lambda player: player.player_stats.elo_rating, player_id),
+                db_access.ATTACK_RANKING: ranked(players, lambda player: player.attack_stats.elo_rating, player_id),
+                db_access.DEFENSE_RANKING: ranked(players, lambda player: player.defense_stats.elo_rating, player_id),
+                db_access.WIN_PERC_RANKING: ranked(players, lambda player: player.player_stats.perc_win(), player_id),
+                db_access.TEAM_RANKING: ranked(teams, lambda team: team.team_stats.elo_rating, lambda team: team.team_id)}
+
+    def actual(self):
+        actual = {}
+        for board in self.expected():
+            rankings = self.db.get_rankings(board)
+            self.assertEqual(range(1, len(rankings) + 1), [ranking.position for ranking in rankings])
+            actual[board] = [ranking.entity.team_id if board == db_access.TEAM_RANKING else ranking.entity.player_id
+                             for ranking in rankings]
+        return actual
+
+    def test_games_move_their_players_and_teams_among_the_others(self):
+        rng = random.Random(7)
+        players = self.players(*"abcdefgh")
+        for seconds_ago in range(40 * 3600, 3600, -3600):
+            a, b, c, d = rng.sample(players, 4)
+            left_team = self.db.create_team(defense_player=a, attack_player=b)
+            right_team = self.db.create_team(defense_player=c, attack_player=d)
+            self.play(left_team, right_team, rng.randint(0, 5), rng.randint(0, 5), seconds_ago=seconds_ago)
+            self.db.end_request()
+
+            self.assertEqual(self.expected(), self.actual())
+
+    def test_games_ended_for_being_out_of_time_rank_their_players(self):
+        left_team, right_team = self.teams("a", "b", "c", "d")
+        self.db.create_update_game(timestamp=timestamp_ago(config.GAME_TIME_LIMIT + 60), left_team=left_team,
+                                   right_team=right_team, left_score=1, right_score=3)
+
+        self.assertIsNone(self.db.get_open_game())
+        self.db.end_request()
+        self.assertEqual(self.expected(), self.actual())
+        self.assertEqual(right_team.team_id, self.actual()[db_access.TEAM_RANKING][0])
+
+    def test_hidden_players_leave_the_player_boards(self):
+        left_team, right_team = self.teams("a", "b", "c", "d")
+        self.play(left_team, right_team, 5, 1)
+
+        self.db.hide_player("c", True)
+        self.db.end_request()
+        self.assertEqual(self.expected(), self.actual())
+        self.assertNotIn(right_team.defense_player.player_id, self.actual()[db_access.PLAYER_RANKING])
+
+        self.db.hide_player("c", False)
+        self.db.end_request()
+        self.assertEqual(self.expected(), self.actual())
+
+
+if __name__ == '__main__':
+    unittest.main()
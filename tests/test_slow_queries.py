@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from slow_queries import SlowQueryLog
+import metrics
+
+
+class SlowQueryLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="foosball-test-")
+        self.path = os.path.join(self.directory, "FB.db")
+        self.log_path = os.path.join(self.directory, "slow_queries.log")
+        # every statement is slow
+        self.slow_query_log = metrics.slow_query_log
+        metrics.slow_query_log = SlowQueryLog(self.log_path, threshold=0)
+
+        self.con = sqlite3.connect(self.path, factory=metrics.MetricsConnection)
+        self.con.execute("CREATE TABLE goals (goal_id INTEGER PRIMARY KEY, side TEXT)")
+        self.con.commit()
+
+    def tearDown(self):
+        metrics.slow_query_log = self.slow_query_log
+        self.con.close()
+        shutil.rmtree(self.directory)
+
+    def entries(self):
+        with open(self.log_path) as log:
+            return [json.loads(line) for line in log]
+
+    def test_rolled_back_write_stays_rolled_back(self):
+        try:
+            with self.con:
+                self.con.execute("INSERT INTO goals(side) VALUES('left')")
+                self.con.execute("INSERT INTO goals(side) VALUES('right')")
+                raise ValueError("the write fails halfway")
+        except ValueError:
+            pass
+
+        self.assertEqual(0, self.con.execute("SELECT COUNT(*) FROM goals").fetchone()[0])
+        plans = [entry["plan"] for entry in self.entries() if entry["sql"].startswith("INSERT")]
+        self.assertEqual(2, len(plans))
+        self.assertFalse(any(step.startswith("could not explain") for plan in plans for step in plan))
+
+    def test_plan_of_a_query(self):
+        self.con.execute("SELECT side FROM goals WHERE goal_id = ?", (1, )).fetchall()
+        select, = [entry for entry in self.entries() if entry["sql"].startswith("SELECT side")]
+        self.assertTrue(select["plan"][0].strip().startswith("SEARCH"))
+
+
+if __name__ == '__main__':
+    unittest.main()
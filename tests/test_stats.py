@@ -0,0 +1,98 @@
+import unittest
+
+from tests.support import DatabaseTestCase, timestamp_ago
+import db_access
+
+
+# games between the teams of setUp, none with a player on both sides
+SCHEDULE = [(0, 1), (2, 3), (4, 5), (1, 2), (3, 5), (0, 4), (5, 0), (1, 3), (2, 0), (4, 5), (3, 1), (0, 2)]
+
+
+def _values(stats):
+    return stats.wins, stats.draws, stats.losses, stats.goals_pro, stats.goals_against, stats.elo_rating, stats.timestamp
+
+
+class IncrementalStatsTest(DatabaseTestCase):
+    """
+        Stats kept up to date game by game against the ones of replaying every game
+    """
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        players = self.players("a", "b", "c", "d", "e", "f")
+        pairs = [(0, 1), (2, 3), (4, 5), (1, 0), (3, 4), (5, 2)]
+        self.game_teams = [self.db.create_team(defense_player=players[i], attack_player=players[j]) for i, j in pairs]
+        # their first stats at the start of the league, before the games played in the past below
+        self.db.recalculate_stats()
+        # seven hours apart, so about three games a day
+        self.games = [self.play(self.game_teams[left], self.game_teams[right], 5, n % 5, seconds_ago=7 * 3600 * (12 - n))
+                      for n, (left, right) in enumerate(SCHEDULE)]
+
+    def snapshot(self, history=True):
+        """
+            The current stats of every player, position and team, their history of games and the leaderboards
+        """
+        entities = []
+        for player in self.db.get_all_players():
+            entities += [(dict(player_id=player.player_id), player.player_stats),
+                         (dict(attack_player_id=player.player_id), player.attack_stats),
+                         (dict(defense_player_id=player.player_id), player.defense_stats)]
+        entities += [(dict(team_id=team.team_id), team.team_stats) for team in self.db.get_all_teams()]
+
+        snapshot = {}
+        for entity, stats in entities:
+            key = entity.items()[0]
+            snapshot[key] = _values(stats)
+            if history:
+                snapshot[key, "history"] = sorted(_values(stats) for stats in self.db.get_all_stats(**entity))
+        for board, _ in db_access.RANKING_QUERIES:
+            snapshot[board] = [(ranking.position, ranking.entity.team_id if board == db_access.TEAM_RANKING else ranking.entity.player_id)
+                               for ranking in self.db.get_rankings(board)]
+        return snapshot
+
+    def assertSameAsFullReplay(self, history=True):
+        incremental = self.snapshot(history)
+        self.db.recalculate_stats()
+        self.assertEqual(self.snapshot(history), incremental)
+
+    def test_ending_games_one_by_one(self):
+        self.assertSameAsFullReplay()
+
+    def test_adding_the_stats_of_an_ended_game(self):
+        left_team, right_team = self.game_teams[0], self.game_teams[2]
+        game = self.db.create_update_game(timestamp=timestamp_ago(60), left_team=left_team, right_team=right_team,
+                                          left_score=3, right_score=5, ended=1)
+        self.db.add_stats_game(game)
+        self.assertSameAsFullReplay()
+
+    def test_deleting_a_game(self):
+        self.db.delete_game_by_timestamp(self.games[4].timestamp)
+        self.assertSameAsFullReplay()
+
+    def test_compacting_the_history(self):
+        before_timestamp = self.games[8].timestamp
+        current = self.snapshot(history=False)
+        self.assertTrue(self.db.compact_stats_history(before_timestamp))
+        self.assertEqual(current, self.snapshot(history=False))
+
+        cur = self.db.con.cursor()
+        cur.execute("""SELECT COUNT(*) FROM stats WHERE timestamp < :before_timestamp
+                       GROUP BY player_id, attack_player_id, defense_player_id, team_id, substr(timestamp, 1, 10)""",
+                    dict(before_timestamp=before_timestamp))
+        self.assertEqual(set([1]), set(count for count, in cur.fetchall()))
+
+    def test_deleting_a_game_of_the_compacted_history(self):
+        self.db.compact_stats_history(self.games[8].timestamp)
+        self.db.delete_game_by_timestamp(self.games[5].timestamp)
+        # the full replay has the whole history back, the current stats have to be the same
+        self.assertSameAsFullReplay(history=False)
+
+    def test_editing_a_game(self):
+        game = self.games[6]
+        self.db.create_update_game(timestamp=game.timestamp, left_team=game.left_team, right_team=game.right_team,
+                                   left_score=2, right_score=5, ended=1)
+        self.assertSameAsFullReplay()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from flask import Flask
+
+from db_access import DBAccess
+from db_pool import ConnectionPool
+from tests.support import DatabaseTestCase
+from view_cache import ViewCache
+import config
+import metrics
+
+
+class ViewCacheTest(DatabaseTestCase):
+
+    def setUp(self):
+        # count the statements of every connection
+        self.connection_factory = ConnectionPool.connection_factory
+        ConnectionPool.connection_factory = metrics.MetricsConnection
+        DatabaseTestCase.setUp(self)
+
+        self.renders = 0
+        self.view_cache = ViewCache(get_version=lambda: self.db.change_version)
+        app = Flask(__name__)
+
+        @app.before_request
+        def begin_request():
+            self.db.begin_request()
+
+        @app.teardown_request
+        def end_request(exception=None):
+            self.db.end_request()
+
+        @app.route('/players')
+        @self.view_cache.cached()
+        def players():
+            self.renders += 1
+            return ", ".join(player.name for player in self.db.get_visible_players())
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        DatabaseTestCase.tearDown(self)
+        ConnectionPool.connection_factory = self.connection_factory
+
+    def get(self, etag=None):
+        return self.client.get('/players', headers={'If-None-Match': '"{}"'.format(etag)} if etag else {})
+
+    def test_not_modified_without_reading_the_database(self):
+        self.players("a")
+        etag = self.get().get_etag()[0]
+
+        statements = metrics.SQL_STATEMENTS.value()
+        response = self.get(etag)
+
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.get_etag()[0])
+        self.assertEqual(statements, metrics.SQL_STATEMENTS.value())
+
+    def test_cached_body_until_a_write(self):
+        self.players("a")
+        first = self.get()
+        self.assertEqual("a", first.get_data())
+        self.assertEqual("a", self.get().get_data())
+        self.assertEqual(1, self.renders)
+
+        self.players("b")
+        response = self.get(first.get_etag()[0])
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("a, b", response.get_data())
+        self.assertNotEqual(first.get_etag()[0], response.get_etag()[0])
+        self.assertEqual(2, self.renders)
+
+    def test_shared_database_follows_the_writes_of_other_processes(self):
+        self.db.shared = True
+        etag = self.get().get_etag()[0]
+
+        other = DBAccess(database=self.path)
+        other.create_player(name="a", photo="/static/" + config.DEFAULT_IMAGE)
+        other.close()
+
+        response = self.get(etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("a", response.get_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
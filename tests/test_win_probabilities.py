@@ -0,0 +1,53 @@
+import unittest
+
+from tests.support import DatabaseTestCase
+from win_probabilities import WinProbabilities
+import elo
+import stats_replay
+
+
+class WinProbabilitiesTest(DatabaseTestCase):
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.left_team, self.right_team = self.teams("a", "b", "c", "d")
+        self.play(self.left_team, self.right_team, 5, 2)
+        self.win_probabilities = WinProbabilities(self.db)
+
+    def test_teams_read_the_matrix(self):
+        for ladder in stats_replay.LADDERS:
+            self.assertEqual(self.win_probabilities.expectancy(ladder, self.left_team.team_id, self.right_team.team_id),
+                             self.win_probabilities.pairing_expectancy(ladder, self.left_team.pair, self.right_team.pair))
+
+    def test_unseen_pair_is_rated_from_its_players(self):
+        a, c, d = [self.db.get_player_by_name(name) for name in "acd"]
+        e, = self.players("e")
+        left, right = (a.player_id, c.player_id), (e.player_id, d.player_id)
+
+        player = elo.wining_expectancy(a.player_stats.elo_rating + c.player_stats.elo_rating
+                                       - elo.INITIAL_RATING - d.player_stats.elo_rating)
+        position = elo.wining_expectancy(a.defense_stats.elo_rating + c.attack_stats.elo_rating
+                                         - elo.INITIAL_RATING - d.attack_stats.elo_rating)
+        self.assertNotEqual(0.5, player)
+        self.assertAlmostEqual(player, self.win_probabilities.pairing_expectancy(stats_replay.INDIVIDUAL_LADDER, left, right))
+        self.assertAlmostEqual(position, self.win_probabilities.pairing_expectancy(stats_replay.POSITION_LADDER, left, right))
+        self.assertAlmostEqual(position, self.win_probabilities.pairing_expectancy(stats_replay.TEAM_LADDER, left, right))
+
+    def test_pair_of_new_players_is_even(self):
+        e, f, g, h = self.players("e", "f", "g", "h")
+        self.assertEqual(0.5, self.win_probabilities.pairing_expectancy(stats_replay.TEAM_LADDER, (e.player_id, f.player_id),
+                                                                        (g.player_id, h.player_id)))
+
+    def test_ratings_follow_new_games(self):
+        a, c, d = [self.db.get_player_by_name(name) for name in "acd"]
+        e, = self.players("e")
+        left, right = (a.player_id, c.player_id), (e.player_id, d.player_id)
+        before = self.win_probabilities.pairing_expectancy(stats_replay.INDIVIDUAL_LADDER, left, right)
+
+        self.play(self.left_team, self.right_team, 5, 0, seconds_ago=1800)
+
+        self.assertGreater(self.win_probabilities.pairing_expectancy(stats_replay.INDIVIDUAL_LADDER, left, right), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,18 @@
 import config
 import datetime
+# strptime imports _strptime on first use, which fails when threads get there at once (Python issue 7980)
+import _strptime
 
 
 def get_timestamp_for_now():
     return datetime.datetime.now().strftime(config.TIMESTAMP_FORMAT)
 
 
+def get_timestamp_after(timestamp, seconds):
+    then = datetime.datetime.strptime(timestamp, config.TIMESTAMP_FORMAT)
+    return (then + datetime.timedelta(seconds=seconds)).strftime(config.TIMESTAMP_FORMAT)
+
+
 def get_seconds_from_timestamp(timestamp):
     now = datetime.datetime.now()
     then = datetime.datetime.strptime(timestamp, config.TIMESTAMP_FORMAT)
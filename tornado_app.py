@@ -0,0 +1,171 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.web import Application, RequestHandler, HTTPError
+from tornado.wsgi import WSGIContainer
+
+from live import LiveScoreHandler, ChangePoller
+import config
+import metrics
+
+
+class BaseHandler(RequestHandler):
+
+    def compute_etag(self):
+        # the read views send their own data version ETags, hashing every body is not needed
+        return None
+
+    def on_finish(self):
+        metrics.REQUEST_SECONDS.observe(self.request.request_time(), (type(self).__name__,))
+
+
+class GoalHandler(BaseHandler):
+    """
+        Goals from the table sensors, queued without waiting on the database
+    """
+
+    def initialize(self, goals):
+        self.goals = goals
+
+    def post(self, side, value=1, table_id=config.DEFAULT_TABLE_ID):
+        sequence = self.get_argument('sequence', "")
+        self.goals.put(side=side, value=int(value), device=self.get_argument('device', None),
+                       sequence=int(sequence) if sequence.isdigit() else None, table_id=int(table_id))
+        self.write("OK")
+
+
+class GoalQueueHandler(BaseHandler):
+
+    def initialize(self, goals):
+        self.goals = goals
+
+    def get(self):
+        self.write({'depth': self.goals.depth()})
+
+
+class ReadHandler(BaseHandler):
+    """
+        A read only view: a 304 while the data version (and the second) is unchanged, otherwise the database is
+        read on the executor so the IOLoop keeps serving goals and streams meanwhile
+    """
+
+    def initialize(self, db, executor, view_cache):
+        self.db = db
+        self.executor = executor
+        self.view_cache = view_cache
+
+    def not_modified(self):
+        etag = self.view_cache.etag(time_sensitive=True)
+        self.set_header("ETag", '"{}"'.format(etag))
+        self.set_header("Cache-Control", "no-cache")
+
+        if_none_match = self.request.headers.get("If-None-Match", "")
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if '"{}"'.format(etag) in tags or "*" in tags:
+            metrics.VIEW_CACHE.inc(("not_modified",))
+            self.set_status(304)
+            return True
+        return False
+
+
+class IsGameOnHandler(ReadHandler):
+
+    @gen.coroutine
+    def get(self, table_id=config.DEFAULT_TABLE_ID):
+        if self.not_modified():
+            return
+
+        game = yield self.executor.submit(self.db.get_open_game, table_id=int(table_id))
+        self.write("Yes" if game else "No")
+
+
+class GameScoreHandler(ReadHandler):
+
+    @gen.coroutine
+    def get(self, timestamp):
+        if self.not_modified():
+            return
+
+        game = yield self.executor.submit(self.db.get_game_by_timestamp, timestamp)
+        if game is None:
+            raise HTTPError(404)
+
+        self.write({'score': "{} x {}".format(game.left_score, game.right_score),
+                    'time': game.time_left_string(),
+                    'ended': bool(game.ended)})
+
+
+class WSGIHandler(BaseHandler):
+    """
+        The Flask pages, run on their own bounded executor. Unlike FallbackHandler with a WSGIContainer this
+        doesn't block the IOLoop while a page renders.
+    """
+
+    def initialize(self, wsgi_application, executor):
+        self.wsgi_application = wsgi_application
+        self.executor = executor
+
+    def on_finish(self):
+        # the Flask app times its own requests, by endpoint
+        pass
+
+    def _call_application(self, environ):
+        data = {}
+        response = []
+
+        def start_response(status, response_headers, exc_info=None):
+            data["status"] = status
+            data["headers"] = response_headers
+            return response.append
+
+        app_response = self.wsgi_application(environ, start_response)
+        try:
+            response.extend(app_response)
+        finally:
+            if hasattr(app_response, "close"):
+                app_response.close()
+        return data["status"], data["headers"], b"".join(response)
+
+    @gen.coroutine
+    def prepare(self):
+        status, headers, body = yield self.executor.submit(self._call_application, WSGIContainer.environ(self.request))
+
+        status_code, reason = status.split(' ', 1)
+        self.set_status(int(status_code), reason)
+        self.clear_header("Content-Type")
+        for name, value in headers:
+            if name.lower() == "set-cookie":
+                self.add_header(name, value)
+            else:
+                self.set_header(name, value)
+        if body and self.request.method != "HEAD":
+            self.write(body)
+        self.finish()
+
+
+def make_application(wsgi_application, db, goals, live_scores, view_cache, db_workers=4, page_workers=8, poll_changes=False):
+    """
+        The sensor, score and stream endpoints served natively on the IOLoop, everything else by Flask.
+        Database reads and pages get separate thread pools so a burst of page views can't hold up the table.
+        Worker processes sharing the database poll_changes to stream the goals written by the others.
+    """
+    db_executor = ThreadPoolExecutor(max_workers=db_workers)
+    page_executor = ThreadPoolExecutor(max_workers=page_workers)
+    read_args = dict(db=db, executor=db_executor, view_cache=view_cache)
+
+    if poll_changes:
+        ChangePoller(live_scores, get_version=lambda: db.data_version, load_game=db.get_game_by_timestamp,
+                     executor=db_executor).start()
+
+    return Application([
+        (r"/goal/queue", GoalQueueHandler, dict(goals=goals)),
+        (r"/goal/([^/]+)", GoalHandler, dict(goals=goals)),
+        (r"/goal/([^/]+)/([^/]+)", GoalHandler, dict(goals=goals)),
+        (r"/tables/(?P<table_id>\d+)/goal/(?P<side>[^/]+)", GoalHandler, dict(goals=goals)),
+        (r"/tables/(?P<table_id>\d+)/goal/(?P<side>[^/]+)/(?P<value>[^/]+)", GoalHandler, dict(goals=goals)),
+        (r"/is_game_on", IsGameOnHandler, read_args),
+        (r"/tables/(?P<table_id>\d+)/is_game_on", IsGameOnHandler, read_args),
+        (r"/games/ajax/([^/]+)", GameScoreHandler, read_args),
+        (r"/games/stream/([^/]+)", LiveScoreHandler, dict(live_scores=live_scores, load_game=db.get_game_by_timestamp, executor=db_executor)),
+        (r".*", WSGIHandler, dict(wsgi_application=wsgi_application, executor=page_executor)),
+    ])
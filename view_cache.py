@@ -0,0 +1,75 @@
+import functools
+import threading
+import time
+
+from flask import Response, request, make_response
+
+import metrics
+
+
+class ViewCache:
+    """
+        Conditional GET and an in-process cache of rendered pages for read only views. Both are keyed on the version
+        given by get_version, so a 304 or a cached body is served without reading any data until something is written.
+    """
+
+    def __init__(self, get_version, max_entries=500):
+        self.get_version = get_version
+        self.max_entries = max_entries
+
+        # versions start over with the process, this keeps ETags of an older process from matching
+        self._process = "{:x}".format(int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def etag(self, time_sensitive=False):
+        etag = "{}-{}".format(self._process, self.get_version())
+        if time_sensitive:
+            # the page shows the time left, it changes every second on its own
+            etag += "-{}".format(int(time.time()))
+        return etag
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def cached(self, time_sensitive=False):
+        """
+            Decorate a view (below @app.route) to answer GETs with an ETag, 304s and cached bodies
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def cached_view(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                etag = self.etag(time_sensitive=time_sensitive)
+                if request.if_none_match.contains(etag):
+                    metrics.VIEW_CACHE.inc(("not_modified",))
+                    response = Response(status=304)
+                else:
+                    key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))), etag)
+                    with self._lock:
+                        entry = self._entries.get(key)
+
+                    if entry is None:
+                        metrics.VIEW_CACHE.inc(("miss",))
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200 or response.is_streamed:
+                            return response
+                        entry = (response.get_data(), response.mimetype)
+                        with self._lock:
+                            if len(self._entries) >= self.max_entries:
+                                # most entries are of older versions by now
+                                self._entries.clear()
+                            self._entries[key] = entry
+                    else:
+                        metrics.VIEW_CACHE.inc(("hit",))
+
+                    response = Response(entry[0], mimetype=entry[1])
+
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+            return cached_view
+        return decorator
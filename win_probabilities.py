@@ -0,0 +1,148 @@
+"""
+    Win expectancies of each team against every other team, on the three rating ladders.
+
+    A team is a pair of players, so its individual and position ratings are those of its two players together: the
+    sum of their ratings, and the defense rating of the defender plus the attack rating of the attacker. A row of the
+    matrix, one team against all the others, is computed in a single batch the first time it is asked for and then
+    kept, up to config.WIN_PROBABILITY_ROWS of them. When games change ratings only the teams they touched are read
+    again, and only their values in the kept rows are computed again.
+
+    Two players who never played together are not a team yet: such pairs are rated from the ratings of their players,
+    and on the team ladder, where they have no rating, the position ratings of both sides stand in.
+"""
+import collections
+import threading
+
+import config
+import elo
+import stats_replay
+
+
+# the ratings of DBAccess.get_side_ratings rows, after the team_id
+_LADDER_COLUMNS = ((stats_replay.TEAM_LADDER, 1), (stats_replay.INDIVIDUAL_LADDER, 2), (stats_replay.POSITION_LADDER, 3))
+
+# DBAccess.get_player_ratings of a player without ratings
+_UNRATED = (elo.INITIAL_RATING, elo.INITIAL_RATING, elo.INITIAL_RATING)
+
+
+class WinProbabilities:
+
+    def __init__(self, db, max_rows=config.WIN_PROBABILITY_ROWS):
+        self.db = db
+        self.max_rows = max_rows
+
+        self._lock = threading.Lock()
+        # DBAccess.ratings_version of the ratings below, None until they are first loaded
+        self._version = None
+        self._team_ids = []
+        self._index = {}
+        self._ratings = dict((ladder, []) for ladder, _ in _LADDER_COLUMNS)
+        # (defense_player_id, attack_player_id): team_id
+        self._pairs = {}
+        # player_id: (player rating, attack rating, defense rating)
+        self._players = {}
+        # (ladder, team_id): expectancies of the team against each of _team_ids, least recently used first
+        self._rows = collections.OrderedDict()
+
+    def expectancy(self, ladder, left_team_id, right_team_id):
+        """
+            Win expectancy of the left team against the right team on a ladder; KeyError for an unknown team
+        """
+        with self._lock:
+            self._refresh()
+            return float(self._row(ladder, left_team_id)[self._index[right_team_id]])
+
+    def pairing_expectancy(self, ladder, left_pair, right_pair):
+        """
+            Win expectancy of the left (defense_player_id, attack_player_id) pair against the right one on a ladder,
+            whether or not the pairs are teams yet
+        """
+        with self._lock:
+            self._refresh()
+            left_team_id = self._pairs.get(tuple(left_pair))
+            right_team_id = self._pairs.get(tuple(right_pair))
+            if left_team_id is not None and right_team_id is not None:
+                return float(self._row(ladder, left_team_id)[self._index[right_team_id]])
+
+            if ladder == stats_replay.TEAM_LADDER:
+                ladder = stats_replay.POSITION_LADDER
+            return elo.wining_expectancy(self._pair_rating(ladder, left_pair) - self._pair_rating(ladder, right_pair))
+
+    def against_all(self, ladder, team_id):
+        """
+            {other team_id: win expectancy of the team against it} for every team, the team itself included
+        """
+        with self._lock:
+            self._refresh()
+            return dict(zip(self._team_ids, [float(value) for value in self._row(ladder, team_id)]))
+
+    def _refresh(self):
+        version = self.db.ratings_version
+        if self._version is None or version[0] != self._version[0]:
+            self._players = self.db.get_player_ratings()
+            self._load(self.db.get_side_ratings())
+        elif version[1] != self._version[1]:
+            self._players.update(self.db.get_player_ratings(since_stats_id=self._version[1]))
+            self._update(self.db.get_side_ratings(since_stats_id=self._version[1]))
+        self._version = version
+
+    def _pair_rating(self, ladder, pair):
+        defense = self._players.get(pair[0], _UNRATED)
+        attack = self._players.get(pair[1], _UNRATED)
+        if ladder == stats_replay.INDIVIDUAL_LADDER:
+            return defense[0] + attack[0]
+        return defense[2] + attack[1]
+
+    def _load(self, side_ratings):
+        self._team_ids = [row[0] for row in side_ratings]
+        self._index = dict((team_id, index) for index, team_id in enumerate(self._team_ids))
+        self._pairs = dict(((row[4], row[5]), row[0]) for row in side_ratings)
+        for ladder, column in _LADDER_COLUMNS:
+            self._ratings[ladder] = [row[column] for row in side_ratings]
+        self._rows.clear()
+
+    def _update(self, side_ratings):
+        changed = dict((ladder, []) for ladder, _ in _LADDER_COLUMNS)
+        added = False
+        for row in side_ratings:
+            index = self._index.get(row[0])
+            if index is None:
+                self._index[row[0]] = len(self._team_ids)
+                self._team_ids.append(row[0])
+                self._pairs[row[4], row[5]] = row[0]
+                for ladder, column in _LADDER_COLUMNS:
+                    self._ratings[ladder].append(row[column])
+                added = True
+                continue
+
+            for ladder, column in _LADDER_COLUMNS:
+                if self._ratings[ladder][index] != row[column]:
+                    self._ratings[ladder][index] = row[column]
+                    changed[ladder].append(index)
+
+        if added:
+            # the kept rows are one value short
+            self._rows.clear()
+            return
+
+        for (ladder, team_id), values in list(self._rows.items()):
+            index = self._index[team_id]
+            ratings = self._ratings[ladder]
+            if index in changed[ladder]:
+                del self._rows[ladder, team_id]
+                continue
+            for other in changed[ladder]:
+                values[other] = elo.wining_expectancy(ratings[index] - ratings[other])
+
+    def _row(self, ladder, team_id):
+        key = ladder, team_id
+        values = self._rows.pop(key, None)
+        if values is None:
+            ratings = self._ratings[ladder]
+            rating = ratings[self._index[team_id]]
+            values = elo.wining_expectancies([rating - other for other in ratings])
+
+        self._rows[key] = values
+        while len(self._rows) > self.max_rows:
+            self._rows.popitem(last=False)
+        return values